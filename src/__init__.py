@@ -1,6 +1,7 @@
 import string
 import os
 import re
+import multiprocessing
 from PyQt5.QtWidgets import QMessageBox, QFileDialog, QDialog, \
     QHBoxLayout, QLabel, QComboBox, QDialogButtonBox, QVBoxLayout, \
     QApplication, QCheckBox
@@ -50,42 +51,39 @@ class StartDialog(QDialog):
         self.vol_select_dropdown.clear()
         self.vol_select_dropdown.addItems(vols)
 
-app = QApplication([])
-disk_select = StartDialog()
-disk_select.setWindowTitle('recoverability')
-file_select = ChooseSourceFileDialog()
+if __name__ == '__main__':
+    # the sharded scan's worker processes re-import this module; only the parent runs the GUI
+    multiprocessing.freeze_support()
 
-while True:
-    disk_select.exec()
-    selected_vol = disk_select.vol_select_dropdown.currentText()
-    if len(selected_vol) is 2:
-        selected_vol = selected_vol[0]
-    elif 'PhysicalDrive' in selected_vol:
-        selected_vol = re.search(r'\d+', selected_vol).group()
-    else:
-        raise Exception('Something went wrong.')    
-    file_select.exec()
-    path = file_select.selectedFiles()[0]
-    if os.stat(path).st_size > 100000000:
-        error = QMessageBox()
-        error.setWindowTitle('recoverability')
-        error.setIcon(QMessageBox.Warning)
-        error.setText('Please select a file under 100 MB. Searching for large files is not yet implemented.')
-        error.setStandardButtons(QMessageBox.Ok)
-        error.exec()
-    elif path.split(":")[0] == selected_vol:
-        error = QMessageBox()
-        error.setWindowTitle('recoverability')
-        error.setIcon(QMessageBox.Warning)
-        error.setText('Your source file cannot be loaded from the same volume you are searching, because the rebuilt file will be created in the same directory.\n\nPlease choose a different source file or volume to search.')
-        error.setStandardButtons(QMessageBox.Ok)
-        error.exec()
-    else:
-        break
+    app = QApplication([])
+    disk_select = StartDialog()
+    disk_select.setWindowTitle('recoverability')
+    file_select = ChooseSourceFileDialog()
 
-window = gui.MainWindow(selected_vol, path)
-window.setWindowTitle('recoverability')
-window.setGeometry(500, 500, 500, 600)
-window.show()
+    while True:
+        disk_select.exec()
+        selected_vol = disk_select.vol_select_dropdown.currentText()
+        if len(selected_vol) is 2:
+            selected_vol = selected_vol[0]
+        elif 'PhysicalDrive' in selected_vol:
+            selected_vol = re.search(r'\d+', selected_vol).group()
+        else:
+            raise Exception('Something went wrong.')    
+        file_select.exec()
+        path = file_select.selectedFiles()[0]
+        if path.split(":")[0] == selected_vol:
+            error = QMessageBox()
+            error.setWindowTitle('recoverability')
+            error.setIcon(QMessageBox.Warning)
+            error.setText('Your source file cannot be loaded from the same volume you are searching, because the rebuilt file will be created in the same directory.\n\nPlease choose a different source file or volume to search.')
+            error.setStandardButtons(QMessageBox.Ok)
+            error.exec()
+        else:
+            break
+
+    window = gui.MainWindow(selected_vol, path)
+    window.setWindowTitle('recoverability')
+    window.setGeometry(500, 500, 500, 600)
+    window.show()
 
-app.exec_()
\ No newline at end of file
+    app.exec_()
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""Reading failing drives, in the manner of ddrescue.
+
+A read that fails, or takes longer than the read timeout, doesn't stop the
+reader: its range is entered in the job's bad-block map and read as zeroes,
+which the job never matches, since they aren't what is on the disk. Failures
+come in clusters, so a reader that hits one doesn't try the bytes right after it
+either: it skips ahead, twice as far after each further failure, back to nothing
+after a read succeeds, and the map records what was skipped. Ranges another
+reader already found bad aren't read again.
+
+The search reads and checks everything else first. Only if it ends without
+finding every file are the failed and skipped ranges read once more, unit by
+unit where a block still fails, so that a few hundred unreadable sectors cost
+some seconds at the end rather than hours in the middle, or the job.
+
+A read that doesn't return can't be interrupted: it is left to a daemon thread
+of its own, and the reader goes on with a freshly opened volume. Timeouts thus
+work with every backend, but a read error in a mapping ends the process, so use
+the file backend on failing drives.
+"""
+import json
+from queue import SimpleQueue
+from threading import Event, Lock, Thread
+
+from checkpoint import atomic_write
+from ranges import RangeSet
+
+MAP_NAME = 'bad blocks.json'
+# bytes skipped after a first failure, doubled after each further one up to MAX_SKIP
+DEFAULT_SKIP_SIZE = 64 * 1024
+MAX_SKIP = 1024 * 1024 * 1024
+# times the bad blocks are read again before the job gives up
+DEFAULT_RETRIES = 1
+
+
+class BadBlocks():
+    """The bad-block map of a volume: the ranges whose reads failed, and those skipped after failures."""
+
+    def __init__(self):
+        self.failed = RangeSet()
+        self.skipped = RangeSet()
+        self.errors = 0     # failed reads, timeouts included
+        self.timeouts = 0
+        self.lock = Lock()
+
+    def fail(self, start, end, timed_out=False):
+        self.failed.add(start, end)
+        self.skipped.remove(start, end)
+        with self.lock:
+            self.errors += 1
+            self.timeouts += timed_out
+
+    def skip(self, start, end):
+        for gap_start, gap_end in self.failed.gaps(start, end):
+            self.skipped.add(gap_start, gap_end)
+
+    def intersection(self, start, end):
+        """Return the parts of [start, end) that failed or were skipped, and so were read as zeroes, as a sorted
+        list of [start, end] pairs."""
+        if not self:
+            return []
+        return RangeSet(self.failed.intersection(start, end) + self.skipped.intersection(start, end)).as_list()
+
+    def pending(self):
+        """Return the failed and skipped ranges, merged, as a list of (start, end) pairs."""
+        ranges = RangeSet(self.failed.as_list() + self.skipped.as_list())
+        return [tuple(r) for r in ranges.as_list()]
+
+    def clear(self, start, end):
+        """Forget [start, end), before it is read again."""
+        self.failed.remove(start, end)
+        self.skipped.remove(start, end)
+
+    def update(self, state):
+        """Add the ranges and counts of state, a dict from as_dict()."""
+        for start, end in state['failed']:
+            self.failed.add(start, end)
+        for start, end in state['skipped']:
+            self.skip(start, end)
+        with self.lock:
+            self.errors += state['errors']
+            self.timeouts += state['timeouts']
+
+    def __bool__(self):
+        return bool(len(self.failed) or len(self.skipped))
+
+    def as_dict(self):
+        return {'failed': self.failed.as_list(), 'skipped': self.skipped.as_list(), 'errors': self.errors,
+                'timeouts': self.timeouts, 'failed_bytes': self.failed.total(),
+                'skipped_bytes': self.skipped.total()}
+
+    def write(self, path):
+        atomic_write(path, json.dumps(self.as_dict()).encode())
+
+
+class Reply():
+    def __init__(self):
+        self.done = Event()
+        self.data = None
+        self.error = None
+
+
+class TimedReads():
+    """Performs the reads of volume on a daemon thread, so that a read that doesn't return can be given up on.
+
+    Once given up on, the thread closes volume (unless it is shared) after that read returns, if ever.
+    """
+
+    def __init__(self, volume):
+        self.volume = volume
+        self.requests = SimpleQueue()
+        Thread(target=self._loop, name='Timed reads', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            offset, size, reply = request
+            try:
+                reply.data = self.volume.read(offset, size)
+            except Exception as e:
+                reply.error = e
+            reply.done.set()
+        if not self.volume.shared:
+            self.volume.close()
+
+    def read(self, offset, size, timeout):
+        reply = Reply()
+        self.requests.put((offset, size, reply))
+        if not reply.done.wait(timeout):
+            raise TimeoutError('no data at ' + hex(offset) + ' after ' + str(timeout) + ' s')
+        if reply.error is not None:
+            raise reply.error
+        return reply.data
+
+    def close(self):
+        self.requests.put(None)
+
+
+class TolerantVolume():
+    """Wraps a volume of vol_size bytes so that failed reads are recorded in bad_blocks and read as zeroes.
+
+    Args:
+        volume: the volume to read.
+        bad_blocks (BadBlocks): the map shared by every reader of the job.
+        vol_size (int): size of the volume, so that reads past its end still come back short.
+        reopen (callable): returns a fresh volume to go on with when a read times out.
+        timeout (float): seconds before a read is given up on; None to wait for every read.
+        trim (bool): instead of skipping ahead after a failure, read the halves of the failed block, and
+            so on down to single units, so that only the units that fail are lost. Used to retry bad blocks.
+        unit (int): size of those units.
+        skip_size (int): bytes skipped after a first failure.
+    """
+
+    def __init__(self, volume, bad_blocks, vol_size, reopen=None, timeout=None, trim=False, unit=512,
+                 skip_size=DEFAULT_SKIP_SIZE):
+        self.volume = volume
+        self.bad_blocks = bad_blocks
+        self.vol_size = vol_size
+        self.reopen = reopen
+        self.timeout = timeout
+        self.trim = trim
+        self.unit = unit
+        self.skip_size = skip_size
+        self.timed = None
+        self.skip = 0           # bytes to skip after the next failure; 0 after a success
+        self.skipping = (0, 0)  # the range skipped after the latest failure
+
+    # the volume it wraps may be the job's, but every wrapper is closed by whoever opened it
+    shared = False
+
+    def read(self, offset, size):
+        end = min(offset + size, self.vol_size)
+        if end <= offset:
+            return self.volume.read(offset, size)
+        pieces = []
+        if self.skipping[0] <= offset < self.skipping[1]:
+            # only the rest of the skipped range is given up on; what lies after it is read as usual
+            skipped = min(end, self.skipping[1])
+            self.bad_blocks.skip(offset, skipped)
+            pieces.append(bytes(skipped - offset))
+            offset = skipped
+        known = self.bad_blocks.failed.intersection(offset, end)
+        if not known and not pieces:
+            return self.attempt(offset, end)
+        # read around what another reader found bad
+        for start, stop in known:
+            if start > offset:
+                pieces.append(self.attempt(offset, start))
+            pieces.append(bytes(stop - start))
+            offset = stop
+        if offset < end:
+            pieces.append(self.attempt(offset, end))
+        return memoryview(b''.join(pieces))
+
+    def attempt(self, start, end):
+        try:
+            data = self.read_timed(start, end - start)
+        except OSError as e:
+            timed_out = isinstance(e, TimeoutError)
+            if self.trim and end - start > self.unit:
+                # halve the block until the units that fail are isolated
+                middle = start + max(self.unit, (end - start) // 2 // self.unit * self.unit)
+                return memoryview(b''.join((self.attempt(start, middle), self.attempt(middle, end))))
+            self.bad_blocks.fail(start, end, timed_out)
+            if not self.trim:
+                self.skip = min(MAX_SKIP, self.skip * 2 if self.skip else self.skip_size)
+                self.skipping = (end, end + self.skip)
+            return memoryview(bytes(end - start))
+        self.skip = 0
+        return data
+
+    def read_timed(self, offset, size):
+        if self.timeout is None:
+            return self.volume.read(offset, size)
+        if self.timed is None:
+            self.timed = TimedReads(self.volume)
+        try:
+            return self.timed.read(offset, size, self.timeout)
+        except TimeoutError:
+            # the read still holds the volume; leave both to the thread and go on with a fresh one
+            self.timed.close()
+            self.timed = None
+            if self.reopen is not None and not self.volume.shared:
+                self.volume = self.reopen()
+            raise
+
+    def close(self):
+        if self.timed is not None:
+            # the thread closes the volume once it is done with it
+            self.timed.close()
+            self.timed = None
+        elif not self.volume.shared:
+            self.volume.close()
@@ -0,0 +1,385 @@
+"""Reproducible benchmark of the search engine on synthetic disk images.
+
+Each layout generates, from a seed, a source file and a disk image that holds it
+in a known arrangement of fragments, then runs a job against the image and
+records the bytes read, the wall time, the time to the first match, the time to
+the full reconstruction and whether the output equals the source. The same seed
+always gives the same images, so results of different versions can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --baseline before.json
+
+Results are written as JSON, one object per run plus the median of each layout
+over its repeats. Progress is written to stdout as JSON lines. A run that doesn't
+rebuild the file, or is stopped after --timeout seconds, is reported as such, and
+each layout's summary counts the runs that did.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from recoverability import Job, SourceFile, SECTOR_SIZE
+from sources import UNMATCHED
+from pacing import Pacer
+from reads import BACKENDS, DEFAULT_BLOCK_SIZE
+
+# 2: fragments lie close together; runs report whether they were reconstructed
+VERSION = 2
+DEFAULT_SEED = 1
+DEFAULT_IMAGE_SIZE = 32 * 1024 * 1024
+DEFAULT_SOURCE_SIZE = 1024 * 1024
+# a median this much worse than the baseline's is reported as a regression
+DEFAULT_TOLERANCE = 0.1
+# ...if it is also this many seconds slower, so that the jitter of short runs isn't
+MIN_SLOWDOWN = 0.05
+# most bits flipped in a rotted unit
+ROT_BITS = 4
+# seconds a run may take before it is given up on
+DEFAULT_TIMEOUT = 600
+
+
+class Layout():
+    """How a layout splits the source into fragments and what lies between them.
+
+    Args:
+        name (str): name of the layout in the results.
+        fragments (int): number of fragments the source is split into.
+        shuffle (bool): whether the fragments lie on the disk out of order.
+        filler (str): what fills the rest of the image: 'random' data, or
+            'interleaved' runs of zeroes, 0xFF and decoys between random data.
+        rot (int): number of the source's units that lie on the disk with up to
+            ROT_BITS bits flipped; only near matching finds them.
+        max_gap (int): most units between consecutive fragments, which then lie
+            together at a random place in the image; None to scatter them across
+            the whole image.
+    """
+
+    def __init__(self, name, fragments, shuffle=False, filler='random', rot=0, max_gap=None):
+        self.name = name
+        self.fragments = fragments
+        self.shuffle = shuffle
+        self.filler = filler
+        self.rot = rot
+        self.max_gap = max_gap
+
+
+# fragments far apart are only found if a probe of the skim, every half a file, lands in one; so fragments lie
+# close enough together for the sweeps around a match to reach the next one, the more so the smaller they are
+LAYOUTS = {layout.name: layout for layout in [
+    Layout('contiguous', 1),
+    Layout('light', 4, max_gap=256),
+    Layout('heavy', 64, shuffle=True, max_gap=16),
+    Layout('interleaved', 16, shuffle=True, filler='interleaved', max_gap=32),
+    Layout('rotted', 1, rot=16),
+]}
+
+
+def make_source(rng, size, unit):
+    """Return size bytes of random content, with some runs of zero and 0xFF units as real files have."""
+    data = bytearray(rng.randbytes(size))
+    units = size // unit
+    for _ in range(max(1, units // 256)):
+        start = rng.randrange(units) * unit
+        length = rng.randint(1, 8) * unit
+        data[start:start + length] = (b'\x00' if rng.random() < 0.5 else b'\xff') * len(data[start:start + length])
+    return bytes(data)
+
+
+def split(rng, count, parts):
+    """Return parts positive lengths that add up to count, cut at random places."""
+    parts = max(1, min(parts, count))
+    cuts = sorted(rng.sample(range(1, count), parts - 1)) if parts > 1 else []
+    return [end - start for start, end in zip([0] + cuts, cuts + [count])]
+
+
+def decoy(rng, source, unit, units):
+    """Return units units that resemble the source without being part of it: a stale copy of some of
+    its units, or a copy with a byte changed in every unit."""
+    start = rng.randrange(max(1, len(source) // unit - units)) * unit
+    data = bytearray(source[start:start + units * unit].ljust(units * unit, b'\x00'))
+    if rng.random() < 0.5:
+        for offset in range(0, len(data), unit):
+            data[offset + rng.randrange(unit)] ^= 0x5a
+    return bytes(data)
+
+
+def rot(rng, data, unit, count):
+    """Flip up to ROT_BITS bits in each of count units of data, a bytearray, chosen among those that aren't one
+    byte repeated. The last unit is left alone, as only its head belongs to the file."""
+    if not count:
+        return
+    units = [n for n in range(len(data) // unit - 1) if data[n * unit:(n + 1) * unit].strip(data[n * unit:n * unit + 1])]
+    for n in rng.sample(units, min(count, len(units))):
+        for bit in rng.sample(range(unit * 8), rng.randint(1, ROT_BITS)):
+            data[n * unit + bit // 8] ^= 1 << bit % 8
+
+
+def fill(rng, image, start, end, unit, layout, source):
+    """Fill image[start:end] according to the layout's filler."""
+    if layout.filler != 'interleaved':
+        image[start:end] = rng.randbytes(end - start)
+        return
+    position = start
+    while position < end:
+        units = min(rng.randint(1, 64), (end - position) // unit)
+        kind = rng.choice(('random', 'zero', 'ff', 'decoy'))
+        if kind == 'zero':
+            data = b'\x00' * (units * unit)
+        elif kind == 'ff':
+            data = b'\xff' * (units * unit)
+        elif kind == 'decoy':
+            data = decoy(rng, source, unit, units)
+        else:
+            data = rng.randbytes(units * unit)
+        image[position:position + len(data)] = data
+        position += len(data)
+
+
+def generate(layout, seed, image_size, source_size, unit, dir_name):
+    """Write the source and the image of layout for seed into dir_name.
+
+    Returns (source path, image path, [(source unit, disk address, units), ...] of the fragments).
+    """
+    rng = random.Random('%s-%d-%d-%d-%d' % (layout.name, seed, image_size, source_size, unit))
+    source = make_source(rng, source_size, unit)
+    units = -(-source_size // unit)
+    free = image_size // unit - units
+    if free < 0:
+        raise ValueError('the source does not fit in the image')
+    lengths = split(rng, units, layout.fragments)
+    order = list(range(len(lengths)))
+    if layout.shuffle:
+        rng.shuffle(order)
+    if layout.max_gap is None:
+        gaps = split(rng, free + len(lengths) + 1, len(lengths) + 1)
+        gaps = [gap - 1 for gap in gaps]
+    else:
+        # the fragments lie close together, somewhere in the image
+        gaps = [rng.randint(0, layout.max_gap) for _ in range(len(lengths) - 1)]
+        if sum(gaps) > free:
+            raise ValueError('the fragments do not fit in the image')
+        gaps.insert(0, rng.randint(0, free - sum(gaps)))
+
+    starts = [sum(lengths[:n]) for n in range(len(lengths))]
+    padded = bytearray(source.ljust(units * unit, b'\x00'))
+    rot(rng, padded, unit, layout.rot)
+    image = bytearray(image_size)
+    fragments = []
+    position = 0
+    for gap, n in zip(gaps, order):
+        fill(rng, image, position * unit, (position + gap) * unit, unit, layout, source)
+        position += gap
+        image[position * unit:(position + lengths[n]) * unit] = padded[starts[n] * unit:(starts[n] + lengths[n]) * unit]
+        fragments.append((starts[n], position * unit, lengths[n]))
+        position += lengths[n]
+    fill(rng, image, position * unit, image_size, unit, layout, source)
+
+    stem = '%s-%d' % (layout.name, seed)
+    source_path = os.path.join(dir_name, stem + '.src')
+    image_path = os.path.join(dir_name, stem + '.img')
+    with open(source_path, 'wb') as f:
+        f.write(source)
+    with open(image_path, 'wb') as f:
+        f.write(image)
+    return source_path, image_path, sorted(fragments)
+
+
+def compare(output_path, source_path, unit):
+    """Return the number of units in which the output differs from the source, or None if there is no output."""
+    if not output_path or not os.path.exists(output_path):
+        return None
+    with open(output_path, 'rb') as f:
+        output = f.read()
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    length = max(len(output), len(source))
+    return sum(output[offset:offset + unit] != source[offset:offset + unit] for offset in range(0, length, unit))
+
+
+def run(image_path, source_path, dir_name, options, unit, rotted=0, timeout=DEFAULT_TIMEOUT):
+    """Run a job for source_path on image_path, which holds rotted units of it, and return its measurements.
+    A job still running after timeout seconds is stopped and reported as timed out."""
+    times = {}
+    first = times.setdefault     # only the first emission counts
+
+    job = Job(image_path, os.path.getsize(image_path), [SourceFile(source_path, sector_size=unit)], 0,
+              dir_name=dir_name, pacer=Pacer.unthrottled(), sector_size=unit, **options)
+    job.success_signal.connect(lambda data: first('first_match', time.perf_counter()))
+    job.extent_signal.connect(lambda data: first('first_match', time.perf_counter()))
+    job.finished_signal.connect(lambda data: first('finished', time.perf_counter()))
+    started = time.perf_counter()
+    job.start()
+    timed_out = not job.wait(timeout)
+    if timed_out:
+        job.fail()
+    wall = time.perf_counter() - started
+    job.join(5)
+
+    file = job.files[0]
+    success = file.finished
+    mismatched = compare(file.rebuilt_file_path if success else None, source_path, unit)
+    image_size = job.vol_size
+    recovered = sum(address != UNMATCHED for address in file.address_table)  # auto-filled units included
+    bytes_read = job.telemetry.bytes_read.value
+    return {
+        'success': success,
+        'timed_out': timed_out,
+        'correct': mismatched == rotted,
+        'mismatched_units': mismatched,
+        'matched_units': file.done_sectors,
+        'recovered_units': recovered,
+        'total_units': file.total_sectors,
+        'recovered_fraction': recovered / file.total_sectors if file.total_sectors else 1,
+        'extents': len(file.extents),
+        'near_units': len(file.near_matches),
+        'bytes_read': bytes_read,
+        'read_fraction': bytes_read / image_size if image_size else 0,
+        'wall_seconds': wall,
+        'first_match_seconds': times['first_match'] - started if 'first_match' in times else None,
+        'reconstruction_seconds': times['finished'] - started if success and 'finished' in times else None,
+        'error': repr(job.error) if job.error else None,
+        'stages': job.profiler.stats(),
+    }
+
+
+def summarise(runs):
+    """Return the median of each measurement of runs, a list of result dicts of one layout, and how many of
+    them rebuilt the file; reconstruction_seconds is the median over those only."""
+    summary = {'runs': len(runs), 'correct': all(result['correct'] for result in runs),
+               'reconstructed': sum(result['success'] for result in runs),
+               'timed_out': sum(result['timed_out'] for result in runs)}
+    for key in ('recovered_fraction', 'bytes_read', 'read_fraction', 'wall_seconds', 'first_match_seconds', 'reconstruction_seconds'):
+        values = [result[key] for result in runs if result[key] is not None]
+        summary[key] = statistics.median(values) if values else None
+    return summary
+
+
+def regressions(summaries, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Yield (layout, measurement, baseline value, value) for each median worse than baseline's by more than
+    tolerance, for each layout that was correct in the baseline and no longer is, and for each that recovers less
+    or rebuilds the file in fewer runs."""
+    for name, summary in summaries.items():
+        before = baseline.get('summary', {}).get(name)
+        if before is None:
+            continue
+        if before['correct'] and not summary['correct']:
+            yield name, 'correct', True, False
+        if summary['recovered_fraction'] < before['recovered_fraction']:
+            yield name, 'recovered_fraction', before['recovered_fraction'], summary['recovered_fraction']
+        if 'reconstructed' in before and summary['reconstructed'] < before['reconstructed']:
+            yield name, 'reconstructed', before['reconstructed'], summary['reconstructed']
+        for key in ('bytes_read', 'wall_seconds', 'first_match_seconds', 'reconstruction_seconds'):
+            old, new = before.get(key), summary.get(key)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and (key == 'bytes_read' or new - old > MIN_SLOWDOWN):
+                yield name, key, old, new
+
+
+def write_event(event, **fields):
+    sys.stdout.write(json.dumps(dict(event=event, **fields)) + '\n')
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the search on synthetic disk images with known layouts.')
+    parser.add_argument('--output', default='benchmark.json', help='file to write the results to (default %(default)s)')
+    parser.add_argument('--baseline', default=None,
+                        help='results of an earlier version to compare with; exits with 1 if anything regressed')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown reported as a regression (default %(default)s)')
+    parser.add_argument('--layouts', nargs='+', choices=list(LAYOUTS), default=None,
+                        help='layouts to run (default: all, those with rotted units only with --near-distance)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='seed of the first image (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='images per layout, with consecutive seeds (default %(default)s)')
+    parser.add_argument('--image-size', type=int, default=DEFAULT_IMAGE_SIZE,
+                        help='size of each image in bytes (default %(default)s)')
+    parser.add_argument('--source-size', type=int, default=DEFAULT_SOURCE_SIZE,
+                        help='size of each source file in bytes (default %(default)s)')
+    parser.add_argument('--sector-size', type=int, default=SECTOR_SIZE,
+                        help='unit the images are laid out and searched in (default %(default)s)')
+    parser.add_argument('--work-dir', default=None,
+                        help='directory for the images and outputs, kept afterwards (default: a temporary one)')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='file',
+                        help='how to read the images (default file)')
+    parser.add_argument('--block-size', type=int, default=None,
+                        help='read block size in bytes (default: calibrated, or ' + str(DEFAULT_BLOCK_SIZE) + ')')
+    parser.add_argument('--no-calibrate', action='store_true',
+                        help='skip measuring the device before each run')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of matching threads (default: cpu count - 1)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='read the whole image with this many processes instead of skimming it, 0 to never '
+                             '(default: when calibration finds it faster)')
+    parser.add_argument('--near-distance', metavar='BITS', type=int, default=None,
+                        help='also match units that differ from a source unit in at most BITS bits (default: exact '
+                             'matches only)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='seconds after which a run is stopped and reported as timed out (default %(default)s)')
+    args = parser.parse_args(argv)
+    if args.layouts is None:
+        args.layouts = [name for name, layout in LAYOUTS.items() if not layout.rot or args.near_distance]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    options = dict(block_size=args.block_size, backend=args.backend, max_workers=args.workers,
+                   processes=args.processes, calibrate=not args.no_calibrate, near_distance=args.near_distance)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='recoverability-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    try:
+        for name in args.layouts:
+            for seed in range(args.seed, args.seed + args.repeat):
+                source_path, image_path, fragments = generate(LAYOUTS[name], seed, args.image_size, args.source_size,
+                                                              args.sector_size, work_dir)
+                result = dict(layout=name, seed=seed, fragments=len(fragments))
+                result.update(run(image_path, source_path, os.path.join(work_dir, '%s-%d' % (name, seed)), options,
+                                  args.sector_size, LAYOUTS[name].rot, args.timeout))
+                results.append(result)
+                write_event('run', **result)
+                if not result['success']:
+                    write_event('not_reconstructed', layout=name, seed=seed, timed_out=result['timed_out'],
+                                recovered_fraction=result['recovered_fraction'])
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    summaries = {name: summarise([result for result in results if result['layout'] == name]) for name in args.layouts}
+    report = {
+        'version': VERSION,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': dict(image_size=args.image_size, source_size=args.source_size, sector_size=args.sector_size,
+                         seed=args.seed, repeat=args.repeat, timeout=args.timeout, **options),
+        'runs': results,
+        'summary': summaries,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    write_event('finished', output=args.output, summary=summaries)
+
+    if baseline is not None:
+        if baseline.get('version') != VERSION or \
+                baseline.get('settings', {}).get('image_size') != args.image_size or \
+                baseline.get('settings', {}).get('source_size') != args.source_size:
+            write_event('baseline_mismatch', baseline=args.baseline)
+        worse = list(regressions(summaries, baseline, args.tolerance))
+        for name, key, old, new in worse:
+            write_event('regression', layout=name, measurement=key, baseline=old, value=new)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""Calibration of the reads to the device being searched.
+
+Before the search, a second or so of reads measures what the device can do: the
+sequential throughput at each candidate block size, the latency of single-unit
+reads at random offsets, and the random read rate at increasing numbers of
+concurrent readers, which stops growing once the device's queue is saturated;
+at that depth, capped at the number of CPUs, the sequential throughput is
+measured again, with each reader in a region of its own, and compared with that
+of one reader over a few samples. From these the job takes its block size and, for each way
+of searching, an estimate of how long reading the search space would take:
+
+- the skim reads one unit per stride, each a random read unless the stride is
+  short enough for whole spans to be read (see reads.iter_sectors);
+- a sequential read goes through everything, with as many concurrent readers
+  as the device rewards.
+
+Small source files give short strides and so many probes; on fast devices
+reading everything sequentially then beats striding. Calibration reads bypass
+the pacer, and on an image in the page cache they measure the cache.
+"""
+import os
+import random
+import statistics
+import time
+from threading import Lock, Thread
+
+from reads import MIN_BLOCK_SIZE, MAX_BLOCK_SIZE, DEFAULT_SPAN_STRIDE_LIMIT, clamp_block_size
+
+# seconds spent measuring in all
+DEFAULT_BUDGET = 1.0
+BLOCK_SIZES = (MIN_BLOCK_SIZE, 4 * 1024 * 1024, MAX_BLOCK_SIZE)
+DEPTHS = (1, 2, 4, 8)
+# a setting within this fraction of the best is as good; the smallest such is chosen
+SATURATION = 0.9
+# reading sequentially must be estimated this much faster than skimming to be chosen
+SEQUENTIAL_MARGIN = 0.8
+# concurrent sequential readers must beat a single one in every one of this many samples to be used
+SAMPLES = 3
+
+
+class Calibration():
+    """What was measured on a device, and the settings chosen from it."""
+
+    def __init__(self):
+        self.sequential = {}    # block size -> bytes per second
+        self.parallel = {}      # concurrent readers -> random reads per second
+        self.latency = None     # median seconds per random single-unit read
+        self.parallel_sequential = None     # least bytes per second read sequentially by that many readers together
+        self.block_size = None
+        self.readers = 1        # concurrent readers worth using for a sequential read
+
+    @property
+    def sequential_rate(self):
+        """Bytes per second read sequentially by one reader at the chosen block size."""
+        return self.sequential.get(self.block_size, 0)
+
+    def estimate(self, search_bytes, stride):
+        """Return (seconds to skim, seconds to read sequentially) search_bytes with the given stride."""
+        rate = self.parallel_sequential if self.readers > 1 else self.sequential_rate
+        sequential = search_bytes / rate if rate else None
+        if stride <= DEFAULT_SPAN_STRIDE_LIMIT:
+            # the skim reads whole spans too, but alone
+            skim = search_bytes / self.sequential_rate if self.sequential_rate else None
+        else:
+            skim = search_bytes / stride * self.latency if self.latency else None
+        return skim, sequential
+
+    def prefers_sequential(self, search_bytes, stride):
+        skim, sequential = self.estimate(search_bytes, stride)
+        if skim is None or sequential is None:
+            return False
+        return sequential < skim * SEQUENTIAL_MARGIN
+
+    def probe_rate(self, stride):
+        """Expected skim probes per second with the given stride."""
+        if stride <= DEFAULT_SPAN_STRIDE_LIMIT:
+            return self.sequential_rate / stride if self.sequential_rate else 0
+        return 1 / self.latency if self.latency else 0
+
+    def as_dict(self):
+        return {
+            'sequential_bytes_per_second': {str(size): rate for size, rate in self.sequential.items()},
+            'random_reads_per_second': {str(depth): rate for depth, rate in self.parallel.items()},
+            'latency_seconds': self.latency,
+            'parallel_sequential_bytes_per_second': self.parallel_sequential,
+            'block_size': self.block_size,
+            'readers': self.readers,
+        }
+
+
+def good_enough(rates):
+    """Return the smallest key of rates whose value is within SATURATION of the best."""
+    best = max(rates.values())
+    return min(key for key, rate in rates.items() if rate >= best * SATURATION)
+
+
+def fresh_start(rng, start, room, span, unit):
+    """Return a random unit-aligned start for span bytes within the room bytes from start."""
+    return start + rng.randrange(max(1, (room - span) // unit + 1)) * unit
+
+
+def measure_sequential(volume, start, end, block_size, budget):
+    """Return the bytes per second of reading [start, end) in blocks of block_size, for at most budget seconds."""
+    began = time.perf_counter()
+    read = 0
+    offset = start
+    while offset < end and time.perf_counter() - began < budget:
+        data = volume.read(offset, min(block_size, end - offset))
+        if not data:
+            break
+        read += len(data)
+        offset += len(data)
+    elapsed = time.perf_counter() - began
+    return read / elapsed if elapsed > 0 else 0
+
+
+def measure_sequential_on(open_volume, start, end, block_size, budget):
+    """Like measure_sequential, on a volume of its own from open_volume()."""
+    volume = open_volume()
+    try:
+        return measure_sequential(volume, start, end, block_size, budget)
+    finally:
+        if not volume.shared:
+            volume.close()
+
+
+def measure_parallel_sequential(open_volume, regions, block_size, budget):
+    """Read each (start, end) region of regions sequentially on a reader of its own, for at most budget
+    seconds. Returns the bytes per second of all readers together."""
+    rates = []
+
+    def work(start, end):
+        rates.append(measure_sequential_on(open_volume, start, end, block_size, budget))
+
+    threads = [Thread(target=work, args=region, name='Calibration ' + str(n), daemon=True)
+               for n, region in enumerate(regions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(rates)
+
+
+def measure_random(open_volume, next_offset, unit, depth, budget):
+    """Read unit bytes at the offsets next_offset() returns with depth concurrent readers, for budget seconds.
+    Returns (reads per second, latency of each read)."""
+    latencies = []
+    deadline = time.perf_counter() + budget
+
+    def work():
+        volume = open_volume()
+        try:
+            while time.perf_counter() < deadline:
+                offset = next_offset()
+                began = time.perf_counter()
+                volume.read(offset, unit)
+                latencies.append(time.perf_counter() - began)
+        finally:
+            if not volume.shared:
+                volume.close()
+
+    began = time.perf_counter()
+    threads = [Thread(target=work, name='Calibration ' + str(n), daemon=True) for n in range(depth)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    return (len(latencies) / elapsed if elapsed > 0 else 0), latencies
+
+
+def calibrate(open_volume, vol_size, unit, origin=0, budget=DEFAULT_BUDGET, progress=None, seed=None,
+              max_readers=None):
+    """Measure the device behind open_volume() and choose a block size and a number of readers, at most
+    max_readers (by default the number of CPUs, as each reader of a sequential read is a process).
+
+    progress(portion done) is called after each measurement. Returns a Calibration.
+    """
+    rng = random.Random(seed)
+    max_readers = max_readers or os.cpu_count() or 1
+    result = Calibration()
+    units = (vol_size - origin) // unit
+    if units <= 0:
+        result.block_size = clamp_block_size(BLOCK_SIZES[0], unit)
+        return result
+    steps = len(BLOCK_SIZES) + len(DEPTHS) + 1
+    share = budget / steps
+    done = 0
+
+    volume = open_volume()
+    try:
+        for block_size in BLOCK_SIZES:
+            block_size = clamp_block_size(block_size, unit)
+            # a fresh region for every size, so that one measurement doesn't read what another cached
+            span = min(vol_size - origin, 16 * block_size)
+            start = fresh_start(rng, origin, vol_size - origin, span, unit)
+            result.sequential[block_size] = measure_sequential(volume, start, start + span, block_size, share)
+            done += 1
+            if progress:
+                progress(done / steps)
+    finally:
+        if not volume.shared:
+            volume.close()
+    result.block_size = good_enough(result.sequential) if any(result.sequential.values()) else \
+        clamp_block_size(BLOCK_SIZES[0], unit)
+
+    lock = Lock()
+
+    def next_offset():
+        with lock:
+            return origin + rng.randrange(units) * unit
+
+    for depth in DEPTHS:
+        rate, latencies = measure_random(open_volume, next_offset, unit, depth, share)
+        result.parallel[depth] = rate
+        if depth == 1 and latencies:
+            result.latency = statistics.median(latencies)
+        done += 1
+        if progress:
+            progress(done / steps)
+    depth = min(good_enough(result.parallel) if any(result.parallel.values()) else 1, max_readers)
+    if depth > 1 and result.sequential_rate:
+        # random reads gain from a deeper queue more readily than sequential ones; check they do too, against
+        # one reader measured alongside, in fresh regions every time
+        spacing = (vol_size - origin) // depth // unit * unit
+        span = min(spacing, 16 * result.block_size)
+        if span > 0:
+            samples = []
+            for _ in range(SAMPLES):
+                start = fresh_start(rng, origin, vol_size - origin, span, unit)
+                single = measure_sequential_on(open_volume, start, start + span, result.block_size,
+                                               share / SAMPLES / 2)
+                starts = [fresh_start(rng, origin + n * spacing, spacing, span, unit) for n in range(depth)]
+                regions = [(s, s + span) for s in starts]
+                samples.append((measure_parallel_sequential(open_volume, regions, result.block_size,
+                                                            share / SAMPLES / 2), single))
+            result.parallel_sequential = min(parallel for parallel, _ in samples)
+            if all(parallel * SATURATION > single for parallel, single in samples):
+                result.readers = depth
+    if progress:
+        progress(1)
+    return result
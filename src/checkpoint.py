@@ -0,0 +1,105 @@
+"""Periodic, atomic checkpoints of a running job.
+
+A checkpoint lives in the job directory: checkpoint.json holds the volume, the
+source files, the skim and inspection state and the ranges of the volume already
+read and checked, and one <file id>.table per source file holds its raw address
+table. Every file is written under a temporary name, flushed and renamed into
+place, tables before the JSON, so a crash at any moment leaves a complete old or
+new checkpoint. Only state that has been checked is recorded, so a resumed job
+never skips a sector whose match was lost.
+
+The readers are never blocked for longer than it takes to copy the state:
+tables are only rewritten when they changed and all writing happens on the
+checkpoint thread.
+"""
+import json
+import os
+import time
+from array import array
+from threading import Event, Lock, Thread
+
+VERSION = 2
+DEFAULT_INTERVAL = 60.0
+STATE_NAME = 'checkpoint.json'
+
+
+def atomic_write(path, data):
+    """Replace the file at path with data, so that readers see either the old or the new content."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def table_path(dir_name, file_id):
+    return os.path.join(dir_name, str(file_id) + '.table')
+
+
+def load(dir_name):
+    """Return the state dict of the checkpoint in dir_name."""
+    with open(os.path.join(dir_name, STATE_NAME)) as f:
+        state = json.load(f)
+    if state.get('version') != VERSION:
+        raise ValueError('unsupported checkpoint version: ' + str(state.get('version')))
+    return state
+
+
+def load_table(dir_name, file_id):
+    """Return the address table of source file file_id saved in dir_name."""
+    table = array('q')
+    with open(table_path(dir_name, file_id), 'rb') as f:
+        table.frombytes(f.read())
+    return table
+
+
+class Checkpointer():
+    """Writes a checkpoint of job into dir_name every interval seconds while the job runs."""
+
+    def __init__(self, job, dir_name, interval=DEFAULT_INTERVAL):
+        self.job = job
+        self.dir_name = dir_name
+        self.interval = interval
+        self.lock = Lock()      # one write at a time
+        self.stopped = Event()
+        self.written = {}       # file id -> done_sectors when its table was last written
+        self.writes = 0
+        self.write_seconds = 0.0
+
+    def start(self):
+        thread = Thread(target=self._loop, name='Checkpoint', daemon=True)
+        thread.start()
+        return thread
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+
+    def write(self):
+        """Write a checkpoint now."""
+        with self.lock:
+            start = time.perf_counter()
+            # the covered ranges are taken first: every match inside them is already in the tables
+            state = self.job.snapshot()
+            state['version'] = VERSION
+            for file_id, file in enumerate(self.job.files):
+                done = file.done_sectors
+                if self.written.get(file_id) != (done, file.finished):
+                    atomic_write(table_path(self.dir_name, file_id), file.address_table.tobytes())
+                    self.written[file_id] = (done, file.finished)
+            atomic_write(os.path.join(self.dir_name, STATE_NAME), json.dumps(state).encode())
+            self.writes += 1
+            self.write_seconds += time.perf_counter() - start
+
+    def remove(self):
+        """Delete the checkpoint, once the job's outputs have been written."""
+        with self.lock:
+            paths = [os.path.join(self.dir_name, STATE_NAME)]
+            paths += [table_path(self.dir_name, file_id) for file_id in range(len(self.job.files))]
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
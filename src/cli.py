@@ -0,0 +1,359 @@
+"""Command-line entry point that runs a recoverability job without the GUI.
+
+Progress is written to stdout as JSON, one object per line, so that scans can be
+scripted and monitored from other tools. Example:
+
+    python cli.py /dev/sdb lost.jpg --start 0x1f400000
+
+Several source files can be given; they are all searched for in the same pass.
+A volume searched repeatedly can be indexed once, after which searches only read
+the units whose digests match:
+
+    python cli.py /dev/sdb --build-index
+    python cli.py /dev/sdb lost.jpg --index "recoverability/index of devsdb"
+
+A scan interrupted by a crash or Ctrl-C can be picked up from its job directory:
+
+    python cli.py --resume "recoverability/Sun Oct 18 08_15_06 2026"
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from threading import Lock
+
+from recoverability import Job, SourceFile, DEFAULT_OUT_DIR, SECTOR_SIZE, unit_size
+from checkpoint import DEFAULT_INTERVAL
+from reads import BACKENDS, DEFAULT_BLOCK_SIZE, FileVolume, device_size
+import ntfs
+import diskindex
+from pacing import Pacer, PacedVolume
+from telemetry import DEFAULT_EXPORT_INTERVAL
+from badblocks import DEFAULT_RETRIES
+from profiling import TRACE_FORMATS
+from dispatch import MODES, DEFAULT_BATCH_SIZE, DEFAULT_QUEUE_SIZE
+
+
+def parse_address(value):
+    """Parse a start address given in decimal, 0x-prefixed hex, or bare hex as accepted by the GUI."""
+    try:
+        return int(value, 0)
+    except ValueError:
+        try:
+            return int(value, 16)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid address: ' + value)
+
+
+def write_event(event, stream=sys.stdout, **fields):
+    """Write one event to stream as a JSON line."""
+    stream.write(json.dumps(dict(event=event, time=time.time(), **fields)) + '\n')
+    stream.flush()
+
+
+class JsonReporter():
+    """Writes job events to a stream as JSON lines. Progress events are rate-limited to one per interval."""
+
+    def __init__(self, job, stream=sys.stdout, interval=1.0):
+        self.job = job
+        self.stream = stream
+        self.interval = interval
+        self.last_progress = 0
+        self.success = False
+        self.lock = Lock()
+
+        job.test_run_finished_signal.connect(lambda: self.write('test_run_finished'))
+        job.candidates_signal.connect(self.candidates)
+        job.search_space_signal.connect(self.search_space)
+        job.disk_index_signal.connect(self.disk_index)
+        job.calibration_signal.connect(self.calibration)
+        job.bad_blocks_signal.connect(self.retrying_bad_blocks)
+        job.predicted_signal.connect(self.predicted)
+        job.success_signal.connect(self.match)
+        job.extent_signal.connect(self.extent)
+        job.near_signal.connect(self.near_match)
+        job.file_finished_signal.connect(self.file_finished)
+        job.finished_signal.connect(self.finished)
+        job.progress_signal.connect(self.progress)
+        job.skim_reader.new_inspection_signal.connect(self.new_inspection)
+        job.skim_reader.resuming_signal.connect(lambda: self.write('skim_resumed'))
+
+    def write(self, event, **fields):
+        with self.lock:
+            write_event(event, self.stream, **fields)
+
+    def progress(self, snapshot):
+        now = time.monotonic()
+        if now - self.last_progress < self.interval:
+            return
+        self.last_progress = now
+        telemetry = self.job.telemetry
+        self.write('progress', progress=snapshot['skim'], address=snapshot['position'], done=snapshot['done'],
+                   total=snapshot['total'], inspections=snapshot['inspections'], phase=telemetry.current_phase,
+                   bytes_per_second=telemetry.read_rate.value, eta_seconds=telemetry.eta()['total'])
+
+    def candidates(self, extents):
+        error = self.job.metadata_error
+        self.write('candidates', count=len(extents), extents=[extent.as_dict() for extent in extents],
+                   error=str(error) if error else None)
+
+    def search_space(self, size):
+        error = self.job.bitmap_error
+        self.write('search_space', bytes=size if size is not None else self.job.vol_size, restricted=size is not None,
+                   error=str(error) if error else None)
+
+    def disk_index(self, data):
+        error = self.job.disk_index_error
+        indexed, verified = data if data is not None else (0, 0)
+        self.write('index_lookup', path=self.job.disk_index, usable=data is not None, indexed=indexed,
+                   verified=verified, error=str(error) if error else None)
+
+    def calibration(self, result):
+        job = self.job
+        search_bytes = sum(end - start for start, end in job.unread_ranges(job.partition_offset, job.vol_size))
+        skim, sequential = result.estimate(search_bytes, job.skim_reader.stride)
+        self.write('calibration', measured=result.as_dict(), block_size=job.block_size,
+                   mode='sharded' if job.processes > 1 else 'sequential' if job.sequential else 'skim',
+                   processes=job.processes, skim_seconds=skim, sequential_seconds=sequential)
+
+    def retrying_bad_blocks(self, bad_blocks):
+        state = bad_blocks.as_dict()
+        self.write('retrying_bad_blocks', failed_bytes=state['failed_bytes'], skipped_bytes=state['skipped_bytes'],
+                   errors=state['errors'], timeouts=state['timeouts'], failed=state['failed'][:100])
+
+    def predicted(self, data):
+        file_id, start, end = data
+        self.write('extent_predicted', file=file_id, start=start, end=end, sectors=(end - start) // self.job.unit_size)
+
+    def match(self, data):
+        file_id, i = data
+        file = self.job.files[file_id]
+        self.write('match', file=file_id, sector=i, address=file.address_table[i],
+                   done=file.done_sectors, total=file.total_sectors)
+
+    def extent(self, data):
+        file_id, start, address, length = data
+        file = self.job.files[file_id]
+        self.write('extent', file=file_id, sector=start, address=address, length=length,
+                   done=file.done_sectors, total=file.total_sectors)
+
+    def near_match(self, data):
+        file_id, i, address, distance = data
+        self.write('near_match', file=file_id, sector=i, address=address, distance=distance)
+
+    def file_finished(self, data):
+        file_id, success, auto_filled = data
+        file = self.job.files[file_id]
+        self.write('file_finished', file=file_id, source=file.name, success=success, auto_filled=auto_filled,
+                   done=file.done_sectors, total=file.total_sectors, extents=len(file.extents),
+                   near_matches=len(file.near_matches), output=file.rebuilt_file_path if success else None)
+
+    def new_inspection(self, data):
+        address, forward, backward = data
+        self.write('inspection_started', address=address)
+        for reader in (forward, backward):
+            reader.finished_signal.connect(
+                lambda rate, reader=reader: self.write('inspection_finished', address=address,
+                                                       direction=reader.id_tuple[0], success_rate=rate))
+
+    def finished(self, data):
+        success, auto_filled = data
+        self.success = success
+        self.write('finished', success=success, auto_filled=auto_filled,
+                   done=self.job.done_sectors, total=self.job.total_sectors,
+                   outputs=[file.rebuilt_file_path if file.written else None for file in self.job.files],
+                   error=repr(self.job.error) if self.job.error else None,
+                   dispatch=self.job.dispatcher.stats.as_dict(),
+                   stages=self.job.profiler.stats(),
+                   paused_seconds=self.job.pacer.paused_seconds,
+                   bad_blocks={key: value for key, value in self.job.bad_blocks.as_dict().items()
+                               if key not in ('failed', 'skipped')})
+
+
+def build_index(path, vol_path, vol_size, unit, origin, block_size, pacer, limit=None):
+    """Index the volume into path, carrying on with an unfinished or partial index. Returns whether the
+    whole volume is indexed."""
+    volume = FileVolume(vol_path)
+    paced = PacedVolume(volume, pacer) if pacer.throttled else volume
+    try:
+        index = diskindex.DiskIndex.create(path, volume, vol_path, vol_size, unit, origin)
+        write_event('index_started', path=path, indexed=index.covered.total(), total=index.end - origin)
+        try:
+            complete = index.build(paced, block_size, limit,
+                                   lambda indexed, total: write_event('index_progress', indexed=indexed, total=total))
+            write_event('index_built', path=path, complete=complete, entries=index.entries,
+                        indexed=index.covered.total(), total=index.end - origin)
+        finally:
+            index.close()
+    finally:
+        volume.close()
+    return complete
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild a file using only sectors found on a (corrupt) volume.')
+    parser.add_argument('image', nargs='?', help='path to the disk image, block device or volume to search')
+    parser.add_argument('sources', nargs='*', metavar='source',
+                        help='a copy of a file to look for; several files are searched for in one pass')
+    parser.add_argument('--resume', metavar='JOB_DIR', default=None,
+                        help='carry on with the job whose checkpoint is in JOB_DIR instead of starting a new one')
+    parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_INTERVAL,
+                        help='seconds between checkpoints of the scan state, 0 to disable (default %(default)s)')
+    parser.add_argument('--start', type=parse_address, default=0,
+                        help='address at which to begin the search (default 0)')
+    parser.add_argument('--vol-size', type=int, default=None,
+                        help='size of the volume in bytes (default: detected)')
+    parser.add_argument('--sector-size', type=int, default=SECTOR_SIZE,
+                        help='logical sector size of the volume, e.g. 4096 for 4Kn disks (default %(default)s)')
+    parser.add_argument('--cluster-size', type=int, default=None,
+                        help='file system cluster size; files are only looked for at cluster boundaries '
+                             '(default: the sector size)')
+    parser.add_argument('--partition-offset', type=parse_address, default=0,
+                        help='byte offset of the partition on the volume, which clusters are counted from (default 0)')
+    parser.add_argument('--sector-granularity', action='store_true',
+                        help='index and probe single sectors rather than whole clusters')
+    parser.add_argument('--ntfs', action='store_true',
+                        help='probe the extents the NTFS $MFT gives for the sources before scanning; '
+                             'the sector and cluster sizes default to those of the boot sector')
+    parser.add_argument('--free-space-only', action='store_true',
+                        help='with --ntfs, only search the clusters $Bitmap marks free and those of candidate files; '
+                             'the whole volume is searched if $Bitmap is corrupt')
+    parser.add_argument('--index', metavar='DIR', default=None,
+                        help='persistent digest index of the volume: the ranges it covers are not read, only the units '
+                             'whose digests match a source are')
+    parser.add_argument('--build-index', action='store_true',
+                        help='index the volume into --index (default: "index of <volume>" in --out-dir) before '
+                             'searching, carrying on with an unfinished index; with no sources, only index')
+    parser.add_argument('--index-limit', type=int, default=None,
+                        help='index at most this many more bytes of the volume in this run (default: all); '
+                             'without sources, the exit status is 1 until the whole volume is indexed')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='file',
+                        help='how to read the volume (default file)')
+    parser.add_argument('--block-size', type=int, default=None,
+                        help='read block size in bytes (default: calibrated, or ' + str(DEFAULT_BLOCK_SIZE) + ')')
+    parser.add_argument('--no-calibrate', action='store_true',
+                        help='skip measuring the device; the block size and the reading strategy are then not '
+                             'chosen for it')
+    parser.add_argument('--read-timeout', type=float, default=None,
+                        help='seconds after which a read of a failing drive is given up on and its range entered in '
+                             'the bad-block map (default: wait for the drive)')
+    parser.add_argument('--read-retries', type=int, default=DEFAULT_RETRIES,
+                        help='times the bad blocks are read again, unit by unit, if the search ends without finding '
+                             'every file (default %(default)s)')
+    parser.add_argument('--near-distance', metavar='BITS', type=int, default=None,
+                        help='also match units that differ from a source unit in at most BITS bits, as bit rot, and '
+                             'report them as near matches (default: exact matches only)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of matching threads (default: cpu count - 1)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='candidate sectors per matching task (default %(default)s)')
+    parser.add_argument('--dispatch', choices=MODES, default='queue',
+                        help='match on matcher threads behind a bounded queue, or inline on the reader threads')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='matching tasks that may wait in the queue before readers block (default %(default)s)')
+    parser.add_argument('--io-share', type=float, default=1.0,
+                        help='fraction of the device time the readers may use, in (0, 1] (default %(default)s)')
+    parser.add_argument('--iops', type=float, default=None,
+                        help='maximum reads per second (default: no limit)')
+    parser.add_argument('--unthrottled', action='store_true',
+                        help='never pause between reads, not even when the device is saturated')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='read the whole volume with this many processes instead of skimming it, 0 to never '
+                             '(default: when calibration finds it faster)')
+    parser.add_argument('--out-dir', default=DEFAULT_OUT_DIR,
+                        help='directory in which the job directory is created (default %(default)s)')
+    parser.add_argument('--metrics', metavar='FILE', default=None,
+                        help='export throughput metrics to FILE periodically: Prometheus text if it ends in .prom, '
+                             'JSON otherwise')
+    parser.add_argument('--metrics-interval', type=float, default=DEFAULT_EXPORT_INTERVAL,
+                        help='seconds between metrics exports (default %(default)s)')
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help='write a timeline of the pipeline stages of every thread to FILE when the job ends')
+    parser.add_argument('--trace-format', choices=TRACE_FORMATS, default='chrome',
+                        help='Chrome trace events (for chrome://tracing or Perfetto) or plain JSON timelines '
+                             '(default %(default)s)')
+    parser.add_argument('--trace-sample', type=int, default=1,
+                        help='keep one in this many timed spans of each thread in the trace (default %(default)s)')
+    parser.add_argument('--progress-interval', type=float, default=1.0,
+                        help='minimum seconds between progress events (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    pacer = Pacer.unthrottled() if args.unthrottled else Pacer(share=args.io_share, iops=args.iops)
+    options = dict(block_size=args.block_size, backend=args.backend, max_workers=args.workers,
+                   processes=args.processes, batch_size=args.batch_size, dispatch=args.dispatch,
+                   queue_size=args.queue_size, pacer=pacer, checkpoint_interval=args.checkpoint_interval or None,
+                   metrics_path=args.metrics, metrics_interval=args.metrics_interval, trace_path=args.trace,
+                   trace_format=args.trace_format, trace_sample=args.trace_sample, disk_index=args.index,
+                   calibrate=not args.no_calibrate, read_timeout=args.read_timeout,
+                   read_retries=args.read_retries, near_distance=args.near_distance)
+    if args.free_space_only and not args.ntfs:
+        parser.error('--free-space-only requires --ntfs')
+    if args.build_index and args.resume:
+        parser.error('--build-index cannot be combined with --resume')
+    if args.ntfs and not args.resume:
+        volume = FileVolume(args.image)
+        try:
+            boot = ntfs.BootSector.read(volume, args.partition_offset)
+            if args.cluster_size is None:
+                args.sector_size, args.cluster_size = boot.bytes_per_sector, boot.cluster_size
+        except (ntfs.NtfsError, OSError):
+            pass    # the job reports it, and scans without the metadata
+        finally:
+            volume.close()
+    volume_options = dict(sector_size=args.sector_size, cluster_size=args.cluster_size,
+                          partition_offset=args.partition_offset,
+                          granularity='sector' if args.sector_granularity else 'cluster', use_ntfs=args.ntfs,
+                          free_space_only=args.free_space_only)
+    if args.resume:
+        if args.image or args.sources:
+            parser.error('the image and sources are taken from the checkpoint when resuming')
+        try:
+            job = Job.resume(args.resume, **options)
+        except (OSError, ValueError) as e:
+            parser.error('cannot resume: ' + str(e))
+        if args.vol_size is None and device_size(job.vol_path) != job.vol_size:
+            parser.error('cannot resume: the size of ' + job.vol_path + ' has changed')
+    else:
+        if not args.image or not (args.sources or args.build_index):
+            parser.error('an image and at least one source are required')
+        vol_size = args.vol_size if args.vol_size is not None else device_size(args.image)
+        if not 0 <= args.start <= vol_size:
+            parser.error('start address is outside the volume')
+        try:
+            unit = unit_size(args.sector_size, args.cluster_size, volume_options['granularity'])
+        except ValueError as e:
+            parser.error(str(e))
+        if args.build_index:
+            options['disk_index'] = args.index or diskindex.default_path(args.out_dir, args.image)
+            try:
+                complete = build_index(options['disk_index'], args.image, vol_size, unit, args.partition_offset,
+                                       args.block_size or DEFAULT_BLOCK_SIZE, pacer, args.index_limit)
+            except KeyboardInterrupt:
+                return 130
+            # a search carries on with a partial index, scanning what it doesn't cover
+            if not args.sources:
+                return 0 if complete else 1
+        try:
+            job = Job(args.image, vol_size, [SourceFile(path, sector_size=unit) for path in args.sources],
+                      args.start, out_dir=args.out_dir, **options, **volume_options)
+        except ValueError as e:
+            parser.error(str(e))
+    reporter = JsonReporter(job, interval=args.progress_interval)
+    reporter.write('started', image=job.vol_path, sources=[file.path for file in job.files],
+                   vol_size=job.vol_size, total=job.total_sectors, done=job.done_sectors,
+                   start=job.skim_reader.init_address, job_dir=job.dir_name, resumed=bool(args.resume))
+    job.start()
+    try:
+        job.wait()
+    except KeyboardInterrupt:
+        job.fail()
+        return 130
+    # let the readers release what they hold (e.g. the shared-memory index of a sharded scan)
+    job.join(5)
+    return 0 if reporter.success else 1
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Persistent index of the content of a whole volume, for searching it repeatedly.
+
+Without it every job reads the volume again, however many files were already
+searched for on it. An indexing pass reads the volume sequentially once and
+stores the digest (sources.digest) of every unit that isn't meaningless, with
+its address. A job given the index looks up the digests of its source units,
+reads only the units they point to, to verify them, and counts the indexed
+ranges as covered: nothing else in them is read.
+
+The volume is indexed a segment at a time. Each segment is sorted and written
+as a run, a flat file of native 64-bit integers (the digests, then the
+addresses in the same order) that lookups map rather than load. The manifest is
+rewritten atomically after every run, so an interrupted build resumes after the
+last complete segment, and a build can be limited to part of the volume and
+extended later; jobs scan whatever isn't indexed yet. The runs are merged into
+one once the whole volume is indexed.
+
+The manifest also records the size and identity of the volume: digests of units
+sampled across it and, for an image file, its modification time. An index whose
+volume has changed is refused for lookups and rebuilt by the next build.
+"""
+import heapq
+import json
+import mmap
+import os
+import shutil
+import stat
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from hashlib import blake2b
+
+from checkpoint import atomic_write
+from ranges import RangeSet
+from reads import DEFAULT_BLOCK_SIZE, iter_span
+from sources import SectorIndex, digest, meaningless
+
+VERSION = 1
+MANIFEST_NAME = 'index.json'
+# bytes of the volume indexed, sorted and written as one run
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+# runs are merged once the volume is indexed, or when there are more than this many
+MAX_RUNS = 64
+# units read across the volume to recognise it
+IDENTITY_SAMPLES = 64
+
+
+class DiskIndexError(Exception):
+    pass
+
+
+def default_path(out_dir, vol_path):
+    """Return where the index of vol_path is kept by default: next to the job directories in out_dir."""
+    friendly_vol_path = vol_path.replace(':', '').replace('/', '').replace('\\', '').replace('.', '')
+    return os.path.join(out_dir, 'index of ' + friendly_vol_path)
+
+
+def identity(volume, vol_path, vol_size, unit):
+    """Return what recognises the volume: its size, a digest of units sampled evenly across it and,
+    for an image file, its modification time."""
+    samples = blake2b(digest_size=16)
+    units = vol_size // unit
+    for n in range(IDENTITY_SAMPLES if units else 0):
+        samples.update(volume.read(units * n // IDENTITY_SAMPLES * unit, unit))
+    result = {'size': vol_size, 'samples': samples.hexdigest()}
+    try:
+        st = os.stat(vol_path)
+    except OSError:
+        return result
+    if stat.S_ISREG(st.st_mode):
+        result['mtime_ns'] = st.st_mtime_ns
+    return result
+
+
+class Run():
+    """A sorted run of the index, mapped read-only."""
+
+    def __init__(self, path, count):
+        self.count = count
+        self.fobj = open(path, 'rb')
+        self.map = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ) if count else None
+        self.view = memoryview(self.map if count else b'').cast('Q')
+        self.keys = self.view[:count]
+        self.addresses = self.view[count:2 * count]
+
+    def lookup(self, key):
+        """Return the addresses of the units whose digest is key, in address order."""
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        return self.addresses[lo:hi].tolist()
+
+    def close(self):
+        # the mapping can only be closed once no view of it is left
+        for view in (self.keys, self.addresses, self.view):
+            view.release()
+        if self.map is not None:
+            self.map.close()
+        self.fobj.close()
+
+
+class DiskIndex():
+    """The index of a volume in directory path, for units of unit_size counted from origin.
+
+    Use DiskIndex.open() to look sources up, and DiskIndex.create() to build or extend the index.
+    """
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.unit_size = manifest['unit_size']
+        self.origin = manifest['origin']
+        self.vol_size = manifest['identity']['size']
+        self.runs = [Run(os.path.join(path, run['file']), run['count']) for run in manifest['runs']]
+        self.covered = RangeSet((start, end) for run in manifest['runs'] for start, end in run['ranges'])
+
+    @staticmethod
+    def read_manifest(path):
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != VERSION or manifest.get('byteorder') != sys.byteorder:
+            raise DiskIndexError('unsupported index format')
+        return manifest
+
+    @classmethod
+    def open(cls, path, volume, vol_path, vol_size, unit_size, origin=0):
+        """Open the index in path for lookups. Raises DiskIndexError if it is missing, was built for other
+        units, or the volume has changed since."""
+        try:
+            manifest = cls.read_manifest(path)
+        except (OSError, ValueError) as e:
+            raise DiskIndexError('no usable index in ' + path + ': ' + str(e))
+        if manifest['unit_size'] != unit_size or manifest['origin'] != origin:
+            raise DiskIndexError('the index was built for ' + str(manifest['unit_size']) + '-byte units from '
+                                 + hex(manifest['origin']))
+        if manifest['identity'] != identity(volume, vol_path, vol_size, unit_size):
+            raise DiskIndexError('the volume has changed since it was indexed')
+        return cls(path, manifest)
+
+    @classmethod
+    def create(cls, path, volume, vol_path, vol_size, unit_size, origin=0, segment_size=DEFAULT_SEGMENT_SIZE):
+        """Open the index in path for building, carrying on with it if it is still valid and starting
+        afresh otherwise."""
+        current = identity(volume, vol_path, vol_size, unit_size)
+        try:
+            manifest = cls.read_manifest(path)
+            if manifest['identity'] == current and manifest['unit_size'] == unit_size \
+                    and manifest['origin'] == origin:
+                return cls(path, manifest)
+        except (OSError, ValueError, DiskIndexError, KeyError):
+            pass
+        # only what an index consists of is removed, in case path was given by mistake
+        os.makedirs(path, mode=0o755, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith(MANIFEST_NAME) or name.startswith(('run-', 'merged-')):
+                os.remove(os.path.join(path, name))
+        manifest = {'version': VERSION, 'byteorder': sys.byteorder, 'vol_path': vol_path, 'identity': current,
+                    'unit_size': unit_size, 'origin': origin, 'segment_size': segment_size, 'runs': []}
+        index = cls(path, manifest)
+        index.save()
+        return index
+
+    @property
+    def entries(self):
+        return sum(run.count for run in self.runs)
+
+    @property
+    def end(self):
+        """End of the last whole unit of the volume."""
+        return self.origin + (self.vol_size - self.origin) // self.unit_size * self.unit_size
+
+    @property
+    def complete(self):
+        return not self.covered.gaps(self.origin, self.end)
+
+    def save(self):
+        atomic_write(os.path.join(self.path, MANIFEST_NAME), json.dumps(self.manifest).encode())
+
+    def lookup(self, key, limit=None):
+        """Return the addresses of indexed units whose digest is key, at most limit of them."""
+        found = []
+        for run in self.runs:
+            found += run.lookup(key)
+            if limit is not None and len(found) >= limit:
+                return found[:limit]
+        return found
+
+    def pending(self):
+        """Yield the (start, end) ranges still to be indexed, split at segment boundaries."""
+        segment = self.manifest['segment_size']
+        for start, end in self.covered.gaps(self.origin, self.end):
+            while start < end:
+                boundary = self.origin + ((start - self.origin) // segment + 1) * segment
+                yield start, min(end, boundary)
+                start = min(end, boundary)
+
+    def build(self, volume, block_size=DEFAULT_BLOCK_SIZE, limit=None, progress=None, should_stop=None):
+        """Index what isn't indexed yet, a segment at a time, stopping once limit bytes have been indexed
+        or should_stop() returns true. progress(bytes indexed, bytes to index) is called after each
+        segment. Returns whether the whole volume is indexed."""
+        indexed = 0
+        for start, end in list(self.pending()):
+            if (limit is not None and indexed >= limit) or (should_stop and should_stop()):
+                break
+            indexed += self.add_segment(volume, start, end, block_size)
+            if progress:
+                progress(self.covered.total(), self.end - self.origin)
+        complete = self.complete
+        if len(self.runs) > 1 and (complete or len(self.runs) > MAX_RUNS):
+            self.merge()
+        return complete
+
+    def add_segment(self, volume, start, end, block_size=DEFAULT_BLOCK_SIZE):
+        """Read [start, end), write the digests of its units as a new run and return the bytes indexed."""
+        unit = self.unit_size
+        skip = meaningless(unit)
+        digests = array('Q')
+        addresses = array('Q')
+        read_end = start
+        for offset, block in iter_span(volume, start, end, block_size, unit, self.origin):
+            whole = min(len(block), end - offset) // unit * unit
+            for rel in range(0, whole, unit):
+                data = block[rel:rel + unit]
+                if data not in skip:
+                    digests.append(digest(data))
+                    addresses.append(offset + rel)
+            read_end = offset + whole
+        if read_end <= start:
+            return 0
+        keys, order = SectorIndex.sort(digests)
+        addresses = array('Q', (addresses[p] for p in order))
+        name = 'run-%016x.bin' % start
+        atomic_write(os.path.join(self.path, name), keys.tobytes() + addresses.tobytes())
+        self.manifest['runs'].append({'file': name, 'count': len(keys), 'ranges': [[start, read_end]]})
+        self.save()
+        self.runs.append(Run(os.path.join(self.path, name), len(keys)))
+        self.covered.add(start, read_end)
+        return read_end - start
+
+    def merge(self):
+        """Merge every run into one, streaming them so that memory use doesn't grow with the volume."""
+        count = self.entries
+        self.manifest['merges'] = self.manifest.get('merges', 0) + 1
+        name = 'merged-%d.bin' % self.manifest['merges']
+        path = os.path.join(self.path, name)
+        keys_path, addresses_path = path + '.keys', path + '.addresses'
+        merged = heapq.merge(*(zip(run.keys, run.addresses) for run in self.runs))
+        with open(keys_path, 'wb') as keys_out, open(addresses_path, 'wb') as addresses_out:
+            keys, addresses = array('Q'), array('Q')
+            for key, address in merged:
+                keys.append(key)
+                addresses.append(address)
+                if len(keys) >= 1 << 20:
+                    keys.tofile(keys_out)
+                    addresses.tofile(addresses_out)
+                    keys, addresses = array('Q'), array('Q')
+            keys.tofile(keys_out)
+            addresses.tofile(addresses_out)
+        del merged
+        with open(keys_path, 'ab') as out, open(addresses_path, 'rb') as f:
+            shutil.copyfileobj(f, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(keys_path, path)
+        os.remove(addresses_path)
+
+        old = [run['file'] for run in self.manifest['runs']]
+        self.manifest['runs'] = [{'file': name, 'count': count, 'ranges': self.covered.as_list()}]
+        self.save()
+        for run in self.runs:
+            run.close()
+        for file in old:
+            os.remove(os.path.join(self.path, file))
+        self.runs = [Run(path, count)]
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
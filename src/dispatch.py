@@ -0,0 +1,144 @@
+"""Batched hand-off of candidate sectors from the readers to the matcher threads.
+
+Readers submit one task per batch of candidates rather than one per sector. The
+tasks pass through a bounded queue, so a reader that outruns the matchers blocks
+(back-pressure) instead of piling up work. In inline mode tasks run directly on
+the submitting thread. Counters make the dispatch overhead measurable.
+"""
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_QUEUE_SIZE = 64
+MODES = ('queue', 'inline')
+
+
+def cancel(future):
+    """Cancel a future that never ran, waking up concurrent.futures.wait() on it as well: wait() only
+    counts a cancelled future as done once it has been notified."""
+    future.cancel()
+    future.set_running_or_notify_cancel()
+
+
+class DispatchStats():
+    """Counters describing how much work went through a Dispatcher and what it cost."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tasks = 0
+        self.items = 0
+        self.submit_seconds = 0.0   # time readers spent handing work over, including back-pressure
+        self.blocked_seconds = 0.0  # part of submit_seconds spent waiting for room in the queue
+        self.run_seconds = 0.0      # time spent running the tasks themselves
+        self.max_depth = 0
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'tasks': self.tasks,
+                'items': self.items,
+                'mean_batch': self.items / self.tasks if self.tasks else 0,
+                'submit_seconds': self.submit_seconds,
+                'blocked_seconds': self.blocked_seconds,
+                'run_seconds': self.run_seconds,
+                'max_depth': self.max_depth,
+            }
+
+
+class Dispatcher():
+    """Runs submitted tasks on a fixed set of matcher threads fed by a bounded queue."""
+
+    def __init__(self, workers=1, queue_size=DEFAULT_QUEUE_SIZE, mode='queue', name='Matcher'):
+        if mode not in MODES:
+            raise ValueError('unknown dispatch mode: ' + str(mode))
+        self.mode = mode
+        self.queue = Queue(queue_size)
+        self.closed = False
+        self.stats = DispatchStats()
+        self.threads = []
+        if mode == 'queue':
+            for n in range(max(1, workers)):
+                thread = Thread(target=self._work, name=name + ' ' + str(n), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def depth(self):
+        """Number of tasks waiting in the queue."""
+        return self.queue.qsize()
+
+    def submit(self, fn, *args, items=1):
+        """Schedule fn(*args) and return a Future for it. items is the number of sectors in the task."""
+        if self.closed:
+            raise RuntimeError('dispatcher has been shut down')
+        future = Future()
+        if self.mode == 'inline':
+            self._run(future, fn, args)
+            with self.stats.lock:
+                self.stats.tasks += 1
+                self.stats.items += items
+            return future
+
+        start = time.perf_counter()
+        blocked = 0.0
+        while True:
+            try:
+                self.queue.put_nowait((future, fn, args))
+                break
+            except Full:
+                pass
+            wait_start = time.perf_counter()
+            try:
+                self.queue.put((future, fn, args), timeout=0.1)
+                blocked += time.perf_counter() - wait_start
+                break
+            except Full:
+                blocked += time.perf_counter() - wait_start
+                if self.closed:
+                    cancel(future)
+                    return future
+        elapsed = time.perf_counter() - start
+        depth = self.queue.qsize()
+        with self.stats.lock:
+            self.stats.tasks += 1
+            self.stats.items += items
+            self.stats.submit_seconds += elapsed
+            self.stats.blocked_seconds += blocked
+            self.stats.max_depth = max(self.stats.max_depth, depth)
+        return future
+
+    def _run(self, future, fn, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.perf_counter()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        elapsed = time.perf_counter() - start
+        with self.stats.lock:
+            self.stats.run_seconds += elapsed
+
+    def _work(self):
+        while True:
+            try:
+                future, fn, args = self.queue.get(timeout=0.1)
+            except Empty:
+                if self.closed:
+                    return
+                continue
+            if self.closed:
+                cancel(future)
+                continue
+            self._run(future, fn, args)
+
+    def shutdown(self):
+        """Stop accepting work and cancel everything still queued. Running tasks are not waited for."""
+        self.closed = True
+        while True:
+            try:
+                future, _, _ = self.queue.get_nowait()
+            except Empty:
+                break
+            cancel(future)
@@ -0,0 +1,35 @@
+"""Minimal observer used by the engine in place of Qt signals."""
+from threading import Lock
+from time import perf_counter
+
+
+class Signal():
+    """A list of callbacks invoked synchronously, on the emitting thread, by emit().
+
+    Consumers that need to run on a particular thread (such as the GUI) are
+    responsible for marshalling the call themselves. With a profiler, the time
+    spent in the slots counts towards its emit stage.
+    """
+
+    def __init__(self, profiler=None):
+        self.slots = []
+        self.lock = Lock()
+        self.profiler = profiler
+
+    def connect(self, slot):
+        with self.lock:
+            self.slots = self.slots + [slot]
+
+    def disconnect(self, slot):
+        with self.lock:
+            self.slots = [s for s in self.slots if s != slot]
+
+    def emit(self, *args):
+        if self.profiler is None:
+            for slot in self.slots:
+                slot(*args)
+            return
+        start = perf_counter()
+        for slot in self.slots:
+            slot(*args)
+        self.profiler.record('emit', start)
@@ -5,8 +5,6 @@ Returns:
 """
 # Standard library imports
 from threading import Lock
-from shutil import disk_usage
-from multiprocessing import cpu_count
 import sys
 # Third-party imports
 from PyQt5 import QtCore
@@ -14,67 +12,61 @@ from PyQt5.QtWidgets import QGridLayout, QHBoxLayout, \
     QLabel, QLineEdit, QPushButton, \
     QWidget, QProgressBar, QMessageBox, \
     QVBoxLayout, QGroupBox
-from wmi import WMI
 
 # Local imports
-from recoverability import Job, Worker, SECTOR_SIZE, SAMPLE_WINDOW
+from recoverability import Job, SourceFile, SECTOR_SIZE
+from performance import SAMPLE_WINDOW
+from checkpoint import DEFAULT_INTERVAL
+from reads import device_size
 
-threadpool = QtCore.QThreadPool.globalInstance()
-threadpool.setMaxThreadCount(cpu_count() - 3)
 inspection_gui_manipulation_mutex = Lock()
 
 
-class SourceFile():
-    """represents information about the user's selected file that is relevant to both the UI and the main program."""
+class JobBridge(QtCore.QObject):
+    """Re-emits the engine signals of a Job as Qt signals.
 
-    def __init__(self, path):
-        # the remaining sectors list will start as a list where each element represents a sector in the source file.
-        self.remaining_sectors = self.to_sectors(path)
-
-        # the address table will start as a list of empty lists
-        self.address_table = [[] for _ in range(len(self.remaining_sectors))]
-
-        # separate path into file and location
-        split = path.split('/')
-        self.dir = '/'.join(split[0:(len(split) - 1)])
-        self.name = split[len(split) - 1]
-
-    def to_sectors(self, path):
-        """
-        splits the source file into a list of sectors
-
-        Args:
-            path (string): path to the source file
+    Engine signals are emitted on the job's worker threads; re-emitting them as Qt
+    signals queues the connected slots onto the GUI thread.
+    """
 
-        Returns:
-            list:   each element represents SECTOR_SIZE bytes
-                    (i.e. one sector) of the source file. The final sector
-                    is padded with zeroes to maintain uniform size.
-        """
-        fobj = open(path, "rb")
-        fobj.seek(0)
-        result = []
-        while True:
-            # read SECTOR_SIZE bytes
-            cur = fobj.read(SECTOR_SIZE)
-            if cur == b'':
-                # finish at EOF
-                break
-            elif len(cur) == SECTOR_SIZE:
-                # populate list with an element representing SECTOR_SIZE bytes
-                result.append(cur)
-            else:
-                # zfill for final sector -- to achieve uniform sector length even
-                # when the data is less than SECTOR_SIZE
-                result.append(
-                    (bytes.fromhex((cur.hex()[::-1].zfill(1024)[::-1]))))
-        return result
+    success_signal = QtCore.pyqtSignal(tuple)
+    finished_signal = QtCore.pyqtSignal(tuple)
+    test_run_progress_signal = QtCore.pyqtSignal(float)
+    test_run_finished_signal = QtCore.pyqtSignal()
+    new_inspection_signal = QtCore.pyqtSignal(tuple)
+    skim_progress_signal = QtCore.pyqtSignal(float)
+    resuming_signal = QtCore.pyqtSignal()
+    inspection_progress_signal = QtCore.pyqtSignal(str, tuple)
+    inspection_finished_signal = QtCore.pyqtSignal(str, float)
+
+    def __init__(self, job):
+        super().__init__()
+        job.success_signal.connect(self.success_signal.emit)
+        # an extent shows as a match of its last sector
+        job.extent_signal.connect(lambda data: self.success_signal.emit((data[0], data[1] + data[3] - 1)))
+        job.finished_signal.connect(self.finished_signal.emit)
+        job.test_run_progress_signal.connect(self.test_run_progress_signal.emit)
+        job.test_run_finished_signal.connect(self.test_run_finished_signal.emit)
+        job.skim_reader.new_inspection_signal.connect(self.relay_inspection)
+        job.skim_reader.progress_signal.connect(self.skim_progress_signal.emit)
+        job.skim_reader.resuming_signal.connect(self.resuming_signal.emit)
+
+    def relay_inspection(self, data):
+        # runs on the engine thread before the readers start, so the GUI sees the
+        # new inspection before any of its progress or completion
+        for reader in data[1:]:
+            id_str = reader.id_tuple[0] + reader.id_tuple[2]
+            reader.progress_signal.connect(
+                lambda info, id_str=id_str: self.inspection_progress_signal.emit(id_str, info))
+            reader.finished_signal.connect(
+                lambda rate, id_str=id_str: self.inspection_finished_signal.emit(id_str, rate))
+        self.new_inspection_signal.emit(data)
 
 
 class ChildInspection(QtCore.QObject):
     """Represents information relevant to the UI about a close inspection taking place in the main program"""
 
-    def __init__(self, id_tuple, sector_limit, average_fn, seconds_fn):
+    def __init__(self, id_tuple, sector_limit):
         """Construct a ChildInspection object.
 
         Args:
@@ -82,9 +74,6 @@ class ChildInspection(QtCore.QObject):
                                 second element is the decimal midpoint of the parent inspection (int)
                                 third element is the same address in hexidecimal (string)
             sector_limit (int): the total number of sectors that the child inspection will read before stopping
-            seconds_fn (callable): this will be a pointer to some InspectionPerformanceCalc object's get_remaining_seconds() method.
-                                    in order to call this function only on the slowest child inspection, it is stored as a member so that this
-                                    evaluation may be made later, once the slowest object in current_inspections is determined.
         """
         super().__init__()
 
@@ -102,9 +91,6 @@ class ChildInspection(QtCore.QObject):
         self.finished = False
         self.sibling = None
         self.sector_limit = sector_limit
-        self.avg = 0
-        self.average_fn = average_fn
-        self.seconds_fn = seconds_fn
 
     @QtCore.pyqtSlot(tuple)
     def update(self, info):
@@ -147,18 +133,17 @@ class MainWindow(QWidget):
         super().__init__()
         self.setWindowTitle("recoverability")
 
-        # create QThread for main program, to be started later
-        self.job_thread = QtCore.QThread()
+        # the main program is created and started later, in its own thread
         self.job = None
+        self.bridge = None
 
         # store information from previous dialog
         self.file = SourceFile(path)
         if selected_vol.isnumeric():
             self.vol_path = '\\\\.\\PhysicalDrive' + selected_vol
-            self.vol_size = int((WMI().Win32_DiskDrive(Index=selected_vol))[0].size)
         else:
             self.vol_path = r"\\." + "\\" + selected_vol + ":"
-            self.vol_size = disk_usage(selected_vol + ':\\').total
+        self.vol_size = device_size(self.vol_path)
 
         # begin creating UI elements. Those that will need to be accessed or modified elsewhere in the program
         # are stored as attributes to the MainWindow object.
@@ -171,8 +156,8 @@ class MainWindow(QWidget):
         source_file_grid.addWidget(QLabel('Location:'), 1, 0)
         source_file_grid.addWidget(QLabel(self.file.dir), 1, 1)
         source_file_grid.addWidget(QLabel('Size:'), 2, 0)
-        source_file_grid.addWidget(QLabel(str(len(self.file.remaining_sectors))
-                                          + " sectors (" + str(SECTOR_SIZE * (len(self.file.remaining_sectors)))
+        source_file_grid.addWidget(QLabel(str(self.file.total_sectors)
+                                          + " sectors (" + str(SECTOR_SIZE * (self.file.total_sectors))
                                           + " bytes)"), 2, 1)
         source_file_box.setLayout(source_file_grid)
 
@@ -183,10 +168,10 @@ class MainWindow(QWidget):
         self.reconstructed_file_info.setAlignment(
             QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         self.reconstructed_file_info.setText(("No matches yet\n\n")
-                                             + ("0/" + (str(len(self.file.remaining_sectors)))
+                                             + ("0/" + (str(self.file.total_sectors))
                                                 + " = " + "0.00%"
                                                 + "\n\nTesting equality for " +
-                                                (str(len(self.file.remaining_sectors)))
+                                                (str(self.file.total_sectors))
                                                 + " remaining sectors..."))
         reconstructed_file_hbox.addWidget(self.reconstructed_file_info)
         reconstructed_file_box.setLayout(reconstructed_file_hbox)
@@ -230,7 +215,8 @@ class MainWindow(QWidget):
 
         # prepare inspection logic
         self.current_inspections = {}
-        self.current_slowest_inspection = None
+        self.time_known = False     # whether the job's telemetry could estimate the time remaining
+        self.inspection_rate = 0
 
         # create and populate the final row, with a start button and hex input
         start_hbox = QHBoxLayout()
@@ -265,13 +251,13 @@ class MainWindow(QWidget):
         If the skim is paused, (paused) is concatenated to the output.
         """
         # TODO create blocking condition for rapid clicks
-        if hasattr(self, 'job'):
+        if self.job is not None:
             if not self.current_inspections:
                 self.skim_address_button.setText(
-                    hex(self.job.skim_reader.fobj.tell()))
+                    hex(self.job.skim_reader.position))
             else:
                 self.skim_address_button.setText(
-                    hex(self.job.skim_reader.fobj.tell()) + ' (paused)')
+                    hex(self.job.skim_reader.position) + ' (paused)')
         else:
             self.skim_address_button.setText("Skim has not been started.")
 
@@ -280,47 +266,21 @@ class MainWindow(QWidget):
             'Display current address in skim'))
 
     def request_averages(self):
-        """.. . . . . ..  . and Update skim performance statistics in the main window
-        """
-        if not self.current_inspections:
-            data = self.job.skim_reader.perf.calculate_average()
-            # first element is a float representing an average skimming time for some interval.
-            # second element is an int representing the estimated skim time remaining based on this average.
-            avg = data[0] * self.job.jump_sectors
-            estimate = data[1]
-            self.sector_average.setText("Average sectors skimmed per " + str(SAMPLE_WINDOW) + " seconds: "
-                                        + str(int(avg)) + '\n(' + str(int(data[0])) + ' read)')
+        """Update the throughput and time remaining shown in the main window from the job's telemetry."""
+        metrics = self.job.telemetry.snapshot()
+        rates = metrics['rates']
+        probes = rates['probes_per_second'] or 0
+        self.inspection_rate = rates['inspected_units_per_second'] or 0
+        self.sector_average.setText("Sectors skimmed per second: " + str(int(probes * (self.job.jump_sectors + 1)))
+                                    + '\n(' + str(int(probes)) + ' read, '
+                                    + '{:.1f}'.format((rates['bytes_per_second'] or 0) / 2 ** 20) + ' MiB/s)')
+        eta = metrics['eta_seconds']
+        seconds = eta['inspections'] if self.current_inspections else eta['total']
+        self.time_known = seconds is not None
+        if self.time_known:
+            # update time remaining by resetting to 0 then adding the new estimate
             self.time.setHMS(0, 0, 0)
-            self.time = self.time.addSecs(estimate)
-
-            return
-
-        inspection_gui_manipulation_mutex.acquire()
-
-        for key in self.current_inspections:
-            insp = self.current_inspections[key]
-            insp.avg = insp.average_fn()
-
-        # now that fresh averages have been collected for all current inspections,
-        # determine the slowest inspection
-        slowest_id = max(self.current_inspections,
-                         key=lambda x: self.current_inspections[x].avg)
-        self.current_slowest_inspection = self.current_inspections[slowest_id]
-
-        # get the estimated seconds remaining in that inspection
-        secs_remaining = self.current_slowest_inspection.seconds_fn()
-
-        # quit if no estimate is possible yet
-        if secs_remaining == 0:
-            return
-
-        # update time remaining by resetting to 0 then adding the new estimate
-        self.time.setHMS(0, 0, 0)
-        try:
-            self.time = self.time.addSecs(secs_remaining)
-        except OverflowError:
-            print("There has been an error with the estimated time remaining.")
-        inspection_gui_manipulation_mutex.release()
+            self.time = self.time.addSecs(min(int(seconds), 24 * 3600 - 1))
 
     @QtCore.pyqtSlot()
     def draw_clock(self):
@@ -333,16 +293,15 @@ class MainWindow(QWidget):
         self.cur_secs += 1
         if self.cur_secs >= SAMPLE_WINDOW:
             self.cur_secs = 0
-            threadpool.start(Worker(self.request_averages))
+            self.request_averages()
 
         # update clock UI appropriately according to the current status of the main program
         if self.current_inspections:
-            if self.current_slowest_inspection:
+            if self.time_known:
                 self.time = self.time.addSecs(-1)
                 time_str = self.time.toString("h:mm:ss")
-                self.time_label.setText("Average sectors parsed in " +
-                                        str(SAMPLE_WINDOW) + " seconds: " +
-                                        "{:.2f}".format(self.current_slowest_inspection.avg) +
+                self.time_label.setText("Sectors inspected per second: " +
+                                        "{:.2f}".format(self.inspection_rate) +
                                         "\n" + time_str + " remaining to finish current close inspections.\n")
             else:
                 self.time_label.setText(self.time.toString("h:mm:ss") +
@@ -355,12 +314,14 @@ class MainWindow(QWidget):
     def closeEvent(self, event):
         """Overridden method to warn the user about closing the window while still in progress."""
         # warning is only needed if the main program is still in progress; it is sufficient to check for existence of self.job
-        if hasattr(self, 'job'):
+        if self.job is not None:
             if not self.job.finished:
                 reply = QMessageBox.question(self, 'Window Close', 'Searching is not finished. Are you sure you want to close the window?',
                                              QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
 
                 if reply == QMessageBox.Yes:
+                    # keep the work done so far; the scan can be resumed from the job directory
+                    self.job.save_checkpoint()
                     event.accept()
                     sys.exit()
                 else:
@@ -388,10 +349,8 @@ class MainWindow(QWidget):
         self.skim_progress_bar.setFormat("Paused")
 
         # create ChildInspection objects
-        forward_gui = ChildInspection(forward.id_tuple, forward.sector_limit,
-                                      forward.perf.calculate_average, forward.perf.get_remaining_seconds)
-        backward_gui = ChildInspection(backward.id_tuple, backward.sector_limit,
-                                       backward.perf.calculate_average, backward.perf.get_remaining_seconds)
+        forward_gui = ChildInspection(forward.id_tuple, forward.sector_limit)
+        backward_gui = ChildInspection(backward.id_tuple, backward.sector_limit)
         forward_gui.sibling = backward_gui
         backward_gui.sibling = forward_gui
 
@@ -420,13 +379,31 @@ class MainWindow(QWidget):
         self.current_inspections[forward_gui.id_str] = forward_gui
         self.current_inspections[backward_gui.id_str] = backward_gui
 
-        # connect signals to slots
-        forward.progress_signal.connect(forward_gui.update)
-        backward.progress_signal.connect(backward_gui.update)
-        forward.finished_signal.connect(
-            lambda success_rate: self.child_inspection_finished(forward_gui, success_rate))
-        backward.finished_signal.connect(
-            lambda success_rate: self.child_inspection_finished(backward_gui, success_rate))
+        # progress and completion of the readers arrive through self.bridge, keyed by id_str
+
+    @QtCore.pyqtSlot(str, tuple)
+    def inspection_progress(self, id_str, info):
+        """Show the progress of an inspection. Updates for an inspection without a UI are dropped.
+
+        Args:
+            id_str (string): the id_str of the inspection's ChildInspection
+            info (tuple): see ChildInspection.update
+        """
+        reader = self.current_inspections.get(id_str)
+        if reader is not None:
+            reader.update(info)
+
+    @QtCore.pyqtSlot(str, float)
+    def inspection_finished(self, id_str, success_rate):
+        """Clean up after an inspection, if it has a UI.
+
+        Args:
+            id_str (string): the id_str of the inspection's ChildInspection
+            success_rate (float): the final success rate of the inspection
+        """
+        reader = self.current_inspections.get(id_str)
+        if reader is not None:
+            self.child_inspection_finished(reader, success_rate)
 
     def child_inspection_finished(self, reader, success_rate):
         """Clean up after a child inspection has completed.
@@ -452,7 +429,7 @@ class MainWindow(QWidget):
                 text + " [completed, " + "{:.2f}".format(overall_success_rate * 100) + "% success]")
 
         # this inspection should no longer be included in various calculations, so delete the reference
-        del self.current_inspections[reader.id_str]
+        self.current_inspections.pop(reader.id_str, None)
         inspection_gui_manipulation_mutex.release()
 
         # go through the entire list of completed inspection labels and only display the most recent 5.
@@ -527,25 +504,27 @@ class MainWindow(QWidget):
         self.skim_progress_bar.setFormat("Loading...")
         self.skim_progress_bar.setAlignment(QtCore.Qt.AlignCenter)
 
-        # initialize main program's Job object in its own QThread. This will be the powerhouse of the program.
-        self.job = Job(self.vol_path, self.vol_size, self.file, validated_start_address)
-        self.job.moveToThread(self.job_thread)
+        # initialize main program's Job object. This will be the powerhouse of the program.
+        self.job = Job(self.vol_path, self.vol_size, self.file, validated_start_address,
+                       checkpoint_interval=DEFAULT_INTERVAL)
+        self.bridge = JobBridge(self.job)
 
         # connect the Job's various signals to appropriate slots
-        self.job.success_signal.connect(self.file_gui_update)
-        self.job.finished_signal.connect(self.job_finished)
-        self.job.test_run_progress_signal.connect(
+        self.bridge.success_signal.connect(self.file_gui_update)
+        self.bridge.finished_signal.connect(self.job_finished)
+        self.bridge.test_run_progress_signal.connect(
             self.skim_progress_bar.setValue)
-        self.job.test_run_finished_signal.connect(self.test_run_finished)
-        self.job.skim_reader.new_inspection_signal.connect(
+        self.bridge.test_run_finished_signal.connect(self.test_run_finished)
+        self.bridge.new_inspection_signal.connect(
             self.initialize_inspection_gui)
-        self.job.skim_reader.progress_signal.connect(self.skim_gui_update)
-        self.job.skim_reader.resuming_signal.connect(
+        self.bridge.inspection_progress_signal.connect(self.inspection_progress)
+        self.bridge.inspection_finished_signal.connect(self.inspection_finished)
+        self.bridge.skim_progress_signal.connect(self.skim_gui_update)
+        self.bridge.resuming_signal.connect(
             lambda: self.skim_progress_bar.setTextVisible(False))
 
-        # run the main program
-        self.job_thread.started.connect(self.job.run)
-        self.job_thread.start()
+        # run the main program in its own thread
+        self.job.start()
 
     @QtCore.pyqtSlot()
     def test_run_finished(self):
@@ -600,13 +579,14 @@ class MainWindow(QWidget):
 
         self.close()
 
-    @QtCore.pyqtSlot(int)
-    def file_gui_update(self, i):
+    @QtCore.pyqtSlot(tuple)
+    def file_gui_update(self, data):
         """Update information shown in the "Reconstructed file" area of the main window.
 
         Args:
-            i (int): last matched sector of source file
+            data (tuple): the id of the matched source file and its last matched sector
         """
+        i = data[1]
         self.reconstructed_file_info.setText(("Last match: sector " + str(i) + "\n\n")
                                              + (str(self.job.done_sectors) + "/" + str(self.job.total_sectors)
                                                 + " = " +
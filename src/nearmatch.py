@@ -0,0 +1,191 @@
+"""Approximate matching of units that differ from a source unit in a few bits, as on bit-rotted media.
+
+Each unit is split into max_distance + 1 bands of whole 64-bit words. Flipping at
+most max_distance bits changes at most max_distance bands, so a unit within that
+Hamming distance of a source unit still equals it in at least one band: looking
+up a hash of each band finds the source units it may be near without comparing
+with all of them, and only those are measured bit by bit. Batches are hashed
+with NumPy where it is installed, like the exact prefilter; without it each unit
+is hashed on its own, to the same keys.
+
+Bands that many source units share (runs of zeroes, repeated headers) are left
+out of the index, so a unit whose only intact bands are such is missed. Source
+units within 2 * max_distance bits of a meaningless unit aren't indexed at all:
+blank disk units would near-match them.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+from sources import SECTOR_SIZE, SectorIndex, UNMATCHED, meaningless
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_MAX_DISTANCE = 8
+# a band value shared by more source units than this says too little to be indexed
+MAX_BUCKET = 16
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+_MIX = 0x9E3779B97F4A7C15
+_SEED = 0x632BE59BD9B4E019
+
+
+def distance(a, b):
+    """Return the number of bits in which a and b, of the same length, differ."""
+    return bin(int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).count('1')
+
+
+class NearIndex():
+    """Index of the bands of every meaningful unit of files, to find those within max_distance bits of a unit.
+
+    Args:
+        files (list): the SourceFiles searched for, with their address tables.
+        max_distance (int): the largest Hamming distance, in bits, of a near match.
+        sector_size (int): the unit the files are split into; a multiple of 8 bytes.
+    """
+
+    def __init__(self, files, max_distance=DEFAULT_MAX_DISTANCE, sector_size=SECTOR_SIZE):
+        words = sector_size // 8
+        if sector_size % 8 or not 0 < max_distance < words:
+            raise ValueError('the near-match distance must be between 1 and ' + str(words - 1) + ' bits')
+        self.files = files
+        self.max_distance = max_distance
+        self.sector_size = sector_size
+        self.bands = max_distance + 1
+        self.edges = [words * band // self.bands for band in range(self.bands + 1)]
+        self.meaningless = meaningless(sector_size)
+        # the bands of meaningless units match blank space everywhere
+        blank = {key for unit in self.meaningless for key in self.unit_keys(unit)}
+        self.starts = []
+        keys = array('Q')
+        positions = array('Q')
+        position = 0
+        for file in files:
+            self.starts.append(position)
+            for block in file.blocks():
+                block_keys, units = self.block_keys(block, position)
+                keys.extend(block_keys)
+                positions.extend(units)
+                position += len(block) // sector_size
+        keys, order = SectorIndex.sort(keys)
+        self.keys, self.positions = self.drop_common(keys, self.permute(positions, order), blank)
+        self.sorted_keys = np.frombuffer(self.keys, dtype=np.uint64) if np is not None and self.keys else None
+
+    def block_keys(self, block, position):
+        """Return (keys, positions) as arrays, the keys of the bands of each unit of block that may be
+        near-matched and, for each key, the flat position of its unit, block starting at position."""
+        size = self.sector_size
+        limit = 2 * self.max_distance
+        bits = size * 8
+        if np is not None:
+            rows = np.frombuffer(block, dtype=np.uint8).reshape(-1, size)
+            if hasattr(np, 'bitwise_count'):
+                ones = np.bitwise_count(rows.view(np.uint64)).sum(axis=1)
+            else:
+                ones = np.unpackbits(rows, axis=1).sum(axis=1)
+            keep = np.flatnonzero((ones > limit) & (ones < bits - limit))
+            keys, positions = array('Q'), array('Q')
+            keys.frombytes(self.row_keys(rows[keep]).tobytes())
+            positions.frombytes(np.repeat(keep.astype(np.uint64) + np.uint64(position), self.bands).tobytes())
+            return keys, positions
+        keys, positions = array('Q'), array('Q')
+        for n in range(len(block) // size):
+            unit = block[n * size:(n + 1) * size]
+            ones = bin(int.from_bytes(unit, 'little')).count('1')
+            if limit < ones < bits - limit:
+                keys.extend(self.unit_keys(unit))
+                positions.extend([position + n] * self.bands)
+        return keys, positions
+
+    @staticmethod
+    def permute(values, order):
+        """Return array('Q') of values in order."""
+        if np is not None and len(values):
+            return array('Q', np.frombuffer(values, dtype=np.uint64)[np.frombuffer(order, dtype=np.uint64)].tobytes())
+        return array('Q', (values[p] for p in order))
+
+    @staticmethod
+    def drop_common(keys, positions, blank):
+        """Return keys, sorted, and positions without the keys in blank or held by more than MAX_BUCKET entries."""
+        if np is not None and len(keys):
+            flat = np.frombuffer(keys, dtype=np.uint64)
+            starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+            sizes = np.diff(np.r_[starts, len(flat)])
+            dropped = (sizes > MAX_BUCKET) | np.isin(flat[starts], np.array(sorted(blank), dtype=np.uint64))
+            keep = np.repeat(~dropped, sizes)
+            return (array('Q', flat[keep].tobytes()),
+                    array('Q', np.frombuffer(positions, dtype=np.uint64)[keep].tobytes()))
+        kept_keys, kept_positions = array('Q'), array('Q')
+        lo = 0
+        while lo < len(keys):
+            hi = bisect_right(keys, keys[lo], lo)
+            if hi - lo <= MAX_BUCKET and keys[lo] not in blank:
+                kept_keys.extend(keys[lo:hi])
+                kept_positions.extend(positions[lo:hi])
+            lo = hi
+        return kept_keys, kept_positions
+
+    def unit_keys(self, unit):
+        """Return the keys of the bands of unit."""
+        words = memoryview(unit).cast('Q')
+        keys = []
+        for band in range(self.bands):
+            h = (band + 1) * _SEED & _MASK
+            for word in words[self.edges[band]:self.edges[band + 1]]:
+                h = (h ^ word) * _MIX & _MASK
+            keys.append(h ^ (h >> 31))
+        return keys
+
+    def row_keys(self, rows):
+        """Return the keys of the bands of each row of rows, an (n, sector_size) uint8 array, as (n, bands)."""
+        words = rows.view(np.uint64)
+        keys = np.empty((len(rows), self.bands), dtype=np.uint64)
+        mix = np.uint64(_MIX)
+        for band in range(self.bands):
+            h = np.full(len(rows), (band + 1) * _SEED & _MASK, dtype=np.uint64)
+            for column in range(self.edges[band], self.edges[band + 1]):
+                h = (h ^ words[:, column]) * mix
+            keys[:, band] = h ^ (h >> np.uint64(31))
+        return keys
+
+    def candidates(self, sectors):
+        """Return the positions in sectors of the meaningful units sharing a band with some source unit."""
+        if not sectors or not self.keys:
+            return []
+        if self.sorted_keys is not None:
+            keys = self.row_keys(np.frombuffer(b''.join(sectors), dtype=np.uint8).reshape(-1, self.sector_size))
+            found = self.sorted_keys[np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.sorted_keys) - 1)]
+            hits = np.flatnonzero((found == keys).any(axis=1)).tolist()
+        else:
+            hits = [n for n, sector in enumerate(sectors) if any(self.lookup(key)[1] for key in self.unit_keys(sector))]
+        return [n for n in hits if sectors[n] not in self.meaningless]
+
+    def lookup(self, key):
+        """Return (first entry holding key, number of entries holding it)."""
+        lo = bisect_left(self.keys, key)
+        return lo, bisect_right(self.keys, key, lo) - lo
+
+    def nearest(self, sector):
+        """Return [(distance, file id, source index), ...], nearest first, for the unmatched source units within
+        max_distance bits of sector."""
+        if sector in self.meaningless:
+            return []
+        near = []
+        seen = set()
+        for key in self.unit_keys(sector):
+            lo, count = self.lookup(key)
+            for position in self.positions[lo:lo + count]:
+                if position in seen:
+                    continue
+                seen.add(position)
+                file_id = bisect_right(self.starts, position) - 1
+                file = self.files[file_id]
+                i = position - self.starts[file_id]
+                if file.address_table[i] != UNMATCHED:
+                    continue
+                d = distance(sector, file.sector(i))
+                if d <= self.max_distance:
+                    near.append((d, file_id, i))
+        return sorted(near)
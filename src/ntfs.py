@@ -0,0 +1,385 @@
+"""NTFS metadata: where the file system says a source file's clusters are.
+
+The boot sector gives the volume geometry and the location of $MFT. Every MFT
+record, including those of deleted files, is decoded for its names, its data
+size and its data runs. Records whose name or size match a source file become
+candidate extents, which the job probes before any blind scanning: when the
+MFT survives, recovery takes a handful of targeted reads.
+
+Only what recovery needs is decoded. Resident data, attribute lists and
+compressed or encrypted streams are ignored; files that need them are still
+found by the skim.
+
+$Bitmap, the allocation bitmap of the volume, restricts the search: a deleted
+file's clusters are almost always marked free, so the clusters in use by live
+files need not be read at all.
+"""
+import re
+
+from ranges import RangeSet
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OEM_ID = b'NTFS    '
+FILE_SIGNATURE = b'FILE'
+# attribute types
+FILE_NAME = 0x30
+DATA = 0x80
+END = 0xFFFFFFFF
+# record header flags
+IN_USE = 0x01
+DIRECTORY = 0x02
+# size-only matches are common for small round sizes, so keep the best few per file
+MAX_CANDIDATES_PER_FILE = 32
+# MFT record numbers of the metadata files used
+MFT_RECORD = 0
+BITMAP_RECORD = 6
+# give up on a headerless MFT after this many consecutive records without a signature
+MAX_BLANK_RECORDS = 1024
+
+
+class NtfsError(Exception):
+    pass
+
+
+class BootSector():
+    """The parts of an NTFS boot sector needed to find $MFT."""
+
+    def __init__(self, data):
+        if len(data) < 512 or data[3:11] != OEM_ID:
+            raise NtfsError('not an NTFS boot sector')
+        self.bytes_per_sector = int.from_bytes(data[0x0B:0x0D], 'little')
+        sectors_per_cluster = data[0x0D]
+        if sectors_per_cluster > 0x80:    # stored as a negative power of two on large-cluster volumes
+            sectors_per_cluster = 1 << (256 - sectors_per_cluster)
+        self.cluster_size = self.bytes_per_sector * sectors_per_cluster
+        self.total_sectors = int.from_bytes(data[0x28:0x30], 'little')
+        self.mft_lcn = int.from_bytes(data[0x30:0x38], 'little')
+        self.mft_mirror_lcn = int.from_bytes(data[0x38:0x40], 'little')
+        per_record = int.from_bytes(data[0x40:0x41], 'little', signed=True)
+        # positive: clusters per record; negative: log2 of the record size in bytes
+        self.record_size = per_record * self.cluster_size if per_record > 0 else 1 << -per_record
+        if self.bytes_per_sector not in (512, 1024, 2048, 4096) or not self.cluster_size \
+                or self.record_size < self.bytes_per_sector or self.record_size > 65536:
+            raise NtfsError('implausible NTFS geometry')
+
+    @classmethod
+    def read(cls, volume, partition_offset=0):
+        return cls(volume.read(partition_offset, 512))
+
+
+def decode_runs(data, pos=0):
+    """Decode a data-run list into [(vcn, lcn, clusters), ...]. lcn is None for sparse runs."""
+    runs = []
+    vcn = lcn = 0
+    while pos < len(data) and data[pos]:
+        length_size = data[pos] & 0x0F
+        offset_size = data[pos] >> 4
+        pos += 1
+        if not 0 < length_size <= 8 or offset_size > 8 or pos + length_size + offset_size > len(data):
+            raise NtfsError('corrupt data run list')
+        length = int.from_bytes(data[pos:pos + length_size], 'little')
+        pos += length_size
+        if offset_size:
+            lcn += int.from_bytes(data[pos:pos + offset_size], 'little', signed=True)
+            pos += offset_size
+            runs.append((vcn, lcn, length))
+        else:
+            runs.append((vcn, None, length))
+        vcn += length
+    return runs
+
+
+def free_runs(bitmap, count):
+    """Yield (start, end) runs of clear bits among the first count bits of bitmap (least significant bit first)."""
+    if np is not None:
+        bits = np.unpackbits(np.frombuffer(bytes(bitmap), dtype=np.uint8), bitorder='little')[:count]
+        edges = np.flatnonzero(np.diff(np.concatenate(([1], bits, [1])).astype(np.int8)))
+        for start, end in zip(edges[0::2].tolist(), edges[1::2].tolist()):
+            yield start, end
+        return
+    start = None
+    for n, byte in enumerate(bitmap):
+        if byte in (0x00, 0xFF) and (start is None) == (byte == 0xFF):
+            continue    # a whole byte continuing the current run
+        for bit in range(n * 8, min(n * 8 + 8, count)):
+            if byte >> (bit % 8) & 1:
+                if start is not None:
+                    yield start, bit
+                    start = None
+            elif start is None:
+                start = bit
+    if start is not None:
+        yield start, count
+
+
+def apply_fixup(record, bytes_per_sector):
+    """Undo the update sequence of a record in place. Returns False if the record is torn."""
+    usa_offset = int.from_bytes(record[4:6], 'little')
+    usa_count = int.from_bytes(record[6:8], 'little')
+    if usa_offset + 2 * usa_count > len(record) or (usa_count - 1) * bytes_per_sector > len(record):
+        return False
+    usn = record[usa_offset:usa_offset + 2]
+    for n in range(1, usa_count):
+        end = n * bytes_per_sector
+        if record[end - 2:end] != usn:
+            return False
+        record[end - 2:end] = record[usa_offset + 2 * n:usa_offset + 2 * n + 2]
+    return True
+
+
+class Record():
+    """A decoded MFT record: its file names, unnamed $DATA size and data runs."""
+
+    def __init__(self, number, flags):
+        self.number = number
+        self.in_use = bool(flags & IN_USE)
+        self.directory = bool(flags & DIRECTORY)
+        self.names = []
+        self.size = None
+        self.runs = []
+
+    @classmethod
+    def parse(cls, data, number, bytes_per_sector):
+        """Decode record number from its raw bytes. Returns None for blank, torn or corrupt records."""
+        record = bytearray(data)
+        if record[:4] != FILE_SIGNATURE or not apply_fixup(record, bytes_per_sector):
+            return None
+        return cls.decode(record, number)
+
+    @classmethod
+    def decode(cls, record, number):
+        """Decode record number from its bytes, with the update sequence already undone. Returns None if
+        it is corrupt."""
+        self = cls(number, int.from_bytes(record[0x16:0x18], 'little'))
+        pos = int.from_bytes(record[0x14:0x16], 'little')
+        try:
+            while pos + 16 <= len(record):
+                kind = int.from_bytes(record[pos:pos + 4], 'little')
+                length = int.from_bytes(record[pos + 4:pos + 8], 'little')
+                if kind == END or length < 16 or pos + length > len(record):
+                    break
+                self.attribute(kind, record[pos:pos + length])
+                pos += length
+        except NtfsError:
+            return None
+        return self
+
+    def attribute(self, kind, attr):
+        non_resident = attr[8]
+        named = attr[9]
+        if kind == FILE_NAME and not non_resident:
+            content = attr[int.from_bytes(attr[0x14:0x16], 'little'):]
+            if len(content) >= 0x42:
+                length = content[0x40]
+                self.names.append(bytes(content[0x42:0x42 + 2 * length]).decode('utf-16-le', 'replace'))
+        elif kind == DATA and non_resident and not named:
+            start_vcn = int.from_bytes(attr[0x10:0x18], 'little')
+            if start_vcn == 0:
+                self.size = int.from_bytes(attr[0x30:0x38], 'little')
+            runs_offset = int.from_bytes(attr[0x20:0x22], 'little')
+            for vcn, lcn, length in decode_runs(attr, runs_offset):
+                self.runs.append((start_vcn + vcn, lcn, length))
+
+
+class Extent():
+    """A run of a candidate file: length bytes of a source file at source_offset, proposed to lie at address."""
+
+    def __init__(self, file_id, source_offset, address, length, priority, record):
+        self.file_id = file_id
+        self.source_offset = source_offset
+        self.address = address
+        self.length = length
+        self.priority = priority
+        self.record = record
+
+    def as_dict(self):
+        return {'file': self.file_id, 'source_offset': self.source_offset, 'address': self.address,
+                'length': self.length, 'priority': self.priority, 'record': self.record.number,
+                'names': self.record.names, 'deleted': not self.record.in_use}
+
+
+class NtfsVolume():
+    """An NTFS file system found at partition_offset on volume (any object with read(offset, size))."""
+
+    def __init__(self, volume, partition_offset=0, block_size=4 * 1024 * 1024):
+        self.volume = volume
+        self.partition_offset = partition_offset
+        self.block_size = block_size
+        self.boot = BootSector.read(volume, partition_offset)
+
+    def address(self, lcn):
+        return self.partition_offset + lcn * self.boot.cluster_size
+
+    def mft_runs(self):
+        """Return the data runs of $MFT itself, from record 0 or its mirror."""
+        for lcn in (self.boot.mft_lcn, self.boot.mft_mirror_lcn):
+            record = Record.parse(self.volume.read(self.address(lcn), self.boot.record_size), 0,
+                                  self.boot.bytes_per_sector)
+            if record is not None and record.runs:
+                return [(vcn, lcn, length) for vcn, lcn, length in record.runs if lcn is not None]
+        return None
+
+    def record(self, number):
+        """Return MFT record number, or None if it is unreadable."""
+        size = self.boot.record_size
+        runs = self.mft_runs() or [(0, self.boot.mft_lcn, None)]
+        offset = number * size
+        cluster = self.boot.cluster_size
+        for vcn, lcn, clusters in runs:
+            rel = offset - vcn * cluster
+            if rel >= 0 and (clusters is None or rel + size <= clusters * cluster):
+                return Record.parse(self.volume.read(self.address(lcn) + rel, size), number,
+                                    self.boot.bytes_per_sector)
+        return None
+
+    @property
+    def total_clusters(self):
+        return self.boot.total_sectors * self.boot.bytes_per_sector // self.boot.cluster_size
+
+    def bitmap(self):
+        """Return the content of $Bitmap, one bit per cluster, set if the cluster is in use.
+
+        Raises NtfsError if $Bitmap is unreadable or contradicts the rest of the metadata.
+        """
+        record = self.record(BITMAP_RECORD)
+        clusters = self.total_clusters
+        if record is None or not record.runs or record.size is None or record.size * 8 < clusters:
+            raise NtfsError('corrupt $Bitmap record')
+        cluster = self.boot.cluster_size
+        data = bytearray()
+        for vcn, lcn, length in sorted(record.runs):
+            if vcn * cluster != len(data):
+                raise NtfsError('corrupt $Bitmap record')
+            if lcn is None or lcn + length > clusters:
+                raise NtfsError('corrupt $Bitmap record')
+            start = self.address(lcn)
+            end = start + length * cluster
+            while start < end:
+                block = self.volume.read(start, min(self.block_size, end - start))
+                if not block:
+                    raise NtfsError('$Bitmap lies beyond the end of the volume')
+                data += block
+                start += len(block)
+        del data[-(-clusters // 8):]
+        # the boot sector, $MFT and $Bitmap itself can't be free on a sound volume
+        in_use = [0, self.boot.mft_lcn] + [lcn for _, lcn, _ in record.runs]
+        if any(lcn >= clusters for lcn in in_use) or any(not data[lcn // 8] >> (lcn % 8) & 1 for lcn in in_use):
+            raise NtfsError('$Bitmap marks metadata clusters as free')
+        return data
+
+    def free_space(self):
+        """Return the byte ranges of the clusters $Bitmap marks free, as a RangeSet."""
+        bitmap = self.bitmap()
+        clusters = self.total_clusters
+        free = RangeSet()
+        for start, end in free_runs(bitmap, clusters):
+            free.add(self.address(start), self.address(end))
+        return free
+
+    def records(self, wanted=None):
+        """Yield every decodable MFT record, deleted ones included.
+
+        wanted is an optional compiled bytes pattern; records in which it finds
+        nothing are skipped without being decoded. It is searched for once the
+        update sequence is undone, since the last two bytes of each sector of a
+        record are stored elsewhere until then.
+        """
+        size = self.boot.record_size
+        runs = self.mft_runs()
+        if runs is None:
+            # record 0 is lost: assume $MFT is contiguous and read until the records run out
+            runs = [(0, self.boot.mft_lcn, None)]
+        per_block = max(1, self.block_size // size)
+        for vcn, lcn, clusters in runs:
+            number = vcn * self.boot.cluster_size // size
+            start = self.address(lcn)
+            end = start + clusters * self.boot.cluster_size if clusters is not None else None
+            blank = 0
+            while end is None or start < end:
+                count = per_block if end is None else min(per_block, (end - start) // size)
+                block = bytes(self.volume.read(start, count * size))
+                if len(block) < size:
+                    break
+                for rel in range(0, len(block) - size + 1, size):
+                    if block[rel:rel + 4] != FILE_SIGNATURE:
+                        blank += 1
+                    else:
+                        blank = 0
+                        data = bytearray(block[rel:rel + size])
+                        if apply_fixup(data, self.boot.bytes_per_sector) and (wanted is None or wanted.search(data)):
+                            record = Record.decode(data, number)
+                            if record is not None:
+                                yield record
+                    number += 1
+                if end is None and blank >= MAX_BLANK_RECORDS:
+                    break
+                start += len(block) - len(block) % size
+
+    def extents(self, record, file_id, priority):
+        """Turn the allocated runs of record into Extents of source file file_id."""
+        cluster = self.boot.cluster_size
+        result = []
+        for vcn, lcn, clusters in record.runs:
+            if lcn is not None:
+                result.append(Extent(file_id, vcn * cluster, self.address(lcn), clusters * cluster, priority, record))
+        return result
+
+
+def name_pattern(name):
+    """Return a bytes pattern for name as stored in a FILE_NAME attribute, in UTF-16 and in any case,
+    since NTFS names are compared case-insensitively."""
+    parts = []
+    for char in name:
+        forms = {char.lower(), char.upper(), char}
+        encoded = sorted(re.escape(form.encode('utf-16-le')) for form in forms)
+        parts.append(encoded[0] if len(encoded) == 1 else b'(?:' + b'|'.join(encoded) + b')')
+    return b''.join(parts)
+
+
+def find_candidates(volume, files, partition_offset=0, block_size=4 * 1024 * 1024):
+    """Return the extents the MFT proposes for files, best first.
+
+    A record whose name and size both match a source file comes first, then
+    size-only matches, then name-only matches; deleted files before live ones.
+    Raises NtfsError if there is no readable NTFS file system at partition_offset.
+    """
+    ntfs = NtfsVolume(volume, partition_offset, block_size)
+    keys = []
+    for file in files:
+        keys.append(name_pattern(file.name))
+        keys.append(re.escape(file.size.to_bytes(8, 'little')))
+    wanted = re.compile(b'|'.join(keys))
+    found = [[] for _ in files]
+    for record in ntfs.records(wanted):
+        if record.directory or not record.runs:
+            continue
+        names = {name.lower() for name in record.names}
+        for file_id, file in enumerate(files):
+            name_match = file.name.lower() in names
+            size_match = record.size == file.size
+            if name_match or size_match:
+                rank = 0 if name_match and size_match else 1 if size_match else 2
+                found[file_id].append(((rank, record.in_use, record.number), record))
+    candidates = []
+    for file_id, matches in enumerate(found):
+        matches.sort(key=lambda match: match[0])
+        for (rank, _, _), record in matches[:MAX_CANDIDATES_PER_FILE]:
+            candidates += ntfs.extents(record, file_id, rank)
+    candidates.sort(key=lambda extent: extent.priority)
+    return candidates
+
+
+def search_space(volume, partition_offset=0, block_size=4 * 1024 * 1024, suspects=()):
+    """Return the parts of the partition a lost file can be in: the free clusters, plus the suspect extents
+    (those of candidate files, which may be live but broken), as a RangeSet of byte ranges.
+
+    Raises NtfsError if $Bitmap can't be trusted, in which case the whole volume must be searched.
+    """
+    space = NtfsVolume(volume, partition_offset, block_size).free_space()
+    for extent in suspects:
+        space.add(extent.address, extent.address + extent.length)
+    return space
@@ -0,0 +1,116 @@
+"""Adaptive pacing of disk reads.
+
+A Pacer decides how long a reader should pause after each read. It can hold the
+readers to a share of the device's time (a duty cycle derived from the measured
+read latency) or to an IOPS budget. On top of that it backs off when the device
+looks saturated, i.e. when read latency climbs well above the best seen so far
+for reads of a similar size, or when the consumers of the readers' output fall behind. An unthrottled
+pacer never pauses, for dedicated recovery hosts.
+"""
+import time
+from threading import Lock
+
+# read latency this many times the baseline means the device is saturated
+SATURATION_RATIO = 3.0
+# a backlog above this fraction means the consumers can't keep up
+BACKLOG_LIMIT = 0.75
+# weight of the newest sample in the latency average
+EWMA_ALPHA = 0.2
+# the baseline drifts up by this factor per sample, so it can follow a device that got slower for good
+BASELINE_DRIFT = 1.001
+# reads faster than this are served from a cache and never count as saturation
+SATURATION_FLOOR = 0.002
+MIN_BACKOFF = 0.001
+MAX_BACKOFF = 0.5
+
+
+class Pacer():
+    """Computes and applies the pause after each read. Safe to share between readers.
+
+    Args:
+        share (float): fraction of the device's time the readers may use, in (0, 1].
+        iops (float): maximum number of reads per second, or None for no limit.
+        adaptive (bool): whether to back off on saturation and backlog.
+        backlog (callable): returns how full the consumers' queue is, from 0 to 1.
+    """
+
+    def __init__(self, share=1.0, iops=None, adaptive=True, backlog=None):
+        if not 0 < share <= 1:
+            raise ValueError('share must be in (0, 1]')
+        self.share = share
+        self.iops = iops
+        self.adaptive = adaptive
+        self.backlog = backlog
+        self.lock = Lock()
+        # per power-of-two read size: [EWMA of seconds per read, best recent EWMA]
+        self.latencies = {}
+        self.backoff = 0.0
+        self.next_slot = 0.0    # earliest time the next read may start under the IOPS budget
+        self.paused_seconds = 0.0
+
+    @classmethod
+    def unthrottled(cls):
+        return cls(adaptive=False)
+
+    @property
+    def throttled(self):
+        return self.adaptive or self.share < 1 or self.iops is not None
+
+    def observe(self, nbytes, seconds):
+        """Fold a read into the latency averages and return whether the device looks saturated."""
+        stats = self.latencies.get(nbytes.bit_length())
+        if stats is None:
+            self.latencies[nbytes.bit_length()] = [seconds, seconds]
+            return False
+        stats[0] += EWMA_ALPHA * (seconds - stats[0])
+        stats[1] = min(stats[1] * BASELINE_DRIFT, stats[0])
+        return stats[0] > max(stats[1] * SATURATION_RATIO, SATURATION_FLOOR)
+
+    def delay(self, nbytes, seconds):
+        """Record a read of nbytes that took seconds and return how long to pause before the next one."""
+        if not self.throttled:
+            return 0.0
+        with self.lock:
+            delay = seconds * (1 - self.share) / self.share
+            if self.iops:
+                # each read reserves the next free slot in the budget
+                now = time.monotonic()
+                self.next_slot = max(self.next_slot, now) + 1 / self.iops
+                delay = max(delay, self.next_slot - now)
+            if self.adaptive:
+                saturated = self.observe(nbytes, seconds)
+                behind = self.backlog is not None and self.backlog() > BACKLOG_LIMIT
+                if saturated or behind:
+                    self.backoff = min(MAX_BACKOFF, max(MIN_BACKOFF, self.backoff * 2))
+                else:
+                    self.backoff = self.backoff / 2 if self.backoff > MIN_BACKOFF else 0.0
+                delay += self.backoff
+            self.paused_seconds += delay
+            return delay
+
+    def pace(self, nbytes, seconds):
+        """Record a read and sleep for as long as the pacer asks."""
+        delay = self.delay(nbytes, seconds)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class PacedVolume():
+    """Wraps a volume so that every read is timed and followed by the pause its Pacer asks for."""
+
+    def __init__(self, volume, pacer):
+        self.volume = volume
+        self.pacer = pacer
+
+    @property
+    def shared(self):
+        return self.volume.shared
+
+    def read(self, offset, size):
+        start = time.perf_counter()
+        data = self.volume.read(offset, size)
+        self.pacer.pace(len(data), time.perf_counter() - start)
+        return data
+
+    def close(self):
+        self.volume.close()
@@ -1,69 +1,67 @@
-from math import ceil
-from PyQt5 import QtCore
-
-SAMPLE_WINDOW = 5
-
-class PerformanceCalculator(QtCore.QObject):
-
-    def __init__(self, volume_size, jump_size, jump_sectors, **kwargs):
-        super().__init__()
-        try:
-            self.avg = kwargs['init_avg']
-        except KeyError:
-            self.avg = 0
-        self.jump_sectors = jump_sectors
-        self.total_sectors_to_read = ceil(volume_size / jump_size)
-        self.cur_sectors_read = 0
-        self.total_sectors_read = 0
-
-    def calculate_average(self):
-        if self.avg > 0:
-            self.avg += self.cur_sectors_read
-            self.avg = (self.avg / 2)
-        else:
-            self.avg += self.cur_sectors_read
-        self.cur_sectors_read = 0
-        return (self.avg, self.get_remaining_seconds())
-
-    def get_remaining_seconds(self):
-        try:
-            return SAMPLE_WINDOW * self.total_sectors_to_read / self.avg
-        except ZeroDivisionError:
-            return 0
-
-    def increment(self):
-        self.cur_sectors_read += 1
-        self.total_sectors_read += 1
-        return self.total_sectors_read / self.total_sectors_to_read
-
-
-class InspectionPerformanceCalc(QtCore.QObject):
-
-    def __init__(self, total_sectors, id_str):
-        super().__init__()
-        self.id_str = id_str
-        self.avg = 0
-        self.sample_size = 1000
-        self.cur_sectors_read = 0
-        self.total_sectors_read = 0
-        self.total_sectors_to_read = total_sectors
-
-    def calculate_average(self):
-        if self.avg > 0:
-            self.avg += self.cur_sectors_read
-            self.avg = (self.avg / 2)
-        else:
-            self.avg += self.cur_sectors_read
-        self.cur_sectors_read = 0
-        return self.avg
-
-    def increment(self):
-        self.cur_sectors_read += 1
-        self.total_sectors_read += 1
-        return self.total_sectors_read / self.total_sectors_to_read
-
-    def get_remaining_seconds(self):
-        try:
-            return SAMPLE_WINDOW * self.total_sectors_to_read / self.avg
-        except ZeroDivisionError:
-            return 0
+"""Progress counters and the sampler that publishes them.
+
+Readers only bump plain counters, each owned by a single reader thread, so
+counting costs next to nothing and needs no lock. A Sampler thread reads them
+at a fixed rate and publishes a snapshot, however fast the readers go. Rates
+and time estimates are worked out from the samples by telemetry.Telemetry.
+"""
+from math import ceil
+from threading import Event, Thread
+
+# seconds between refreshes of the time remaining shown in the GUI
+SAMPLE_WINDOW = 5
+# seconds between progress snapshots
+SAMPLE_INTERVAL = 0.1
+
+class PerformanceCalculator():
+    """Counts the units the skim has probed, out of those it would probe across the whole volume."""
+
+    def __init__(self, volume_size, jump_size):
+        self.total_sectors_to_read = ceil(volume_size / jump_size)
+        self.total_sectors_read = 0
+
+    def add(self, count=1):
+        """Count count more sectors read. Only the reader that owns the calculator may call this."""
+        self.total_sectors_read += count
+
+    @property
+    def progress(self):
+        return self.total_sectors_read / max(1, self.total_sectors_to_read)
+
+
+class InspectionPerformanceCalc():
+    """Counts the sectors a close inspection has read, out of its sector limit."""
+
+    def __init__(self, total_sectors, id_str):
+        self.id_str = id_str
+        self.total_sectors_read = 0
+        self.total_sectors_to_read = total_sectors
+
+    def add(self, count=1):
+        """Count count more sectors read. Only the reader that owns the calculator may call this."""
+        self.total_sectors_read += count
+
+    @property
+    def progress(self):
+        return self.total_sectors_read / max(1, self.total_sectors_to_read)
+
+
+class Sampler():
+    """Calls sample() every interval seconds on its own thread, until stopped."""
+
+    def __init__(self, sample, interval=SAMPLE_INTERVAL):
+        self.sample = sample
+        self.interval = interval
+        self.stopped = Event()
+
+    def start(self):
+        thread = Thread(target=self._loop, name='Progress sampler', daemon=True)
+        thread.start()
+        return thread
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
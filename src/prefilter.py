@@ -0,0 +1,77 @@
+"""Batched prefilters that pick candidate sectors out of a batch read from the disk.
+
+Only the sectors a prefilter lets through are handed to Job.check_sector for a
+full lookup. NumPy is optional: without it, PyPrefilter does the same job one
+sector at a time.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SECTOR_SIZE = 512
+
+# multiplier used to mix the two halves of a fingerprint (the 64-bit golden ratio)
+_MIX = 0x9E3779B97F4A7C15
+
+
+class PyPrefilter():
+    """Per-sector fallback used when NumPy is not installed."""
+
+    def __init__(self, index, sector_size=SECTOR_SIZE):
+        self.index = index
+        self.meaningless = [b'\x00' * sector_size, b'\xff' * sector_size]
+
+    def candidates(self, sectors, keep_meaningless=False):
+        """Return the positions in sectors that may match an outstanding source sector."""
+        return [n for n, sector in enumerate(sectors)
+                if sector in self.index and (keep_meaningless or sector not in self.meaningless)]
+
+
+class NumpyPrefilter():
+    """Vectorized prefilter over whole batches of sectors.
+
+    Each sector is reduced to a 64-bit fingerprint built from its first and last
+    8 bytes. A batch is viewed as an (n, sector_size) array, fingerprinted in one
+    pass and looked up with np.searchsorted in the sorted fingerprints of the source
+    sectors (np.isin would hash all of those again for every batch). All-zero and
+    all-0xFF survivors are dropped in the same pass.
+    """
+
+    def __init__(self, blocks, sector_size=SECTOR_SIZE):
+        self.sector_size = sector_size
+        # blocks are buffers of whole source sectors, fingerprinted one at a time to bound memory use
+        parts = [self.fingerprint(self.as_rows(block)) for block in blocks]
+        self.fingerprints = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.uint64)
+
+    def as_rows(self, buf):
+        return np.frombuffer(buf, dtype=np.uint8).reshape(-1, self.sector_size)
+
+    def fingerprint(self, rows):
+        head = np.ascontiguousarray(rows[:, :8]).view(np.uint64).ravel()
+        tail = np.ascontiguousarray(rows[:, -8:]).view(np.uint64).ravel()
+        return head ^ (tail * np.uint64(_MIX))
+
+    def candidates(self, sectors, keep_meaningless=False):
+        """Return the positions in sectors whose fingerprint matches some source sector."""
+        if not sectors:
+            return []
+        rows = self.as_rows(b''.join(sectors))
+        fingerprints = self.fingerprint(rows)
+        if not len(self.fingerprints):
+            return []
+        found = self.fingerprints[np.minimum(np.searchsorted(self.fingerprints, fingerprints),
+                                             len(self.fingerprints) - 1)]
+        survivors = np.flatnonzero(found == fingerprints)
+        if not keep_meaningless and len(survivors):
+            words = rows[survivors].view(np.uint64)
+            meaningless = ~words.any(axis=1) | (words == np.uint64(0xFFFFFFFFFFFFFFFF)).all(axis=1)
+            survivors = survivors[~meaningless]
+        return survivors.tolist()
+
+
+def make_prefilter(blocks, index, sector_size=SECTOR_SIZE):
+    """Return a NumpyPrefilter over the source blocks if NumPy is installed, otherwise a PyPrefilter."""
+    if np is not None:
+        return NumpyPrefilter(blocks, sector_size)
+    return PyPrefilter(index, sector_size)
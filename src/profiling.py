@@ -0,0 +1,169 @@
+"""Per-stage timing of the scan pipeline, and an optional trace of it.
+
+The stages are:
+    read        reads from the volume, not counting pauses made by the pacer
+    filter      the prefilter picking candidates out of a batch
+    dispatch    handing batches to the matchers, back-pressure included
+    match       index lookups and verification of candidates and extents
+    coverage    bookkeeping of the covered and claimed ranges
+    lock        waiting for the job's inspection mutex
+    emit        running the slots of signals
+    write       writing out reconstructed files
+Stages nest where one calls another: a match emits success_signal, so its time
+includes that emit.
+
+Each thread adds to cells of its own, so recording takes no lock and costs two
+clock reads and a few list updates; the profiler is always on. A Trace can in
+addition keep a sample of the timed spans, per thread, and write them as a
+Chrome trace (for chrome://tracing or Perfetto) or as plain JSON timelines, to
+look into a single slow run afterwards.
+"""
+import json
+import os
+from collections import deque
+from itertools import count
+from threading import Lock, current_thread, local
+from time import perf_counter
+
+from checkpoint import atomic_write
+
+STAGES = ('read', 'filter', 'dispatch', 'match', 'coverage', 'lock', 'emit', 'write')
+TRACE_FORMATS = ('chrome', 'json')
+# spans kept per thread by a trace; the oldest are dropped beyond this
+DEFAULT_TRACE_LIMIT = 100000
+
+
+class Trace():
+    """Keeps one in every sample spans timed by a Profiler, up to limit per thread.
+
+    Args:
+        path (str): file the trace is written to by write().
+        trace_format (str): 'chrome' for the Chrome trace event format, 'json'
+            for a list of per-thread timelines.
+        sample (int): keep every sample-th span of each thread.
+        limit (int): spans kept per thread; the oldest are dropped first.
+    """
+
+    def __init__(self, path, trace_format='chrome', sample=1, limit=DEFAULT_TRACE_LIMIT):
+        if trace_format not in TRACE_FORMATS:
+            raise ValueError('unknown trace format: ' + str(trace_format))
+        self.path = path
+        self.format = trace_format
+        self.sample = max(1, sample)
+        self.limit = limit
+        self.origin = perf_counter()
+        self.local = local()
+        self.timelines = []         # (thread number, thread name, deque of (stage, start, end))
+        self.numbers = count(1)     # thread idents are reused, so threads are numbered instead
+        self.lock = Lock()          # only taken the first time a thread records
+
+    def add(self, stage, start, end):
+        timeline = getattr(self.local, 'timeline', None)
+        if timeline is None:
+            timeline = self.local.timeline = [0, deque(maxlen=self.limit)]
+            with self.lock:
+                self.timelines.append((next(self.numbers), current_thread().name, timeline[1]))
+        timeline[0] += 1
+        if timeline[0] % self.sample == 0:
+            timeline[1].append((stage, start, end))
+
+    def chrome(self):
+        """Return the kept spans in the Chrome trace event format."""
+        pid = os.getpid()
+        events = []
+        for tid, name, spans in list(self.timelines):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+            for stage, start, end in list(spans):
+                events.append({'name': stage, 'cat': 'recoverability', 'ph': 'X', 'pid': pid, 'tid': tid,
+                               'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def timelines_dict(self):
+        """Return the kept spans as {'threads': [{'name', 'spans': [[stage, start, seconds], ...]}, ...]},
+        with start in seconds since the trace began."""
+        return {'sample': self.sample, 'threads': [
+            {'id': tid, 'name': name,
+             'spans': [[stage, start - self.origin, end - start] for stage, start, end in list(spans)]}
+            for tid, name, spans in list(self.timelines)]}
+
+    def write(self, path=None):
+        data = self.chrome() if self.format == 'chrome' else self.timelines_dict()
+        atomic_write(path or self.path, json.dumps(data).encode())
+
+
+class Profiler():
+    """Accumulates the calls, items and seconds of each stage, and passes the spans to trace if given."""
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.local = local()
+        self.cells = []
+        self.lock = Lock()  # only taken the first time a thread records
+
+    def record(self, stage, start, items=1):
+        """Count the time from start, a perf_counter() value, to now towards stage. Returns now, so that
+        the next stage can be timed from it."""
+        end = perf_counter()
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = self.local.cell = {name: [0, 0, 0.0] for name in STAGES}
+            with self.lock:
+                self.cells.append(cell)
+        entry = cell[stage]
+        entry[0] += 1
+        entry[1] += items
+        entry[2] += end - start
+        if self.trace is not None:
+            self.trace.add(stage, start, end)
+        return end
+
+    def stats(self):
+        """Return {stage: {'calls', 'items', 'seconds'}} summed over all threads."""
+        totals = {name: [0, 0, 0.0] for name in STAGES}
+        for cell in list(self.cells):
+            for name, (calls, items, seconds) in list(cell.items()):
+                total = totals[name]
+                total[0] += calls
+                total[1] += items
+                total[2] += seconds
+        return {name: {'calls': calls, 'items': items, 'seconds': seconds}
+                for name, (calls, items, seconds) in totals.items()}
+
+
+class ProfiledLock():
+    """A lock whose acquisitions count towards a stage of profiler, so contention shows up."""
+
+    def __init__(self, profiler, stage='lock'):
+        self.lock = Lock()
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        start = perf_counter()
+        self.lock.acquire()
+        self.profiler.record(self.stage, start)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+class ProfiledVolume():
+    """Wraps a volume so that every read counts towards the read stage, with the bytes read as items."""
+
+    def __init__(self, volume, profiler):
+        self.volume = volume
+        self.profiler = profiler
+
+    @property
+    def shared(self):
+        return self.volume.shared
+
+    def read(self, offset, size):
+        start = perf_counter()
+        data = self.volume.read(offset, size)
+        self.profiler.record('read', start, len(data))
+        return data
+
+    def close(self):
+        self.volume.close()
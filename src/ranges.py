@@ -0,0 +1,181 @@
+"""Half-open byte ranges of a volume: RangeSet tracks which parts have been covered, and
+IntervalMap which parts the active readers are working on."""
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+
+class RangeSet():
+    """A thread-safe set of disjoint, non-adjacent [start, end) ranges, kept sorted."""
+
+    def __init__(self, ranges=()):
+        self.lock = Lock()
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            self.add(start, end)
+
+    def add(self, start, end):
+        """Add [start, end), merging it with any range it overlaps or touches."""
+        if end <= start:
+            return
+        with self.lock:
+            lo = bisect_left(self.ends, start)      # first range ending at or after start
+            hi = bisect_right(self.starts, end)     # ranges from here on start after end
+            if lo < hi:
+                start = min(start, self.starts[lo])
+                end = max(end, self.ends[hi - 1])
+            self.starts[lo:hi] = [start]
+            self.ends[lo:hi] = [end]
+
+    def remove(self, start, end):
+        """Remove [start, end), splitting a range it falls inside."""
+        if end <= start:
+            return
+        with self.lock:
+            lo = bisect_right(self.ends, start)     # first range ending after start
+            hi = bisect_left(self.starts, end)      # ranges from here on start at or after end
+            if lo >= hi:
+                return
+            starts, ends = [], []
+            if self.starts[lo] < start:
+                starts.append(self.starts[lo])
+                ends.append(start)
+            if self.ends[hi - 1] > end:
+                starts.append(end)
+                ends.append(self.ends[hi - 1])
+            self.starts[lo:hi] = starts
+            self.ends[lo:hi] = ends
+
+    def __contains__(self, address):
+        return self.span(address) is not None
+
+    def span(self, address):
+        """Return the (start, end) range containing address, or None."""
+        with self.lock:
+            n = bisect_right(self.starts, address) - 1
+            if n >= 0 and address < self.ends[n]:
+                return self.starts[n], self.ends[n]
+            return None
+
+    def gaps(self, start, end):
+        """Return the parts of [start, end) that are not in the set, as a list of (start, end) pairs."""
+        result = []
+        with self.lock:
+            n = max(0, bisect_right(self.starts, start) - 1)
+            while start < end and n < len(self.starts) and self.starts[n] < end:
+                if self.ends[n] > start:
+                    if self.starts[n] > start:
+                        result.append((start, self.starts[n]))
+                    start = self.ends[n]
+                n += 1
+        if start < end:
+            result.append((start, end))
+        return result
+
+    def intersection(self, start, end):
+        """Return the parts of [start, end) that are in the set, as a list of (start, end) pairs."""
+        result = []
+        with self.lock:
+            n = max(0, bisect_right(self.starts, start) - 1)
+            while n < len(self.starts) and self.starts[n] < end:
+                if self.ends[n] > start:
+                    result.append((max(start, self.starts[n]), min(end, self.ends[n])))
+                n += 1
+        return result
+
+    def total(self):
+        """Number of bytes in the set."""
+        with self.lock:
+            return sum(e - s for s, e in zip(self.starts, self.ends))
+
+    def as_list(self):
+        with self.lock:
+            return [[s, e] for s, e in zip(self.starts, self.ends)]
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class IntervalMap():
+    """A thread-safe collection of [start, end) intervals, which may overlap, each held by an owner.
+
+    Intervals are kept sorted by start, over a binary tree holding the largest end
+    in each subtree, so an overlap query only descends into subtrees that reach its
+    start: it takes O((k + 1) log n) time for k intervals found. Adding or removing
+    an interval inserts into the sorted list and rebuilds the tree, in linear time;
+    only a handful of readers are active at any time, and each is added and removed
+    once but queried for every probe and prediction.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.starts = []
+        self.intervals = []     # (start, end, owner), sorted by start
+        self.size = 1           # number of leaves, a power of two
+        self.tree = [None, None]  # tree[1] is the root; leaf size + n holds the end of intervals[n]
+
+    def add(self, start, end, owner):
+        if end <= start:
+            return
+        with self.lock:
+            n = bisect_right(self.starts, start)
+            self.starts.insert(n, start)
+            self.intervals.insert(n, (start, end, owner))
+            self._build()
+
+    def remove(self, owner):
+        """Remove every interval held by owner."""
+        with self.lock:
+            kept = [interval for interval in self.intervals if interval[2] is not owner]
+            if len(kept) != len(self.intervals):
+                self.intervals = kept
+                self.starts = [start for start, _, _ in kept]
+                self._build()
+
+    def _build(self):
+        size = 1
+        while size < len(self.intervals):
+            size *= 2
+        tree = [None] * size + [end for _, end, _ in self.intervals] + [None] * (size - len(self.intervals))
+        for node in range(size - 1, 0, -1):
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if right is None else right if left is None else max(left, right)
+        self.size = size
+        self.tree = tree
+
+    def overlapping(self, start, end):
+        """Return the (start, end, owner) intervals that overlap [start, end), sorted by start."""
+        result = []
+        with self.lock:
+            count = bisect_left(self.starts, end)     # intervals from here on start at or after end
+            tree, size = self.tree, self.size
+            stack = [(1, 0, size)]                    # (node, first leaf, number of leaves)
+            while stack:
+                node, first, width = stack.pop()
+                # skip subtrees starting too late, and those where no interval reaches start
+                if first >= count or tree[node] is None or tree[node] <= start:
+                    continue
+                if node >= size:
+                    result.append(self.intervals[node - size])
+                else:
+                    width //= 2
+                    stack.append((2 * node + 1, first + width, width))
+                    stack.append((2 * node, first, width))
+        return result
+
+    def __contains__(self, address):
+        return bool(self.overlapping(address, address + 1))
+
+    def gaps(self, start, end):
+        """Return the parts of [start, end) that no interval covers, as a list of (start, end) pairs."""
+        result = []
+        for s, e, _ in self.overlapping(start, end):
+            if s > start:
+                result.append((start, s))
+            start = max(start, e)
+        if start < end:
+            result.append((start, end))
+        return result
+
+    def __len__(self):
+        return len(self.intervals)
@@ -0,0 +1,238 @@
+"""Large-block read helpers shared by the disk readers.
+
+Sectors are sliced out of large aligned blocks with memoryview instead of being
+read one at a time, so that the number of syscalls no longer scales with the
+number of sectors inspected. Two volume backends are available: FileVolume reads
+through a private descriptor per reader, while MmapVolume maps the image in
+windows that every reader of a job shares.
+"""
+import os
+import mmap
+from collections import OrderedDict
+from threading import Lock
+
+SECTOR_SIZE = 512
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+MIN_BLOCK_SIZE = 1024 * 1024
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+# the mmap backend maps the volume in windows of this size, keeping at most DEFAULT_MAX_WINDOWS mapped
+DEFAULT_WINDOW_SIZE = 64 * 1024 * 1024
+DEFAULT_MAX_WINDOWS = 8
+
+# strides up to this size are cheaper to read as a whole span than as separate positioned reads
+DEFAULT_SPAN_STRIDE_LIMIT = 64 * 1024
+
+O_BINARY = getattr(os, 'O_BINARY', 0)
+
+
+def open_volume(vol_path):
+    """Open a volume, physical drive or image read-only and return its file descriptor."""
+    return os.open(vol_path, os.O_RDONLY | O_BINARY)
+
+
+def volume_size(fd):
+    """Return the size in bytes of the volume or image behind fd."""
+    size = os.lseek(fd, 0, os.SEEK_END)
+    os.lseek(fd, 0, os.SEEK_SET)
+    return size
+
+
+def device_size(vol_path):
+    """Return the size in bytes of a volume, physical drive or image."""
+    fd = open_volume(vol_path)
+    try:
+        size = volume_size(fd)
+        if size == 0 and os.name == 'nt':
+            # raw Windows devices don't support seeking to the end; ask the driver instead
+            size = _windows_device_size(fd)
+        return size
+    finally:
+        os.close(fd)
+
+
+def _windows_device_size(fd):
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+    IOCTL_DISK_GET_LENGTH_INFO = 0x0007405C
+    length = ctypes.c_longlong(0)
+    returned = wintypes.DWORD(0)
+    ok = ctypes.windll.kernel32.DeviceIoControl(
+        wintypes.HANDLE(msvcrt.get_osfhandle(fd)), IOCTL_DISK_GET_LENGTH_INFO, None, 0,
+        ctypes.byref(length), ctypes.sizeof(length), ctypes.byref(returned), None)
+    if not ok:
+        raise ctypes.WinError()
+    return length.value
+
+
+def clamp_block_size(block_size, sector_size=SECTOR_SIZE):
+    """Clamp block_size to the supported range and round it down to a whole number of sectors."""
+    block_size = max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+    return block_size - (block_size % sector_size)
+
+
+if hasattr(os, 'pread'):
+    def pread(fd, size, offset):
+        return os.pread(fd, size, offset)
+else:
+    def pread(fd, size, offset):
+        # no positioned reads on this platform (Windows); callers must not share fd across threads
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+def read_exact(fd, size, offset):
+    """Read up to size bytes at offset, retrying short reads until EOF."""
+    data = pread(fd, size, offset)
+    if len(data) == size or not data:
+        return data
+    chunks = [data]
+    got = len(data)
+    while got < size:
+        more = pread(fd, size - got, offset + got)
+        if not more:
+            break
+        chunks.append(more)
+        got += len(more)
+    return b''.join(chunks)
+
+
+class FileVolume():
+    """Reads a volume through a private file descriptor using positioned reads."""
+
+    shared = False
+
+    def __init__(self, vol_path):
+        self.fd = open_volume(vol_path)
+
+    def read(self, offset, size):
+        return memoryview(read_exact(self.fd, size, offset))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MmapVolume():
+    """Maps windows of a raw image or block device on demand and serves reads from the page cache.
+
+    One instance is meant to be shared by every reader of a job. Reads that fall inside a
+    single window are returned as zero-copy memoryviews into the mapping; reads that straddle
+    two windows are copied. At most max_windows windows are mapped at once, so images larger
+    than the address space can still be read.
+    """
+
+    shared = True
+
+    def __init__(self, vol_path, window_size=DEFAULT_WINDOW_SIZE, max_windows=DEFAULT_MAX_WINDOWS):
+        self.fd = open_volume(vol_path)
+        self.size = volume_size(self.fd)
+        # windows must start on an allocation boundary
+        self.window_size = max(mmap.ALLOCATIONGRANULARITY,
+                               window_size - (window_size % mmap.ALLOCATIONGRANULARITY))
+        self.max_windows = max_windows
+        self.windows = OrderedDict()
+        self.lock = Lock()
+
+    def window(self, n):
+        """Return a memoryview of window n, mapping it and evicting the least recently used window if needed."""
+        with self.lock:
+            view = self.windows.get(n)
+            if view is not None:
+                self.windows.move_to_end(n)
+                return view
+            start = n * self.window_size
+            length = min(self.window_size, self.size - start)
+            view = memoryview(mmap.mmap(self.fd, length, access=mmap.ACCESS_READ, offset=start))
+            self.windows[n] = view
+            if len(self.windows) > self.max_windows:
+                # readers may still hold slices of the evicted window, so leave unmapping to the GC
+                self.windows.popitem(last=False)
+            return view
+
+    def read(self, offset, size):
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return memoryview(b'')
+        n = offset // self.window_size
+        rel = offset - n * self.window_size
+        view = self.window(n)
+        if rel + size <= len(view):
+            return view[rel:rel + size]
+        chunks = []
+        while size > 0:
+            view = self.window(n)
+            chunk = view[rel:rel + size]
+            chunks.append(chunk)
+            size -= len(chunk)
+            n += 1
+            rel = 0
+        return memoryview(b''.join(chunks))
+
+    def close(self):
+        with self.lock:
+            self.windows.clear()
+        os.close(self.fd)
+
+
+BACKENDS = {'file': FileVolume, 'mmap': MmapVolume}
+
+
+def iter_span(volume, start, end, block_size=DEFAULT_BLOCK_SIZE, sector_size=SECTOR_SIZE, origin=0):
+    """Yield (offset, block) pairs covering [start, end) with one read per block.
+
+    Blocks after the first start at origin plus a multiple of block_size, so with a
+    cluster-sized sector_size and the partition start as origin every block holds
+    whole clusters. Iteration stops early at EOF.
+    """
+    offset = start
+    while offset < end:
+        next_boundary = origin + ((offset - origin) // block_size + 1) * block_size
+        size = min(next_boundary, end) - offset
+        # raw volumes only accept whole sectors
+        size += (-size) % sector_size
+        block = volume.read(offset, size)
+        if not block:
+            return
+        yield offset, block
+        if len(block) < size:
+            return
+        offset += len(block)
+
+
+def iter_sectors(volume, start, end, stride=SECTOR_SIZE, block_size=DEFAULT_BLOCK_SIZE,
+                 sector_size=SECTOR_SIZE, span_stride_limit=DEFAULT_SPAN_STRIDE_LIMIT):
+    """Yield (offset, sector) for every offset in range(start, end, stride).
+
+    Each sector is a read-only memoryview into a larger block, so it can be compared
+    or used as a dict key without copying. When the stride is small whole spans are
+    read in blocks of block_size; otherwise each probe is fetched with a single
+    positioned read. Iteration stops at the first incomplete sector (EOF).
+    """
+    if stride <= span_stride_limit:
+        # read whole spans and slice each probe out of the block
+        pos = start
+        for block_start, block in iter_span(volume, start, end + sector_size, block_size, sector_size):
+            block_end = block_start + len(block)
+            while pos < end and pos + sector_size <= block_end:
+                rel = pos - block_start
+                yield pos, block[rel:rel + sector_size]
+                pos += stride
+            if pos >= end:
+                return
+            if pos >= block_end:
+                continue
+            # the next probe straddles two blocks; fetch it directly
+            sector = volume.read(pos, sector_size)
+            if len(sector) < sector_size:
+                return
+            yield pos, sector
+            pos += stride
+        return
+
+    # large stride: one positioned read per probe, with no seek or buffered-IO round trip
+    for offset in range(start, end, stride):
+        sector = volume.read(offset, sector_size)
+        if len(sector) < sector_size:
+            return
+        yield offset, sector
@@ -1,273 +1,1416 @@
 import time
 import os
-from threading import Lock, current_thread
-from PyQt5 import QtCore
-from performance import PerformanceCalculator, InspectionPerformanceCalc, SAMPLE_WINDOW
+import traceback
+from collections import deque
+from concurrent.futures import wait
+from multiprocessing import cpu_count
+from threading import Lock, Event, Thread, current_thread
+from events import Signal
+from pacing import Pacer, PacedVolume
+from dispatch import Dispatcher, DEFAULT_BATCH_SIZE, DEFAULT_QUEUE_SIZE
+import shards
+import checkpoint
+import ntfs
+import diskindex
+import calibration
+import badblocks
+import nearmatch
+from ranges import RangeSet, IntervalMap
+from prefilter import make_prefilter
+from performance import PerformanceCalculator, InspectionPerformanceCalc, Sampler
+from telemetry import Telemetry, MeteredVolume, DEFAULT_EXPORT_INTERVAL
+from profiling import Profiler, ProfiledLock, ProfiledVolume, Trace
+from reads import BACKENDS, DEFAULT_BLOCK_SIZE, clamp_block_size, iter_sectors
+from sources import SourceFile, SectorIndex, SECTOR_SIZE, UNMATCHED, AUTO_FILLED, meaningless, digest
 
 # constants
-SECTOR_SIZE = 512
-MEANINGLESS_SECTORS = [b'\x00' * SECTOR_SIZE, b'\xff' * SECTOR_SIZE]
+DEFAULT_OUT_DIR = 'recoverability'
 
-# globals
-inspection_manipulation_mutex = Lock()
-threadpool = QtCore.QThreadPool.globalInstance()
+# readers hand at least this many sectors at a time to the prefilter
+MIN_BATCH = 256
+# consecutive matches after which an inspection verifies the rest of the extent in bulk
+EXTENT_RUN = 3
+GRANULARITIES = ('cluster', 'sector')
+# copies looked up in the disk index per source unit beyond the one needed, in case some no longer verify
+INDEX_SPARE_COPIES = 2
+# leading bytes of a tail matched by prefix that a disk unit must share with it to be compared in full
+TAIL_KEY = 8
 
-class Worker(QtCore.QRunnable):
-    
-    def __init__(self, fn, *args):
-        super(Worker, self).__init__()
 
-        if not fn:
-            self.fn = self.check_sector
-        else:
-            self.fn = fn
-        self.args = args
+def unit_size(sector_size=SECTOR_SIZE, cluster_size=None, granularity='cluster'):
+    """Return the size of the units source files are indexed in and the volume is probed at."""
+    cluster_size = cluster_size or sector_size
+    if cluster_size % sector_size:
+        raise ValueError('the cluster size must be a multiple of the sector size')
+    if granularity not in GRANULARITIES:
+        raise ValueError('unknown granularity: ' + str(granularity))
+    return cluster_size if granularity == 'cluster' else sector_size
 
-    @QtCore.pyqtSlot()
-    def run(self):
-        self.fn(*self.args)
 
-    @QtCore.pyqtSlot()
-    def check_sector(self, inp, addr, close_reader=None):
-        try:
-            i = job.file.remaining_sectors.index(inp)
-            actual_address = addr - SECTOR_SIZE
-            job.file.address_table[i].append(actual_address)
-            job.file.remaining_sectors[i] = None
-            if len(job.file.address_table[i]) == 1:
-                job.done_sectors += 1
-                job.success_signal.emit(i)
-            if close_reader:
-                close_reader.success_count += 1
-                close_reader.consecutive_successes += 1
-            elif not job.skim_reader.inspection_in_progress(addr):
-                job.new_close_inspection(actual_address)
-            if all(_ in MEANINGLESS_SECTORS for _ in filter(None, job.file.remaining_sectors)) \
-                and not job.finished:
-                job.finish()
-        except ValueError:  # inp did not exist in job.file.remaining_sectors
-            if close_reader:
-                close_reader.consecutive_successes = 0
-        return
+class DiskReader():
+    def __init__(self, job, volume, block_size=DEFAULT_BLOCK_SIZE):
+        self.job = job
+        volume = MeteredVolume(ProfiledVolume(volume, job.profiler), job.telemetry.bytes_read)
+        self.volume = PacedVolume(volume, job.pacer) if job.pacer.throttled else volume
+        self.unit = job.unit_size
+        self.block_size = clamp_block_size(block_size, self.unit)
+        self.position = 0   # address of the most recently read sector
 
-class DiskReader(QtCore.QObject):
-    def __init__(self, vol_path):
-        super().__init__()
-        self.fobj = os.fdopen(os.open(vol_path, os.O_RDONLY | os.O_BINARY), 'rb')
+    def sectors(self, start, end, stride=None):
+        """Yield (address, sector) pairs from range(start, end, stride), read in large blocks.
+        Sectors are job.unit_size long, and so is the default stride."""
+        return iter_sectors(self.volume, start, end, stride or self.unit, self.block_size, self.unit)
 
-class CloseReader(DiskReader):
+    def search_batches(self, start, end, stride):
+        """Like batches, over the parts of [start, end) in the job's search space that have not been read.
 
-    progress_signal = QtCore.pyqtSignal(tuple)
-    finished_signal = QtCore.pyqtSignal(float)
+        The stride counts bytes of those parts, so a run of them shorter than the
+        stride is still probed in its turn, and a file lying in consecutive runs is
+        probed as often as if they were contiguous.
+        """
+        offset = 0  # distance from the start of the next run to the next probe
+        for span_start, span_end in self.job.unread_ranges(start, end):
+            first = span_start + offset
+            if first < span_end:
+                yield from self.batches(first, span_end, stride)
+                last = first + (span_end - 1 - first) // stride * stride
+                offset = last + stride - span_end
+            else:
+                offset -= span_end - span_start
+
+    def batches(self, start, end, stride=None):
+        """Yield lists of (address, sector) pairs from range(start, end, stride), about one block per list."""
+        stride = stride or self.unit
+        batch_size = max(MIN_BATCH, self.block_size // stride)
+        batch = []
+        for pair in self.sectors(start, end, stride):
+            batch.append(pair)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        # a shared volume belongs to the job and outlives its readers
+        if not self.volume.shared:
+            self.volume.close()
+
+class CloseReader(DiskReader):
 
-    def __init__(self, start_at, backward=False):
-        super().__init__(job.vol_path)
+    def __init__(self, job, start_at, sector_limit, backward=False):
+        super().__init__(job, job.open_volume(), job.block_size)
+        self.progress_signal = Signal(job.profiler)     # (portion read, success rate), published by the job's sampler
+        self.finished_signal = Signal(job.profiler)     # final success rate
         self.start_at = start_at
-        self.sector_limit = job.total_sectors // 2
+        self.sector_limit = sector_limit
         self.sector_count = 0
         self.success_count = 0
         self.consecutive_successes = 0
+        self.hint = None    # (file id, source index, address) of the latest match
         if backward:
             self.id_tuple = ("backward", start_at, hex(start_at))
-            self.start_at -= (self.sector_limit * SECTOR_SIZE)
+            self.start_at = max(job.partition_offset, self.start_at - (self.sector_limit * self.unit))
         else:
             self.id_tuple = ("forward", start_at, hex(start_at))
         self.perf = InspectionPerformanceCalc(self.sector_limit, self.id_tuple[0] + self.id_tuple[2])
 
     def read(self):
-        #debug_this_thread()
+        job = self.job
         current_thread().name = self.id_tuple[0] + self.id_tuple[2]
-        self.fobj.seek(self.start_at)
-        for _ in range(self.sector_limit):
-            data = self.fobj.read(SECTOR_SIZE)
-            if job.finished or not data:
+        end = self.start_at + (self.sector_limit * self.unit)
+        self.position = self.start_at
+        # ranges read (or being read) by another reader, or outside the search space, are skipped
+        gaps = job.claim(self.start_at, end, self)
+        skipped = self.sector_limit - sum(e - s for s, e in gaps) // self.unit
+        eof = True
+        pending = deque()   # (future, start, end) of each batch, in reading order
+        for gap_start, gap_end in gaps:
+            for batch in self.follow(gap_start, gap_end):
+                start = time.perf_counter()
+                candidates = set(job.candidates([data for _, data in batch], keep_meaningless=True))
+                job.profiler.record('filter', start, len(batch))
+                # check_batch walks these in order to keep consecutive_successes meaningful;
+                # a None sector marks a meaningful sector the prefilter already ruled out
+                checks = []
+                for n, (addr, data) in enumerate(batch):
+                    if n in candidates:
+                        checks.append((addr, data))
+                    elif data not in job.meaningless:
+                        checks.append((addr, None))
+                futures = [job.submit(job.check_batch, chunk, self, items=len(chunk)) for chunk in job.chunks(checks)]
+                pending.append((futures, batch[0][0], batch[-1][0] + self.unit))
+                self.commit(pending)
+                # progress is only counted here; the job's sampler publishes it
+                self.position = batch[-1][0]
+                self.sector_count += len(batch)
+                self.perf.add(len(batch))
+                job.telemetry.inspected.add(len(batch))
+                if job.finished:
+                    break
+            if job.finished:
                 break
-            if data not in MEANINGLESS_SECTORS or self.consecutive_successes > 2:
-                threadpool.start(Worker(None, data, self.fobj.tell(), self))
-            self.sector_count += 1
-            self.progress_signal.emit((self.perf.increment(), self.success_count / self.sector_count))
-
-            time.sleep(0.01)
+        else:
+            eof = self.sector_count + skipped < self.sector_limit
+        # the success rate below decides whether to continue, so let the last matches land first
+        wait([f for futures, _, _ in pending for f in futures if f])
+        self.commit(pending)
+        start = time.perf_counter()
+        job.claims.remove(self)
+        job.profiler.record('coverage', start)
 
         if job.finished:
+            self.close()
             return
 
-        inspection_manipulation_mutex.acquire()
-        job.skim_reader.inspections.remove(self)
-        inspection_manipulation_mutex.release()
+        with job.inspection_mutex:
+            job.skim_reader.remove_inspection(self)
 
-        if not data:
-            job.skim_reader.handle_eof()
+        success_rate = self.success_count / max(1, self.sector_count)
+        if eof:
+            job.skim_reader.request_resume(eof=True)
         else:
-            new_insp_address = self.fobj.tell() + (self.sector_limit * SECTOR_SIZE)
-            if (self.consecutive_successes > 0 or (self.success_count / self.sector_count) > 0.4) \
+            # carry on in the same direction: the new pair's other half reads the range next to this one
+            if self.id_tuple[0] == 'forward':
+                new_insp_address = end + (self.sector_limit * self.unit)
+            else:
+                new_insp_address = max(job.partition_offset, self.start_at - (self.sector_limit * self.unit))
+            if (self.consecutive_successes > 0 or success_rate > 0.4) \
+                and (self.id_tuple[0] == 'forward' or self.start_at > job.partition_offset) \
                 and not job.skim_reader.inspection_in_progress(new_insp_address):
-                job.new_close_inspection(new_insp_address)
+                job.new_close_inspection(new_insp_address, self.sector_limit)
             else:
-                #print('request')
                 job.skim_reader.request_resume()
 
-        self.finished_signal.emit(self.success_count / self.sector_count)
-        #print(self.id_tuple[0] + self.id_tuple[2] + " EMIT")
+        self.finished_signal.emit(success_rate)
         current_thread().name = ("X " + self.id_tuple[0] + self.id_tuple[2])
-        del self.perf
+        self.close()
 
         return
 
-class SkimReader(DiskReader):
+    def follow(self, start, end):
+        """Yield lists of (address, sector) pairs from [start, end) like batches, but once a run of matches
+        has established an extent, verify the rest of it in bulk and carry on after it."""
+        batch_size = max(MIN_BATCH, self.block_size // self.unit)
+        while start < end:
+            start = self.verify_extent(start, end)
+            batch = list(self.sectors(start, min(end, start + batch_size * self.unit)))
+            if not batch:
+                return
+            yield batch
+            start = batch[-1][0] + self.unit
+
+    def verify_extent(self, start, end):
+        """Match [start, end) against the extent of the latest match, a block at a time, until it breaks.
+        Returns the address of the first unit not matched."""
+        job = self.job
+        hint = self.hint
+        if hint is None or self.consecutive_successes < EXTENT_RUN:
+            return start
+        self.hint = None
+        file_id, i, addr = hint
+        file = job.files[file_id]
+        j = i + (start - addr) // self.unit
+        per_block = self.block_size // self.unit
+        while start < end and not job.finished:
+            count = min(per_block, (end - start) // self.unit, file.total_sectors - j)
+            if count <= 0:
+                break
+            data = self.volume.read(start, count * self.unit)
+            count = min(count, len(data) // self.unit)
+            matched = job.verify_extent(file_id, j, start, data[:count * self.unit])
+            job.record_extent(file_id, j, start, data[:matched * self.unit])
+            self.sector_count += matched
+            self.success_count += matched
+            self.consecutive_successes += matched
+            self.perf.add(matched)
+            job.telemetry.inspected.add(matched)
+            if matched:
+                self.position = start + (matched - 1) * self.unit
+            start += matched * self.unit
+            j += matched
+            if matched < count or count == 0:
+                break
+        return start
+
+    def commit(self, pending):
+        """Mark the leading batches of pending whose checks have all completed as covered."""
+        began = time.perf_counter()
+        while pending and all(f is None or f.done() for f in pending[0][0]):
+            _, start, end = pending.popleft()
+            self.job.covered.add(start, end)
+        self.job.profiler.record('coverage', began)
+
+class PredictiveReader(DiskReader):
+    """Grows the extent around a match by reading where the file's other sectors should be.
+
+    If sector i of a file lies at addr, sector j most likely lies at
+    addr + (j - i) * unit. The predicted sectors are read a block at a time,
+    forward and then backward from the match, and each block is compared with the
+    file in one go until a prediction fails in each direction; the sector that
+    broke it is checked against the index like any other, so the extent counts as
+    covered. A near match of the predicted sector doesn't break it. Whatever is
+    still missing afterwards is left to close inspections started at the two ends
+    of the extent.
+    """
+
+    def __init__(self, job, file_id, i, addr):
+        super().__init__(job, job.open_volume(), job.block_size)
+        self.file_id = file_id
+        self.i = i
+        self.addr = addr
+        file = job.files[file_id]
+        self.sector_limit = file.total_sectors
+        self.id_tuple = ("predicted", addr, hex(addr))
+        self.start = addr   # the extent found so far is [start, end)
+        self.end = addr + self.unit
+
+    def read(self):
+        job = self.job
+        current_thread().name = self.id_tuple[0] + self.id_tuple[2]
+        file = job.files[self.file_id]
+        # where the file's first sector would be, if it were contiguous
+        base = self.addr - self.i * self.unit
+        self.grow(base, forward=True)
+        self.grow(base, forward=False)
+        job.predicted_signal.emit((self.file_id, self.start, self.end))
+        if not job.finished and not file.finished:
+            # fall back to sweeping from where the prediction failed
+            limit = file.total_sectors // 2
+            job.start_inspections([(self.end, limit), (self.start, limit)])
+        with job.inspection_mutex:
+            job.skim_reader.remove_inspection(self)
+        self.close()
+        if not job.finished:
+            job.skim_reader.request_resume()
+
+    def grow(self, base, forward):
+        """Extend [start, end) a block at a time in one direction, until a predicted sector doesn't match."""
+        job = self.job
+        file = job.files[self.file_id]
+        unit = self.unit
+        per_block = self.block_size // unit
+        while not job.finished:
+            if forward:
+                addr = self.end
+                count = min(per_block, file.total_sectors - (addr - base) // unit, (job.vol_size - addr) // unit)
+            else:
+                count = min(per_block, (self.start - base) // unit, (self.start - job.partition_offset) // unit)
+                addr = self.start - count * unit
+            if count <= 0:
+                return
+            # what has been read already isn't read again: its matches are in the address table
+            next_unit = addr if forward else self.start - unit
+            if next_unit in job.covered:
+                if not self.follow_table(base, forward):
+                    return
+                continue
+            # like the close inspections, only read what no other reader has read or is reading
+            gaps = job.claim(addr, addr + count * unit, self)
+            try:
+                if forward and gaps and gaps[0][0] == addr:
+                    count = (gaps[0][1] - addr) // unit
+                elif not forward and gaps and gaps[-1][1] == self.start:
+                    count = (self.start - gaps[-1][0]) // unit
+                    addr = self.start - count * unit
+                else:   # the next unit is being read elsewhere, or outside the search space
+                    return
+                data = self.volume.read(addr, count * unit)
+                if not self.match_block(base, addr, data[:len(data) // unit * unit], forward):
+                    return
+            finally:
+                job.claims.remove(self)
+
+    def match_block(self, base, addr, data, forward):
+        """Match the units of data, read at addr, against the file where predicted, extending [start, end) over
+        them. Each unit is compared once: a near match in place of a predicted unit is recorded and the rest of
+        data is matched after it. Returns whether every unit matched."""
+        job = self.job
+        unit = self.unit
+        first = (addr - base) // unit
+        lo, hi = 0, len(data) // unit   # the units of data not matched yet
+        while lo < hi:
+            if forward:
+                matched = job.verify_extent(self.file_id, first + lo, addr + lo * unit, data[lo * unit:hi * unit])
+                job.record_extent(self.file_id, first + lo, addr + lo * unit, data[lo * unit:(lo + matched) * unit])
+                lo += matched
+                self.end = addr + lo * unit
+                if lo == hi:
+                    break
+                miss = lo
+                lo += 1
+            else:
+                matched = job.verify_extent(self.file_id, first + lo, addr + lo * unit, data[lo * unit:hi * unit],
+                                            backward=True)
+                hi -= matched
+                job.record_extent(self.file_id, first + hi, addr + hi * unit, data[hi * unit:(hi + matched) * unit])
+                self.start = addr + hi * unit
+                if lo == hi:
+                    break
+                hi -= 1
+                miss = hi
+            # a near match where one was predicted is a rotted unit of the extent, which goes on after it
+            matches = job.check_unit(addr + miss * unit, data[miss * unit:(miss + 1) * unit])
+            if (self.file_id, first + miss) not in matches:
+                return False
+            if forward:
+                self.end += unit
+            else:
+                self.start -= unit
+        return len(data) > 0
 
-    new_inspection_signal = QtCore.pyqtSignal(tuple)
-    progress_signal = QtCore.pyqtSignal(float)
-    resuming_signal = QtCore.pyqtSignal()
+    def follow_table(self, base, forward):
+        """Extend the extent over covered units the address table already places where predicted.
+        Returns whether it grew."""
+        job = self.job
+        table = job.files[self.file_id].address_table
+        unit = self.unit
+        grown = False
+        if forward:
+            span = job.covered.span(self.end)
+            while span and self.end < span[1]:
+                j = (self.end - base) // unit
+                if j >= len(table) or table[j] != self.end:
+                    break
+                self.end += unit
+                grown = True
+        else:
+            span = job.covered.span(self.start - unit)
+            while span and self.start > span[0]:
+                j = (self.start - unit - base) // unit
+                if j < 0 or table[j] != self.start - unit:
+                    break
+                self.start -= unit
+                grown = True
+        return grown
+
+class SkimReader(DiskReader):
 
-    def __init__(self, vol_path, jump_sectors, init_address):
-        super().__init__(vol_path)
-        self.jump_size = jump_sectors * SECTOR_SIZE
+    def __init__(self, job, volume, jump_sectors, init_address, block_size=DEFAULT_BLOCK_SIZE):
+        super().__init__(job, volume, block_size)
+        self.new_inspection_signal = Signal(job.profiler)   # (address, forward CloseReader, backward CloseReader)
+        self.progress_signal = Signal(job.profiler)         # portion of the volume skimmed, published by the job's sampler
+        self.resuming_signal = Signal(job.profiler)
+        self.set_jump(jump_sectors)
         self.inspections = []
+        self.active = IntervalMap()     # the neighbourhood of each inspection's origin
         self.resume_at = None
+        self.checked_to = init_address  # every probe before this address has been read and checked
         self.init_address = init_address
         self.second_pass = False
+        self.running = False    # whether a thread is skimming; inspections that finish meanwhile leave it be
         self.perf = None
 
-    def request_resume(self):
-        inspection_manipulation_mutex.acquire()
-        if not self.inspections: # only resume if all children are finished
-            self.resuming_signal.emit()
-            threadpool.start(Worker(self.read, self.resume_at))
-        inspection_manipulation_mutex.release()
+    def set_jump(self, jump_sectors):
+        """Set the number of sectors skipped between probes. Takes effect from the next (resumed) read."""
+        self.jump_size = jump_sectors * self.unit
+        self.stride = self.jump_size + self.unit
 
+    def request_resume(self, eof=False):
+        """Carry on once the last inspection is done: from resume_at, or, if an inspection ran into the end of
+        the volume (eof), as the skim does there. A skim still waiting on its checks carries on by itself."""
+        with self.job.inspection_mutex:
+            if self.inspections or self.running:
+                return
+            self.running = True
+            if not eof:
+                self.resuming_signal.emit()
+                self.job.spawn(self.read, self.resume_at)
+        if eof:
+            self.handle_eof()
 
     def handle_eof(self):
         if self.inspections:
             return
-        if self.init_address == 0:
-            job.finished = True
-            job.finished_signal.emit(False)
+        if self.init_address == self.job.partition_offset:
+            self.job.exhausted()
         else:
             self.second_pass = True
-            self.read(0)
+            self.read(self.job.partition_offset)
 
     def read(self, start_at=None):
+        job = self.job
         if start_at is None:
             start_at = self.init_address
         current_thread().name = "Skim thread"
-        self.fobj.seek(start_at)
-
+        self.running = True
+        end = self.init_address if self.second_pass else job.vol_size
+        self.position = start_at
+        self.checked_to = start_at
         while True:
-            data = self.fobj.read(SECTOR_SIZE)
-            if self.inspections or job.finished or not data \
-                or (self.fobj.tell() > self.init_address and self.second_pass):
-                break
-            if data not in MEANINGLESS_SECTORS:
-                threadpool.start(Worker(None, data, self.fobj.tell()))
-            self.progress_signal.emit(self.perf.increment())
-            self.fobj.seek(self.jump_size, 1)
+            next_probe = start_at
+            pending = deque()   # (futures, next probe) of each batch, in reading order
+            for batch in self.search_batches(start_at, end, self.stride):
+                if self.inspections or job.finished:
+                    break
+                start = time.perf_counter()
+                candidates = [batch[n] for n in job.candidates([data for _, data in batch])]
+                job.profiler.record('filter', start, len(batch))
+                self.position = batch[-1][0]
+                next_probe = self.position + self.stride
+                pending.append(([job.submit(job.check_batch, chunk, items=len(chunk))
+                                 for chunk in job.chunks(candidates)], next_probe))
+                self.commit(pending)
+                self.perf.add(len(batch))
+            else:
+                next_probe = end
+            # a match still waiting in the dispatcher may start an inspection; don't declare EOF before it has run
+            wait([f for futures, _ in pending for f in futures if f])
+            self.commit(pending)
+            self.checked_to = next_probe
 
-        if job.finished:
-            return
-        elif self.inspections:
-            self.resume_at = self.fobj.tell()
+            if job.finished:
+                return
+            with job.inspection_mutex:
+                if self.inspections:
+                    # the last inspection to finish resumes the skim
+                    self.resume_at = next_probe
+                    self.running = False
+                    current_thread().name = "Control returned from skim thread"
+                    return
+            if next_probe >= end:
+                break
+            # the inspections that stopped the skim are already done
+            start_at = next_probe
 
-        if not data:
+        if not self.second_pass:
             self.handle_eof()
-        elif (self.fobj.tell() > self.init_address) and self.second_pass:
-            job.finished = True
-            job.finished_signal.emit(False)
+        else:
+            job.exhausted()
 
         current_thread().name = "Control returned from skim thread"
 
-    def inspection_in_progress(self, addr):
-        for reader in self.inspections:
-            upper_limit = reader.id_tuple[1] + (reader.sector_limit * SECTOR_SIZE)
-            lower_limit = reader.id_tuple[1] - (reader.sector_limit * SECTOR_SIZE)
-            if lower_limit < addr and addr < upper_limit:
-                return True
-        return False
+    def commit(self, pending):
+        """Advance checked_to past the leading batches of pending whose checks have all completed."""
+        while pending and all(f is None or f.done() for f in pending[0][0]):
+            self.checked_to = pending.popleft()[1]
+
+    def add_inspection(self, reader):
+        """Register an inspection (or prediction), pausing the skim until it is removed. Call with the
+        job's inspection_mutex held."""
+        self.inspections.append(reader)
+        # matches within sector_limit of the reader's origin, on either side, are its business
+        reach = reader.sector_limit * self.unit
+        self.active.add(reader.id_tuple[1] - reach + 1, reader.id_tuple[1] + reach, reader)
 
-class Job(QtCore.QObject):
+    def remove_inspection(self, reader):
+        self.inspections.remove(reader)
+        self.active.remove(reader)
 
-    success_signal = QtCore.pyqtSignal(int)
-    finished_signal = QtCore.pyqtSignal(tuple)
-    test_run_progress_signal = QtCore.pyqtSignal(float)
-    test_run_finished_signal = QtCore.pyqtSignal()
+    def inspection_in_progress(self, addr):
+        return addr in self.active
+
+class Job():
+    """A search for one or more source files on one volume.
 
-    def __init__(self, vol_path, vol_size, file, init_address):
-        super().__init__()
+    All files are matched against a single combined index, so the volume is
+    read once however many files are searched for. Each file gets its own
+    address table, output file and completion report. Jobs hold all of their
+    own state, so several may run in the same process. Progress is reported
+    through the Signal attributes, which are emitted from the job's worker threads.
+    """
 
-        global job
-        job = self
+    def __init__(self, vol_path, vol_size, files, init_address, block_size=None, backend='file',
+                 out_dir=DEFAULT_OUT_DIR, max_workers=None, processes=None, batch_size=DEFAULT_BATCH_SIZE,
+                 dispatch='queue', queue_size=DEFAULT_QUEUE_SIZE, pacer=None, dir_name=None,
+                 checkpoint_interval=None, sector_size=SECTOR_SIZE, cluster_size=None, partition_offset=0,
+                 granularity='cluster', use_ntfs=False, free_space_only=False, metrics_path=None,
+                 metrics_interval=DEFAULT_EXPORT_INTERVAL, trace_path=None, trace_format='chrome', trace_sample=1,
+                 disk_index=None, calibrate=True, read_timeout=None, read_retries=badblocks.DEFAULT_RETRIES,
+                 near_distance=None):
+        # time spent in each stage of the pipeline, and optionally a trace of it
+        self.trace = Trace(trace_path, trace_format, trace_sample) if trace_path else None
+        self.profiler = Profiler(self.trace)
+        self.success_signal = Signal(self.profiler)              # (file id, index of the newly matched source sector)
+        self.file_finished_signal = Signal(self.profiler)        # (file id, success, number of auto-filled sectors)
+        self.finished_signal = Signal(self.profiler)             # (success of every file, number of auto-filled sectors)
+        self.test_run_progress_signal = Signal(self.profiler)    # percentage of the test run completed
+        self.progress_signal = Signal(self.profiler)             # snapshot dict, published at most every SAMPLE_INTERVAL seconds
+        self.test_run_finished_signal = Signal(self.profiler)
+        self.candidates_signal = Signal(self.profiler)           # list of ntfs.Extents proposed by the file system metadata
+        self.predicted_signal = Signal(self.profiler)            # (file id, start, end) of an extent grown from a match
+        self.extent_signal = Signal(self.profiler)               # (file id, source start, disk address, length) matched as a whole
+        self.search_space_signal = Signal(self.profiler)         # bytes left to search, or None for the whole volume
+        self.disk_index_signal = Signal(self.profiler)           # (bytes indexed, units verified), or None if unusable
+        self.calibration_signal = Signal(self.profiler)          # calibration.Calibration measured on the volume
+        self.bad_blocks_signal = Signal(self.profiler)           # badblocks.BadBlocks, before each retry of it
+        self.near_signal = Signal(self.profiler)                 # (file id, source index, address, distance in bits)
 
         self.finished = False
-        self.dir_name = 'recoverability/' + time.ctime().replace(":", '_')
-        os.makedirs(self.dir_name, mode=0o755)
+        self.error = None
+        self.done = Event()
+        self.threads = []   # reader threads started by spawn()
+        self.telemetry = Telemetry(self, export_path=metrics_path, export_interval=metrics_interval)
+        self.sampler = Sampler(self.sample_progress)
+        self.published = {}     # reader -> what its progress signal last published
+        self.finish_lock = Lock()
+        self.inspection_mutex = ProfiledLock(self.profiler)
+        self.batch_size = max(1, batch_size)
+        self.dispatcher = Dispatcher(max_workers or max(1, cpu_count() - 1), queue_size, dispatch)
+        self.pacer = pacer or Pacer()
+        if self.pacer.backlog is None:
+            self.pacer.backlog = lambda: self.dispatcher.depth() / max(1, queue_size)
+
+        self.dir_name = dir_name or os.path.join(out_dir, time.ctime().replace(":", '_'))
+        os.makedirs(self.dir_name, mode=0o755, exist_ok=True)
         self.vol_path = vol_path
         self.vol_size = vol_size
-        self.file = file
+        # files start on cluster boundaries, counted from the start of the partition
+        self.sector_size = sector_size
+        self.cluster_size = cluster_size or sector_size
+        self.partition_offset = partition_offset
+        self.granularity = granularity
+        self.use_ntfs = use_ntfs
+        self.metadata_error = None
+        # with free_space_only, only the clusters $Bitmap marks free (and those of candidates) are searched
+        self.free_space_only = free_space_only
+        self.search_space = None    # a RangeSet, or None for the whole volume
+        self.bitmap_error = None
+        # directory of a diskindex.DiskIndex of the volume, whose indexed ranges need not be read
+        self.disk_index = disk_index
+        self.disk_index_error = None
+        self.unit_size = unit_size(sector_size, cluster_size, granularity)
+        self.meaningless = meaningless(self.unit_size)
+        # a block size or number of processes left as None is chosen by calibration
+        self.auto_calibrate = calibrate
+        self.calibration = None
+        self.auto_block_size = block_size is None
+        self.block_size = clamp_block_size(block_size or DEFAULT_BLOCK_SIZE, self.unit_size)
+        self.backend = backend
+        self.auto_processes = processes is None
+        self.processes = processes or 0
+        self.sequential = False     # whether calibration chose to read every unit rather than skim
+        self.volume_class = BACKENDS[backend]
+        # where reads failed or were skipped, to be retried once everything else has been searched
+        self.bad_blocks = badblocks.BadBlocks()
+        self.read_timeout = read_timeout
+        self.read_retries = read_retries
+        self.retrying = False
+        self.shared_volume = self.volume_class(vol_path) if self.volume_class.shared else None
+        files = list(files) if isinstance(files, (list, tuple)) else [files]
+        # sources must be split into the units the volume is probed at; the job owns them and closes them
+        self.files = []
+        for file in files:
+            if file.sector_size != self.unit_size:
+                file.close()
+                file = SourceFile(file.path, sector_size=self.unit_size)
+            self.files.append(file)
+        self.file = self.files[0]
+        self.index = SectorIndex(self.files)
+        # the last meaningful unit before each tail, whose match says where the tail should lie
+        self.tail_leads = [self.tail_lead(file) for file in self.files]
+        # tails not right after such a unit, by their leading bytes: they are also matched by prefix as units are read
+        self.tails = {}
+        for file_id, file in enumerate(self.files):
+            if self.tail_unreachable(file, self.tail_leads[file_id]):
+                self.tails.setdefault(file.tail[:TAIL_KEY], []).append(file_id)
+        self.prefilter = make_prefilter([block for file in self.files for block in file.blocks()], self.index,
+                                        self.unit_size)
+        # units within near_distance bits of a source unit are matched too, as bit rot; a sharded scan can't
+        if near_distance is not None and processes is not None and processes > 1:
+            raise ValueError('near matching is not available with several processes')
+        self.near = nearmatch.NearIndex(self.files, near_distance, self.unit_size) if near_distance else None
+        self.auto_filled = 0
         self.done_sectors = 0
-        self.total_sectors = len(file.remaining_sectors)
-        self.jump_sectors = self.total_sectors // 2
-        self.skim_reader = SkimReader(self.vol_path, self.jump_sectors, init_address)
+        self.total_sectors = sum(file.total_sectors for file in self.files)
+        self.jump_sectors = self.skim_jump()
+        self.skim_reader = SkimReader(self, self.open_volume(), self.jump_sectors, self.align(init_address),
+                                      self.block_size)
+        # parts of the volume that have been read and checked in full, and those being read now
+        self.covered = RangeSet()
+        self.claims = IntervalMap()
+        self.claim_lock = Lock()
+        # close inspections to pick up again when the job starts, as (origin, sector limit)
+        self.restored_inspections = []
+        self.checkpointer = checkpoint.Checkpointer(self, self.dir_name, checkpoint_interval) if checkpoint_interval else None
         friendly_vol_path = vol_path.replace(':', '').replace('/', '').replace('\\', '').replace('.', '')
-        self.rebuilt_file_path = self.dir_name + '/' + self.file.name.split('.')[0] + " [reconstructed using sectors from " + friendly_vol_path + "]." + self.file.name.split('.')[1]
+        for file_id, file in enumerate(self.files):
+            stem, ext = os.path.splitext(file.name)
+            if any(other.name == file.name for other in self.files[:file_id]):
+                stem += ' (' + str(file_id) + ')'
+            file.rebuilt_file_path = os.path.join(self.dir_name, stem + " [reconstructed using sectors from " + friendly_vol_path + "]" + ext)
+        self.rebuilt_file_path = self.file.rebuilt_file_path
+
+    def align(self, address):
+        """Round address up to the next unit boundary of the partition."""
+        offset = max(0, address - self.partition_offset)
+        return self.partition_offset + -(-offset // self.unit_size) * self.unit_size
 
+    def skim_jump(self):
+        """Skim stride in sectors: half the size of the smallest file still being searched for, or none when
+        reading sequentially."""
+        if self.sequential:
+            return 0
+        remaining = [file.total_sectors for file in self.files if not file.finished]
+        return min(remaining or [0]) // 2
 
-    def test_run(self):
-        #debug_this_thread()
-        def fake_fn(inp):
-            _  = [i for i, sector in enumerate(job.file.remaining_sectors) if sector == inp]
+    def snapshot(self):
+        """Return the job's checked state as a JSON-serialisable dict, for a checkpoint."""
+        with self.inspection_mutex:
+            skim = self.skim_reader
+            inspections = {}
+            for reader in skim.inspections:
+                inspections[reader.id_tuple[1]] = reader.sector_limit
+            return {
+                'vol_path': self.vol_path,
+                'vol_size': self.vol_size,
+                'geometry': {'sector_size': self.sector_size, 'cluster_size': self.cluster_size,
+                             'partition_offset': self.partition_offset, 'granularity': self.granularity},
+                'use_ntfs': self.use_ntfs,
+                'free_space_only': self.free_space_only,
+                'sources': [{'path': os.path.abspath(file.path), 'size': file.size, 'finished': file.written,
+                             'near_matches': sorted(file.near_matches.items())} for file in self.files],
+                'skim': {'init_address': skim.init_address, 'checked_to': skim.checked_to,
+                         'second_pass': skim.second_pass},
+                'inspections': sorted(inspections.items()),
+                'covered': self.covered.as_list(),
+                'bad_blocks': self.bad_blocks.as_dict(),
+                'auto_filled': self.auto_filled,
+            }
 
-        test_window = 0.5
+    def restore(self, state):
+        """Load a checkpoint's state into this freshly constructed job."""
+        for file_id, (file, saved) in enumerate(zip(self.files, state['sources'])):
+            if file.size != saved['size']:
+                raise ValueError(file.path + ' has changed since the checkpoint was written')
+            table = checkpoint.load_table(self.dir_name, file_id)
+            if len(table) != file.total_sectors:
+                raise ValueError('the checkpoint table of ' + file.path + ' does not match the file')
+            for i, addr in enumerate(table):
+                if addr != UNMATCHED:
+                    self.index.restore(file_id, i, addr)
+                    if addr != AUTO_FILLED:
+                        file.done_sectors += 1
+                        self.done_sectors += 1
+            file.address_table = table
+            file.finished = file.written = saved['finished']
+            file.near_matches = dict(saved.get('near_matches', []))
+        self.auto_filled = state['auto_filled']
+        for start, end in state['covered']:
+            self.covered.add(start, end)
+        if 'bad_blocks' in state:
+            self.bad_blocks.update(state['bad_blocks'])
+        skim = state['skim']
+        self.skim_reader.second_pass = skim['second_pass']
+        self.skim_reader.checked_to = self.skim_reader.resume_at = skim['checked_to']
+        self.restored_inspections = [tuple(insp) for insp in state['inspections']]
+        self.jump_sectors = self.skim_jump()
+        self.skim_reader.set_jump(self.jump_sectors)
 
-        self.skim_reader.fobj.seek(0)
+    @classmethod
+    def resume(cls, dir_name, **kwargs):
+        """Return a job that carries on from the checkpoint in dir_name. kwargs are passed to the constructor."""
+        state = checkpoint.load(dir_name)
+        geometry = state['geometry']
+        size = unit_size(geometry['sector_size'], geometry['cluster_size'], geometry['granularity'])
+        files = [SourceFile(source['path'], sector_size=size) for source in state['sources']]
+        job = cls(state['vol_path'], state['vol_size'], files, state['skim']['init_address'],
+                  dir_name=dir_name, **dict(kwargs, use_ntfs=state['use_ntfs'], free_space_only=state['free_space_only'], **geometry))
+        job.restore(state)
+        return job
+
+    def search_ranges(self, start, end):
+        """Return the parts of [start, end) in the search space, as a list of (start, end) pairs."""
+        if self.search_space is None:
+            return [(start, end)] if start < end else []
+        return self.search_space.intersection(start, end)
+
+    def unread_ranges(self, start, end):
+        """Return the parts of [start, end) in the search space that no reader has read or is reading."""
+        began = time.perf_counter()
+        ranges = [gap for s, e in self.search_ranges(start, end) for covered_gap in self.covered.gaps(s, e)
+                  for gap in self.claims.gaps(*covered_gap)]
+        self.profiler.record('coverage', began)
+        return ranges
+
+    def claim(self, start, end, reader):
+        """Reserve the unread parts of [start, end) for reader, until it calls claims.remove(reader).
+        Returns them as a list of (start, end) pairs."""
+        with self.claim_lock:
+            ranges = self.unread_ranges(start, end)
+            began = time.perf_counter()
+            for s, e in ranges:
+                self.claims.add(s, e, reader)
+            self.profiler.record('coverage', began)
+        return ranges
+
+    def open_volume(self, tolerant=True, trim=False):
+        """Return the volume a new reader should read from: the job's shared mapping, or a private descriptor.
+
+        Unless tolerant is false, failed reads are entered in the bad-block map and read as zeroes; with
+        trim, the failed blocks are split down to the units that fail (see badblocks.TolerantVolume).
+        """
+        volume = self.shared_volume or self.volume_class(self.vol_path)
+        if not tolerant:
+            return volume
+        return badblocks.TolerantVolume(volume, self.bad_blocks, self.vol_size,
+                                        lambda: self.open_volume(tolerant=False), self.read_timeout, trim,
+                                        self.unit_size)
+
+    def submit(self, fn, *args, items=1):
+        """Hand fn(*args) to the job's dispatcher. An exception raised by fn fails the job."""
+        if self.finished:
+            return None
         start = time.perf_counter()
-        skips = 0
-        while True:
-            data = self.skim_reader.fobj.read(SECTOR_SIZE)
-            threadpool.start(Worker(fake_fn, data))
-            skips += 1
-            progress = (time.perf_counter() - start) / test_window
-            if progress >= 1:
+        try:
+            future = self.dispatcher.submit(fn, *args, items=items)
+        except RuntimeError:    # the dispatcher was shut down by another thread finishing the job
+            return None
+        finally:
+            self.profiler.record('dispatch', start, items)
+        future.add_done_callback(self._check_future)
+        return future
+
+    def spawn(self, fn, *args):
+        """Run the long-lived reader method fn(*args) on its own thread, so readers never starve the matcher threads."""
+        thread = Thread(target=self._run_guarded, args=(fn,) + args, daemon=True)
+        with self.finish_lock:
+            self.threads = [t for t in self.threads if t.is_alive()] + [thread]
+        thread.start()
+        return thread
+
+    def join(self, timeout=None):
+        """Wait for the job's reader threads to return after it has finished, so that they release what
+        they hold before the process exits."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in list(self.threads):
+            if thread is not current_thread():
+                thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def _check_future(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        self.error = future.exception()
+        traceback.print_exception(type(self.error), self.error, self.error.__traceback__)
+        self.fail()
+
+    def record(self, file_id, i, addr):
+        """Record that sector i of file file_id, retired from the index (which entered it in the address table),
+        was found at addr."""
+        file = self.files[file_id]
+        file.done_sectors += 1
+        self.done_sectors += 1
+        self.success_signal.emit((file_id, i))
+        if i == self.tail_leads[file_id]:
+            self.match_tail(file_id, addr + (file.total_sectors - 1 - i) * self.unit_size)
+
+    def match_tail(self, file_id, addr):
+        """Match the last sector of a file at addr, comparing only the bytes that belong to the file.
+
+        The rest of the last sector (or cluster) on the disk is slack that need not be
+        zero, so the padded tail in the index would never be found by content. It is
+        looked for after the last meaningful unit before it, as meaningless ones are not
+        matched by content; tails not right after such a unit are compared by prefix as
+        units are read as well (see tail_unreachable).
+        """
+        file = self.files[file_id]
+        i = file.total_sectors - 1
+        if file.address_table[i] != UNMATCHED or file.tail_length == file.sector_size:
+            return
+        volume = self.open_volume(tolerant=False)
+        try:
+            data = volume.read(addr, self.unit_size)    # whole units, as raw volumes require
+        except OSError:
+            return      # zeroes read in its place could pass for a tail of zeroes
+        finally:
+            if not volume.shared:
+                volume.close()
+        if data[:file.tail_length] == file.tail[:file.tail_length] and self.index.restore(file_id, i, addr):
+            self.record(file_id, i, addr)
+
+    def tail_lead(self, file):
+        """Return the index of the last meaningful unit of file before its tail, or -1."""
+        for i in range(file.total_sectors - 2, -1, -1):
+            if file.sector(i) not in self.meaningless:
+                return i
+        return -1
+
+    def tail_unreachable(self, file, lead):
+        """Whether the tail of file is also compared by prefix with the units read: it is padded, and the unit
+        before it, if any, is meaningless, so that no match may lead to it."""
+        if file.tail_length >= file.sector_size or file.tail_length < TAIL_KEY:
+            return False
+        if file.tail[:file.tail_length] in (b'\x00' * file.tail_length, b'\xff' * file.tail_length):
+            return False
+        return lead < 0 or lead != file.total_sectors - 2
+
+    def retire_tail(self, sector, addr):
+        """Retire the tails matched by prefix that sector begins with. Returns [(file id, source index), ...]."""
+        matches = []
+        for file_id in self.tails.get(bytes(sector[:TAIL_KEY]), ()):
+            file = self.files[file_id]
+            i = file.total_sectors - 1
+            if sector[:file.tail_length] == file.tail[:file.tail_length] and self.index.restore(file_id, i, addr):
+                matches.append((file_id, i))
+        return matches
+
+    def verify_extent(self, file_id, j, addr, data, backward=False):
+        """Compare data, read at addr, with the file's sectors from j on, in one comparison if they all match.
+
+        Returns how many units match: leading ones, or trailing ones if backward.
+        On a mismatch the extent is bisected to find where it breaks. Units in the
+        bad-block map don't match, whatever their zeroes.
+        """
+        start = time.perf_counter()
+        try:
+            unit = self.unit_size
+            bad = self.bad_blocks.intersection(addr, addr + len(data) // unit * unit)
+            if bad and backward:
+                skip = -(-(bad[-1][1] - addr) // unit)
+                return self._verify_extent(file_id, j + skip, data[skip * unit:len(data) // unit * unit], backward)
+            if bad:
+                data = data[:(bad[0][0] - addr) // unit * unit]
+            return self._verify_extent(file_id, j, data, backward)
+        finally:
+            self.profiler.record('match', start, len(data) // self.unit_size)
+
+    def _verify_extent(self, file_id, j, data, backward):
+        file = self.files[file_id]
+        unit = self.unit_size
+        count = len(data) // unit
+
+        def same(a, b):
+            # only the bytes that belong to the file count in its last sector
+            end = min(file.size, (j + b) * unit)
+            return file.map[(j + a) * unit:end] == bytes(data[a * unit:end - j * unit])
+
+        if count == 0 or same(0, count):
+            return count
+        lo, hi = 0, count
+        if backward:
+            # units [hi, count) match and the last mismatch is in [lo, hi)
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if same(mid, hi):
+                    hi = mid
+                else:
+                    lo = mid
+            return count - hi
+        # units [0, lo) match and the first mismatch is in [lo, hi)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if same(lo, mid):
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def record_extent(self, file_id, j, addr, data):
+        """Record data, verified to be the file's sectors from j on, as found at addr, and mark it covered."""
+        file = self.files[file_id]
+        unit = self.unit_size
+        count = len(data) // unit
+        if count == 0:
+            return
+        # sectors already found elsewhere keep their addresses
+        restored = self.index.restore_run(file_id, j, j + count, addr)
+        file.done_sectors += len(restored)
+        self.done_sectors += len(restored)
+        file.extents.append((j, addr, count))
+        self.extent_signal.emit((file_id, j, addr, count))
+        if j <= self.tail_leads[file_id] < j + count:
+            self.match_tail(file_id, addr + (file.total_sectors - 1 - j) * unit)
+        touched = {file_id}
+        if len(self.files) > 1:
+            # the other files may need the same content
+            for k in range(count):
+                for other, i in self.index.retire(data[k * unit:(k + 1) * unit], addr + k * unit):
+                    self.record(other, i, addr + k * unit)
+                    touched.add(other)
+        self.covered.add(addr, addr + count * unit)
+        for file_id in touched:
+            if self.index.remaining_meaningful[file_id] == 0:
+                self.finish_file(file_id)
+
+    def check_unit(self, addr, data):
+        """Check a single unit against the index and mark it covered. Returns [(file id, source index), ...]
+        of the units it matched."""
+        matches = []
+        if data not in self.meaningless and not self.bad_blocks.intersection(addr, addr + self.unit_size):
+            matches = self.index.retire(data, addr)
+            if not matches and self.tails:
+                matches = self.retire_tail(data, addr)
+            if not matches and self.near is not None:
+                matches = self.retire_near(data, addr)
+            for file_id, i in matches:
+                self.record(file_id, i, addr)
+                if self.index.remaining_meaningful[file_id] == 0:
+                    self.finish_file(file_id)
+        self.covered.add(addr, addr + self.unit_size)
+        return matches
+
+    def candidates(self, sectors, keep_meaningless=False):
+        """Return the positions in sectors worth checking: those the prefilter passes, those beginning like a tail
+        matched by prefix, and near matches."""
+        found = self.prefilter.candidates(sectors, keep_meaningless=keep_meaningless)
+        if not self.tails and self.near is None:
+            return found
+        found = set(found)
+        if self.tails:
+            found.update(n for n, sector in enumerate(sectors) if bytes(sector[:TAIL_KEY]) in self.tails)
+        if self.near is not None:
+            found.update(self.near.candidates(sectors))
+        return sorted(found)
+
+    def retire_near(self, sector, addr):
+        """Retire, for each file, the outstanding unit nearest to sector within the near-match distance,
+        which is reported as found at addr. Returns [(file id, source index), ...]."""
+        matches = []
+        for d, file_id, i in self.near.nearest(sector):
+            if any(other == file_id for other, _ in matches) or not self.index.restore(file_id, i, addr):
+                continue
+            self.files[file_id].near_matches[i] = d
+            self.near_signal.emit((file_id, i, addr, d))
+            matches.append((file_id, i))
+        return matches
+
+    def chunks(self, pairs):
+        """Split pairs into lists of at most batch_size, one dispatch task each."""
+        return [pairs[n:n + self.batch_size] for n in range(0, len(pairs), self.batch_size)]
+
+    def check_batch(self, pairs, close_reader=None):
+        """Check a batch of (address, sector) pairs in order. A None sector is a known miss."""
+        start = time.perf_counter()
+        for addr, inp in pairs:
+            if self.finished:
                 break
-            self.test_run_progress_signal.emit(100 * progress)
-            self.skim_reader.fobj.seek(self.skim_reader.jump_size, 1)
+            if inp is None:
+                close_reader.consecutive_successes = 0
+            elif close_reader and close_reader.consecutive_successes <= 2 and inp in self.meaningless:
+                continue
+            else:
+                self.check_sector(inp, addr, close_reader)
+        self.profiler.record('match', start, len(pairs))
 
-        avg = skips * SAMPLE_WINDOW / test_window
-        return avg
+    def check_sector(self, inp, addr, close_reader=None):
+        matches = []
+        # zeroes read in place of a bad block match nothing
+        if not self.bad_blocks.intersection(addr, addr + self.unit_size):
+            matches = self.index.retire(inp, addr)
+            if not matches and self.tails:
+                matches = self.retire_tail(inp, addr)
+            if not matches and self.near is not None:
+                # a rotted unit of an extent still counts towards the run of successes
+                matches = self.retire_near(inp, addr)
+        if not matches:  # inp is not an outstanding sector of any file
+            if close_reader:
+                close_reader.consecutive_successes = 0
+            return
+        for file_id, i in matches:
+            self.record(file_id, i, addr)
+        if close_reader:
+            close_reader.success_count += 1
+            close_reader.consecutive_successes += 1
+            close_reader.hint = (*matches[0], addr)
+        elif not self.skim_reader.inspection_in_progress(addr):
+            self.new_prediction(*matches[0], addr)
+        for file_id, _ in matches:
+            if self.index.remaining_meaningful[file_id] == 0:
+                self.finish_file(file_id)
+        return
+
+    def calibrate(self):
+        """Measure the device, then choose the block size and whether to read the search space sequentially
+        (on several processes if the device rewards it) rather than skim it, where the caller left them open."""
+        result = calibration.calibrate(self.open_volume, self.vol_size, self.unit_size, self.partition_offset,
+                                       progress=lambda done: self.test_run_progress_signal.emit(100 * done))
+        self.calibration = result
+        if self.auto_block_size:
+            self.block_size = clamp_block_size(result.block_size, self.unit_size)
+            self.skim_reader.block_size = self.block_size
+        search_bytes = sum(end - start for start, end in self.unread_ranges(self.partition_offset, self.vol_size))
+        if self.processes <= 1 and result.prefers_sequential(search_bytes, self.skim_reader.stride):
+            # only a scan from the start of the partition is handed to processes unasked
+            if self.auto_processes and result.readers > 1 and self.near is None \
+                    and self.skim_reader.init_address == self.partition_offset:
+                self.processes = result.readers
+            else:
+                self.sequential = True
+                self.jump_sectors = self.skim_jump()
+                self.skim_reader.set_jump(self.jump_sectors)
+        self.telemetry.probe_rate.seed(result.probe_rate(self.skim_reader.stride))
+        self.calibration_signal.emit(result)
 
     def run(self):
-        init_avg = self.test_run()
-        self.skim_reader.perf = PerformanceCalculator(self.vol_size, self.skim_reader.jump_size, self.jump_sectors, init_avg=init_avg)
+        """Run the job on the calling thread until the skim hands control to the inspections."""
+        if self.checkpointer:
+            self.checkpointer.start()
+        self.sampler.start()
+        # inspections started before the skim leave it to this thread
+        self.skim_reader.running = True
+        # a resumed job may hold complete files whose output was not written before the checkpoint
+        for file_id, file in enumerate(self.files):
+            if not file.finished and self.index.remaining_meaningful[file_id] == 0:
+                self.finish_file(file_id)
+        if self.finished:
+            return
+        if self.disk_index:
+            self.telemetry.phase = 'index_lookup'
+            self.search_disk_index()
+            if self.finished:
+                return
+        if self.use_ntfs:
+            self.telemetry.phase = 'metadata'
+            self.probe_metadata()
+            if self.finished:
+                return
+        if self.auto_calibrate:
+            self.telemetry.phase = 'calibration'
+            self.calibrate()
+        if self.processes > 1:
+            self.run_sharded()
+            return
+        self.skim_reader.perf = PerformanceCalculator(self.vol_size, self.skim_reader.stride)
+        self.telemetry.phase = 'skim'
+        self.test_run_finished_signal.emit()
+        if self.restored_inspections:
+            # the skim carries on from resume_at once these are done
+            with self.inspection_mutex:
+                self.skim_reader.running = False
+            self.start_inspections(self.restored_inspections)
+            self.restored_inspections = []
+        else:
+            self.skim_reader.read(self.skim_reader.resume_at)
+
+    def search_disk_index(self):
+        """Verify the units the disk index gives for the outstanding source units, then count the indexed
+        ranges as covered: whatever else they hold matches no source unit."""
+        volume = self.open_volume()
+        try:
+            index = diskindex.DiskIndex.open(self.disk_index, volume, self.vol_path, self.vol_size, self.unit_size,
+                                             self.partition_offset)
+        except diskindex.DiskIndexError as e:
+            # the volume is scanned as if there were no index
+            self.disk_index_error = e
+            self.disk_index_signal.emit(None)
+            return
+        finally:
+            if not volume.shared:
+                volume.close()
+        try:
+            skip = {digest(sector) for sector in self.meaningless}
+            wanted = {}     # digest -> outstanding source units with it
+            for file in self.files:
+                if file.finished:
+                    continue
+                for i, key in enumerate(file.digests):
+                    if key not in skip and file.address_table[i] == UNMATCHED:
+                        wanted[key] = wanted.get(key, 0) + 1
+            # any copy of a unit will do, so only a few are read
+            addresses = sorted({addr for key, count in wanted.items()
+                                for addr in index.lookup(key, count + INDEX_SPARE_COPIES)})
+            indexed = index.covered.as_list()
+        finally:
+            index.close()
+
+        unit = self.unit_size
+        reader = self.skim_reader
+        n = 0
+        while n < len(addresses) and not self.finished:
+            # read runs of consecutive units in one go
+            run = 1
+            while n + run < len(addresses) and addresses[n + run] == addresses[n] + run * unit \
+                    and run * unit < self.block_size:
+                run += 1
+            data = reader.volume.read(addresses[n], run * unit)
+            for k in range(len(data) // unit):
+                self.check_unit(addresses[n] + k * unit, data[k * unit:(k + 1) * unit])
+            n += run
+        for start, end in indexed:
+            self.covered.add(start, end)
+        self.disk_index_signal.emit((sum(end - start for start, end in indexed), len(addresses)))
+
+    def probe_metadata(self):
+        """Probe the extents the NTFS metadata proposes for the source files, before any blind scanning."""
+        volume = self.open_volume()
+        try:
+            try:
+                candidates = ntfs.find_candidates(volume, self.files, self.partition_offset, self.block_size)
+            except ntfs.NtfsError as e:
+                # no usable file system metadata; the scan finds the files without it
+                self.metadata_error = e
+                candidates = []
+            if self.free_space_only:
+                try:
+                    self.search_space = ntfs.search_space(volume, self.partition_offset, self.block_size, candidates)
+                except ntfs.NtfsError as e:
+                    # an untrustworthy bitmap could hide the file; search everything
+                    self.bitmap_error = e
+        finally:
+            if not volume.shared:
+                volume.close()
+        self.candidates_signal.emit(candidates)
+        self.search_space_signal.emit(self.search_space.total() if self.search_space is not None else None)
+        for extent in candidates:
+            if self.finished:
+                return
+            if not self.files[extent.file_id].finished:
+                self.probe_extent(extent)
+
+    def probe_extent(self, extent):
+        """Read an extent and match it against the sectors of its file at the positions the metadata gives.
+
+        Sectors that aren't where the metadata says are looked up like any other,
+        so the extent counts as covered afterwards.
+        """
+        file_id = extent.file_id
+        file = self.files[file_id]
+        unit = self.unit_size
+        end = min(extent.address + extent.length, self.vol_size)
+        touched = {file_id}
+        for gap_start, gap_end in self.covered.gaps(extent.address, end):
+            for batch in self.skim_reader.batches(gap_start, gap_end):
+                for addr, data in batch:
+                    i = (extent.source_offset + addr - extent.address) // unit
+                    if self.bad_blocks.intersection(addr, addr + unit):
+                        continue
+                    if i < file.total_sectors and data == file.sector(i) and self.index.restore(file_id, i, addr):
+                        self.record(file_id, i, addr)
+                    elif data not in self.meaningless:
+                        for other, j in self.index.retire(data, addr):
+                            self.record(other, j, addr)
+                            touched.add(other)
+                self.covered.add(batch[0][0], batch[-1][0] + unit)
+                if self.finished:
+                    return
+        for other in touched:
+            if self.index.remaining_meaningful[other] == 0:
+                self.finish_file(other)
+
+    def run_sharded(self):
+        """Read the whole volume sequentially with a pool of processes instead of skimming it."""
+        def merge(matches):
+            start = time.perf_counter()
+            for position, addr in matches:
+                # workers report one sector per content; retire whichever copies are still outstanding
+                file_id, i = self.index.locate(position)
+                for file_id, i in self.index.retire(self.files[file_id].sector(i), addr):
+                    self.record(file_id, i, addr)
+                    if self.index.remaining_meaningful[file_id] == 0:
+                        self.finish_file(file_id)
+            self.profiler.record('match', start, len(matches))
+
+        skim = self.skim_reader
+        # the scan wraps around from the end of the volume to the start of the partition
+        span = self.vol_size - self.partition_offset
+        skim.perf = PerformanceCalculator(span, self.unit_size)
+        self.telemetry.phase = 'sharded'
+
+        def progress(done):
+            skim.position = self.partition_offset + (skim.init_address - self.partition_offset + done) % max(1, span)
+            # the workers' reads happen in other processes, so count them here
+            self.telemetry.bytes_read.add(done - skim.perf.total_sectors_read * self.unit_size)
+            skim.perf.add(done // self.unit_size - skim.perf.total_sectors_read)
+
         self.test_run_finished_signal.emit()
-        self.skim_reader.read()
-
-    def new_close_inspection(self, address):
-        inspection_manipulation_mutex.acquire()
-        forward = CloseReader(address)
-        backward = CloseReader(address, True)
-        job.skim_reader.inspections.append(forward)
-        job.skim_reader.inspections.append(backward)
-        job.skim_reader.new_inspection_signal.emit((address, forward, backward))
-        inspection_manipulation_mutex.release()
-        threadpool.start(Worker(forward.read))
-        threadpool.start(Worker(backward.read))
-
-    def finish(self):
-
-        self.finished = True
+        shards.scan(self.vol_path, self.vol_size, self.index, self.processes, merge, progress,
+                    start=self.skim_reader.init_address, block_size=self.block_size, backend=self.backend,
+                    sector_size=self.unit_size, origin=self.partition_offset, covered=self.covered,
+                    within=self.search_space, should_stop=lambda: self.finished, bad_blocks=self.bad_blocks,
+                    read_timeout=self.read_timeout)
+        self.exhausted()    # only reached if some file was not found
+
+    def start(self):
+        """Run the job in a background thread. Use wait() to block until it has finished."""
+        return self.spawn(self.run)
+
+    def _run_guarded(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self.error = e
+            traceback.print_exc()
+            self.fail()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished. Returns False if timeout expired first."""
+        return self.done.wait(timeout)
+
+    def new_close_inspection(self, address, sector_limit):
+        self.start_inspections([(address, sector_limit)])
+
+    def new_prediction(self, file_id, i, addr):
+        """Grow the extent around sector i of file file_id, found at addr, before sweeping around it."""
+        reader = PredictiveReader(self, file_id, i, addr)
+        with self.inspection_mutex:
+            self.skim_reader.add_inspection(reader)
+        self.spawn(reader.read)
+
+    def start_inspections(self, inspections):
+        """Start a forward and a backward close inspection for each (address, sector limit) pair."""
+        readers = []
+        with self.inspection_mutex:
+            # register them all before any can finish, so the skim doesn't resume in between
+            for address, sector_limit in inspections:
+                forward = CloseReader(self, address, sector_limit)
+                backward = CloseReader(self, address, sector_limit, True)
+                self.skim_reader.add_inspection(forward)
+                self.skim_reader.add_inspection(backward)
+                self.skim_reader.new_inspection_signal.emit((address, forward, backward))
+                readers += [forward, backward]
+        for reader in readers:
+            self.spawn(reader.read)
+
+    def sample_progress(self):
+        """Publish the readers' progress counters through their progress signals, where they changed."""
+        self.telemetry.sample()
+        skim = self.skim_reader
+        published = {}
+        inspections = {}
+        for reader in list(skim.inspections):
+            if isinstance(reader, CloseReader):
+                info = (reader.perf.progress, reader.success_count / max(1, reader.sector_count))
+                inspections[reader.id_tuple[0] + reader.id_tuple[2]] = info
+                published[reader] = info
+        if skim.perf is not None:
+            published[skim] = skim.perf.progress
+        published[self] = {'skim': published.get(skim), 'position': skim.position, 'done': self.done_sectors,
+                           'total': self.total_sectors, 'inspections': inspections}
+        for source, value in published.items():
+            if self.published.get(source) != value:
+                source.progress_signal.emit(value)
+        self.published = published
+
+    def save_checkpoint(self):
+        """Write a checkpoint now, if checkpoints are enabled."""
+        if self.checkpointer:
+            self.checkpointer.write()
+
+    def exhausted(self):
+        """Called once the whole search space has been read without finding every file: read the bad blocks
+        again, and fail the job if they don't hold what is missing either."""
+        with self.finish_lock:
+            if self.retrying or self.finished:
+                return
+            self.retrying = True
+        self.retry_bad_blocks()
+        self.fail()
+
+    def retry_bad_blocks(self):
+        """Read the failed and skipped ranges of the bad-block map again, up to read_retries times, and check
+        every unit that reads now."""
+        reader = DiskReader(self, self.open_volume(trim=True), self.block_size)
+        unit = self.unit_size
+        try:
+            for _ in range(self.read_retries):
+                pending = self.bad_blocks.pending()
+                if not pending or self.finished:
+                    break
+                self.telemetry.phase = 'retry'
+                self.bad_blocks_signal.emit(self.bad_blocks)
+                for start, end in pending:
+                    # whole units, as they were probed
+                    start = max(self.partition_offset, start)
+                    start -= (start - self.partition_offset) % unit
+                    end = self.align(end)
+                    self.bad_blocks.clear(start, end)
+                    for batch in reader.batches(start, end):
+                        for addr, data in batch:
+                            self.check_unit(addr, data)
+                        if self.finished:
+                            return
+        finally:
+            reader.close()
+
+    def fail(self):
+        with self.finish_lock:
+            if self.finished:
+                return
+            self.finished = True
+        if self.checkpointer:
+            # keep what has been covered so far for a later --resume
+            self.checkpointer.stop()
+            self.checkpointer.write()
+        for file_id, file in enumerate(self.files):
+            if not file.finished:
+                self.file_finished_signal.emit((file_id, False, 0))
+        self.finished_signal.emit((False, self.auto_filled))
+        self._shutdown()
+
+    def finish_file(self, file_id):
+        """Write out a file whose every meaningful sector has been found."""
+        file = self.files[file_id]
+        with self.finish_lock:
+            if file.finished or self.finished:
+                return
+            file.finished = True
+            all_finished = all(f.finished for f in self.files)
+            if all_finished:
+                self.finished = True
+
         auto_filled = 0
-        for sector in filter(None, job.file.remaining_sectors):
-            if sector in MEANINGLESS_SECTORS:
-                i = job.file.remaining_sectors.index(sector)
-                job.file.address_table[i] = sector
-                job.file.remaining_sectors[i] = None
-                auto_filled += 1
-
-        fobj = os.fdopen(os.open(self.vol_path, os.O_RDONLY | os.O_BINARY), 'rb')
-        out_file = open(self.rebuilt_file_path, 'wb')
-        for addresses in job.file.address_table:
-            fobj.seek(addresses[0])
-            out_file.write(fobj.read(SECTOR_SIZE))
-            out_file.flush()
-        out_file.close()
-        self.finished_signal.emit((True, auto_filled))
+        for _ in self.index.retire_meaningless(file_id):
+            auto_filled += 1
+        self.auto_filled += auto_filled
+
+        # an error must not pass for zeroes in the output
+        volume = self.open_volume(tolerant=False)
+        start = time.perf_counter()
+        try:
+            with open(file.rebuilt_file_path, 'wb') as out_file:
+                self.write_file(file, volume, out_file)
+            file.written = True
+        except OSError as e:
+            # units that were read once may fail now; the checkpoint keeps where they are for a --resume
+            self.error = e
+            traceback.print_exc()
+        finally:
+            self.profiler.record('write', start, file.size)
+            if not volume.shared:
+                volume.close()
+        self.file_finished_signal.emit((file_id, file.written, auto_filled))
+
+        if all_finished:
+            success = all(f.written for f in self.files)
+            if self.checkpointer:
+                self.checkpointer.stop()
+                if success:
+                    self.checkpointer.remove()
+                else:
+                    self.checkpointer.write()
+            self.finished_signal.emit((success, self.auto_filled))
+            self._shutdown()
+        else:
+            # the skim can now take bigger steps if the smallest file was the one finished
+            self.jump_sectors = self.skim_jump()
+            self.skim_reader.set_jump(self.jump_sectors)
+
+    def write_file(self, file, volume, out_file):
+        """Write the reconstruction of file, reading runs of consecutive addresses from the volume in one go."""
+        table = file.address_table
+        unit = self.unit_size
+        max_run = max(1, self.block_size // unit)
+        i = 0
+        while i < len(table):
+            if table[i] == AUTO_FILLED:    # meaningless sector, copied from the source
+                out_file.write(file.sector(i))
+                i += 1
+                continue
+            run = 1
+            while run < max_run and i + run < len(table) and table[i + run] == table[i] + run * unit:
+                run += 1
+            out_file.write(volume.read(table[i], run * unit))
+            i += run
+        # drop the padding (or cluster slack) after the end of the file
+        out_file.truncate(file.size)
+
+    def _shutdown(self):
+        self.sampler.stop()
+        if self.bad_blocks:
+            self.bad_blocks.write(os.path.join(self.dir_name, badblocks.MAP_NAME))
+        if self.telemetry.export_path:
+            self.telemetry.export()
+        if self.trace:
+            self.trace.write()
+        self.done.set()
+        # may be called from a matcher thread, so don't wait for the remaining tasks
+        self.dispatcher.shutdown()
+        # the readers and matchers may still be using the sources, so close them once they have all stopped
+        Thread(target=self._close_sources, name='Close sources', daemon=True).start()
 
+    def _close_sources(self):
+        self.join()
+        for thread in self.dispatcher.threads:
+            thread.join()
+        for file in self.files:
+            file.close()
@@ -0,0 +1,184 @@
+"""Process-sharded scanning of a whole volume.
+
+The volume is split into byte ranges ("shards") which are read sequentially by a
+pool of worker processes, so matching is no longer limited to the one core the
+GIL allows. The sorted source-sector digests live in shared memory: workers
+attach to them by name instead of receiving a pickled copy with every task, and
+verify hits against their own read-only mappings of the source files. Each
+worker opens its own reader once and returns the (flat source position, address)
+pairs it found, with the bad blocks it came across.
+"""
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+from badblocks import BadBlocks, TolerantVolume
+from reads import BACKENDS, DEFAULT_BLOCK_SIZE, iter_span
+from sources import SourceFile, digest, meaningless, SECTOR_SIZE
+
+DEFAULT_SHARD_SIZE = 64 * 1024 * 1024
+
+
+class SharedSourceIndex():
+    """The sorted digests of a SectorIndex and the flat positions they came from, in shared memory.
+
+    The creating process owns the segments and must call unlink() when the scan is over;
+    workers attach by name with attach() and only read them.
+    """
+
+    def __init__(self, keys, positions, count):
+        self.key_shm, self.position_shm = keys, positions
+        self.count = count
+        self.keys = keys.buf.cast('Q')[:self.count]
+        self.positions = positions.buf.cast('Q')[:self.count]
+
+    @classmethod
+    def create(cls, index):
+        count = len(index.keys)
+        # shared memory segments can't be empty
+        key_shm = shared_memory.SharedMemory(create=True, size=max(8, 8 * count))
+        position_shm = shared_memory.SharedMemory(create=True, size=max(8, 8 * count))
+        key_shm.buf[:8 * count] = index.keys.tobytes()
+        position_shm.buf[:8 * count] = index.positions.tobytes()
+        return cls(key_shm, position_shm, count)
+
+    @classmethod
+    def attach(cls, names, count):
+        # workers share the creator's resource tracker, so attaching doesn't transfer ownership
+        return cls(*(shared_memory.SharedMemory(name=name) for name in names), count)
+
+    @property
+    def names(self):
+        return (self.key_shm.name, self.position_shm.name)
+
+    def lookup(self, sector, files, starts):
+        """Return the flat position of some source sector equal to sector, or None."""
+        key = digest(sector)
+        n = bisect_left(self.keys, key)
+        while n < self.count and self.keys[n] == key:
+            position = self.positions[n]
+            file_id = bisect_right(starts, position) - 1
+            if files[file_id].sector(position - starts[file_id]) == sector:
+                return position
+            n += 1
+        return None
+
+    def close(self):
+        self.keys.release()
+        self.positions.release()
+        for shm in (self.key_shm, self.position_shm):
+            shm.close()
+
+    def unlink(self):
+        for shm in (self.key_shm, self.position_shm):
+            shm.unlink()
+
+
+# per-process state of a shard worker, set up once by _init_worker
+_worker = None
+
+
+def _init_worker(vol_path, vol_size, backend, names, count, paths, starts, sector_size, block_size, origin,
+                 read_timeout):
+    global _worker
+    index = SharedSourceIndex.attach(names, count)
+    files = [SourceFile(path, ingest=False, sector_size=sector_size) for path in paths]
+    prefilter = None
+    try:
+        from prefilter import np, NumpyPrefilter
+        if np is not None:
+            prefilter = NumpyPrefilter([block for file in files for block in file.blocks()], sector_size)
+    except ImportError:
+        pass
+    volume_class = BACKENDS[backend]
+    volume = TolerantVolume(volume_class(vol_path), BadBlocks(), vol_size, lambda: volume_class(vol_path),
+                            read_timeout, unit=sector_size)
+    _worker = (volume, index, files, starts, prefilter, sector_size, block_size, origin)
+
+
+def _scan_shard(start, end):
+    """Read [start, end) sequentially and return (bytes read, [(flat source position, address), ...],
+    the bad-block map of the shard as a dict)."""
+    volume, index, files, starts, prefilter, sector_size, block_size, origin = _worker
+    # each shard gets a map of its own, which the parent merges into the job's
+    volume.bad_blocks = BadBlocks()
+    skip = meaningless(sector_size)
+    matches = []
+    read = 0
+    for block_start, block in iter_span(volume, start, end, block_size, sector_size, origin):
+        read += len(block)
+        rows = range(0, len(block) - sector_size + 1, sector_size)
+        if prefilter is not None:
+            sectors = [block[rel:rel + sector_size] for rel in rows]
+            rows = [rows[n] for n in prefilter.candidates(sectors)]
+        for rel in rows:
+            sector = block[rel:rel + sector_size]
+            if sector in skip:
+                continue
+            position = index.lookup(sector, files, starts)
+            if position is not None:
+                matches.append((position, block_start + rel))
+    return read, matches, volume.bad_blocks.as_dict()
+
+
+def split(start, end, shard_size, sector_size=SECTOR_SIZE):
+    """Split [start, end) into sector-aligned shards of about shard_size bytes."""
+    shard_size = max(sector_size, shard_size - shard_size % sector_size)
+    return [(s, min(s + shard_size, end)) for s in range(start, end, shard_size)]
+
+
+def wrap(start, end, origin):
+    """Return the spans [start, end) and [origin, start), without empty ones: a scan from start that wraps
+    around to the beginning of the partition."""
+    return [(s, e) for s, e in ((start, end), (origin, min(start, end))) if s < e]
+
+
+def scan(vol_path, vol_size, index, processes, on_matches, on_progress=None, start=0,
+         block_size=DEFAULT_BLOCK_SIZE, backend='file', shard_size=DEFAULT_SHARD_SIZE,
+         sector_size=SECTOR_SIZE, origin=0, covered=None, within=None, should_stop=None, bad_blocks=None,
+         read_timeout=None):
+    """Scan [start, vol_size) and then [origin, start) with a pool of processes.
+
+    index is the SectorIndex of the source files. on_matches(matches) is called on the
+    calling thread with each shard's list of (flat source position, address) pairs as
+    soon as that shard is done; on_progress(bytes_read) follows it. Ranges in the
+    RangeSet covered are skipped, and each shard is added to it once its matches have
+    been handled. If within is a RangeSet, only the ranges in it are scanned. The scan
+    stops early once should_stop() returns True. The ranges the workers fail to read, or skip after
+    failures, are added to the BadBlocks bad_blocks, and reads taking longer than read_timeout seconds fail.
+
+    sector_size is the unit the sources are indexed in, and units lie at origin (the
+    partition start) plus a multiple of it; start must be one of those offsets.
+    """
+    shared = SharedSourceIndex.create(index)
+    paths = [file.path for file in index.files]
+    try:
+        with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                 initargs=(vol_path, vol_size, backend, shared.names, shared.count, paths,
+                                           index.starts, sector_size, block_size, origin, read_timeout)) as pool:
+            spans = [(s, e) for span_start, span_end in wrap(start, vol_size, origin)
+                     for s, e in (within.intersection(span_start, span_end) if within is not None
+                                  else [(span_start, span_end)])]
+            gaps = [gap for s, e in spans for gap in (covered.gaps(s, e) if covered is not None else [(s, e)])]
+            futures = {pool.submit(_scan_shard, s, e): (s, e)
+                       for gap_start, gap_end in gaps for s, e in split(gap_start, gap_end, shard_size, sector_size)}
+            done = 0
+            for future in as_completed(futures):
+                read, matches, bad = future.result()
+                on_matches(matches)
+                if bad_blocks is not None:
+                    bad_blocks.update(bad)
+                if covered is not None:
+                    covered.add(*futures[future])
+                done += read
+                if on_progress:
+                    on_progress(done)
+                if should_stop and should_stop():
+                    for f in futures:
+                        f.cancel()
+                    break
+    finally:
+        shared.close()
+        shared.unlink()
+
+
@@ -0,0 +1,268 @@
+"""Compact, streaming ingestion of the source files being searched for.
+
+A source file is never loaded into memory. It is mapped read-only and read once,
+block by block, to compute a 64-bit digest per sector; the mapping is then used
+to verify matches byte for byte. The index over all source files is a pair of
+flat arrays (digests sorted, and the positions they came from), and each file's
+address table is a flat array of disk addresses, so a source costs a few tens of
+bytes per sector whatever its size.
+"""
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from hashlib import blake2b
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SECTOR_SIZE = 512
+MEANINGLESS_SECTORS = [b'\x00' * SECTOR_SIZE, b'\xff' * SECTOR_SIZE]
+_meaningless = {SECTOR_SIZE: MEANINGLESS_SECTORS}
+# source files are read in blocks of this size while ingesting
+INGEST_BLOCK_SIZE = 4 * 1024 * 1024
+
+# address table entries that are not disk addresses
+UNMATCHED = -1
+AUTO_FILLED = -2
+
+
+def digest(sector):
+    """Return a 64-bit digest of sector."""
+    return int.from_bytes(blake2b(sector, digest_size=8).digest(), 'little')
+
+
+def meaningless(size):
+    """Return the all-zero and all-0xFF units of size bytes, which say nothing about where a file lies."""
+    if size not in _meaningless:
+        _meaningless[size] = [b'\x00' * size, b'\xff' * size]
+    return _meaningless[size]
+
+
+class SourceFile():
+    """represents information about the user's selected file that is relevant to both the UI and the main program.
+
+    Args:
+        path (string): path to the source file
+        ingest (bool): whether to compute the sector digests. Readers that only
+            need to verify content against the file can skip it.
+        sector_size (int): the unit the file is split into and matched by: a
+            disk sector, or a whole cluster when probing is cluster-aligned.
+    """
+
+    def __init__(self, path, ingest=True, sector_size=SECTOR_SIZE):
+        self.path = path
+        self.sector_size = sector_size
+        self.size = os.path.getsize(path)
+        self.total_sectors = -(-self.size // sector_size)
+
+        # the file is mapped rather than read, so only the pages in use are resident
+        self.fobj = open(path, 'rb')
+        self.map = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        # the final sector is padded with zeroes to maintain uniform sector length
+        tail_start = (self.total_sectors - 1) * sector_size
+        self.tail = bytes(self.map[tail_start:]).ljust(sector_size, b'\x00') if self.size else b''
+
+        # one digest per sector, and the number of sectors that are not meaningless
+        self.digests = array('Q')
+        self.meaningful_sectors = 0
+        if ingest:
+            self.ingest()
+
+        # disk address of each sector once it has been found (or UNMATCHED / AUTO_FILLED)
+        self.address_table = array('q', [UNMATCHED]) * self.total_sectors
+
+        # separate path into file and location
+        self.dir, self.name = os.path.split(os.path.abspath(path))
+
+        # per-file progress, maintained by the Job searching for this file
+        self.done_sectors = 0
+        self.extents = []       # (source start, disk address, length) of each run of sectors matched as a whole
+        self.near_matches = {}  # source index -> bits in which the unit found differs, for near matches
+        self.finished = False
+        self.written = False    # whether the reconstruction has been written out
+        self.rebuilt_file_path = None
+
+    def sector(self, i):
+        """Return the content of sector i."""
+        if i == self.total_sectors - 1:
+            return self.tail
+        return self.map[i * self.sector_size:(i + 1) * self.sector_size]
+
+    def blocks(self, block_size=INGEST_BLOCK_SIZE):
+        """Yield the file as buffers of whole (padded) sectors, in order."""
+        block_size = max(self.sector_size, block_size - block_size % self.sector_size)
+        whole = (self.total_sectors - 1) * self.sector_size if self.size else 0
+        view = memoryview(self.map) if self.size else None
+        for start in range(0, whole, block_size):
+            yield view[start:min(start + block_size, whole)]
+        if self.size:
+            yield self.tail
+
+    @property
+    def tail_length(self):
+        """Number of bytes of the file in its last sector."""
+        return self.size - (self.total_sectors - 1) * self.sector_size
+
+    def ingest(self):
+        """Read the file once and compute the digest of every sector."""
+        size = self.sector_size
+        skip = meaningless(size)
+        for block in self.blocks():
+            for rel in range(0, len(block), size):
+                sector = block[rel:rel + size]
+                self.digests.append(digest(sector))
+                if sector not in skip:
+                    self.meaningful_sectors += 1
+
+    def close(self):
+        """Release the mapping and the file. Only the attributes, such as the address table, remain usable."""
+        if self.size and not self.map.closed:
+            self.map.close()
+        self.fobj.close()
+
+
+class SectorIndex():
+    """Sorted-digest index from sector content to the (file id, source index) pairs that still need a match.
+
+    The digests of all files are concatenated and sorted once; positions[n] is the
+    flat position (file start + index) the n-th smallest digest came from, so equal
+    sectors sit next to each other, grouped by file and in index order. A match
+    retires, for every file that still needs that content, the lowest outstanding
+    index, which is verified against the source file itself.
+
+    A sector's address is entered in its file's address table under the same lock
+    that retires it, so a file with no outstanding sectors has a complete table.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.lock = Lock()
+        self.meaningless = meaningless(files[0].sector_size) if files else MEANINGLESS_SECTORS
+        self.starts = []    # flat position of each file's first sector
+        digests = array('Q')
+        for file in files:
+            self.starts.append(len(digests))
+            digests.extend(file.digests)
+        self.keys, self.positions = self.sort(digests)
+        self.retired = bytearray(len(digests))
+        # first possibly outstanding entry of each (file, digest) run touched so far
+        self.cursors = {}
+        self.remaining = [file.total_sectors for file in files]
+        self.remaining_meaningful = [file.meaningful_sectors for file in files]
+
+    @staticmethod
+    def sort(digests):
+        """Return (sorted digests, positions they came from) as arrays, with equal digests in position order."""
+        if np is not None:
+            flat = np.frombuffer(digests, dtype=np.uint64) if len(digests) else np.zeros(0, dtype=np.uint64)
+            order = np.argsort(flat, kind='stable')
+            keys, positions = array('Q'), array('Q')
+            keys.frombytes(flat[order].tobytes())
+            positions.frombytes(order.astype(np.uint64).tobytes())
+            return keys, positions
+        order = sorted(range(len(digests)), key=digests.__getitem__)
+        return array('Q', (digests[p] for p in order)), array('Q', order)
+
+    def locate(self, position):
+        """Return the (file id, source index) of a flat position."""
+        file_id = bisect_right(self.starts, position) - 1
+        return file_id, position - self.starts[file_id]
+
+    def __contains__(self, sector):
+        key = digest(sector)
+        n = bisect_left(self.keys, key)
+        return n < len(self.keys) and self.keys[n] == key
+
+    def runs(self, sector):
+        """Yield (file id, lo, hi): the entries of each file whose digest equals that of sector."""
+        key = digest(sector)
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        while lo < hi:
+            file_id, _ = self.locate(self.positions[lo])
+            end = self.starts[file_id + 1] if file_id + 1 < len(self.starts) else len(self.retired)
+            file_hi = bisect_left(self.positions, end, lo, hi)
+            yield file_id, lo, file_hi
+            lo = file_hi
+
+    def take(self, file_id, lo, hi, sector):
+        """Retire and return the lowest outstanding index in run [lo, hi) equal to sector, or None."""
+        n = self.cursors.get(lo, lo)
+        while n < hi and self.retired[n]:
+            n += 1
+        self.cursors[lo] = n
+        file = self.files[file_id]
+        for n in range(n, hi):
+            if self.retired[n]:
+                continue
+            i = self.positions[n] - self.starts[file_id]
+            if file.sector(i) == sector:    # the digests match; rule out a collision
+                self.retired[n] = 1
+                return i
+        return None
+
+    def restore(self, file_id, i, addr):
+        """Retire sector i of file file_id, found at addr other than by content lookup (e.g. before the job
+        was resumed). Returns whether it was still outstanding."""
+        with self.lock:
+            return self._restore(file_id, i, addr)
+
+    def restore_run(self, file_id, lo, hi, addr):
+        """Retire sectors lo to hi - 1 of file file_id, matched as one extent starting at addr. Returns the
+        indices that were still outstanding."""
+        size = self.files[file_id].sector_size
+        with self.lock:
+            return [i for i in range(lo, hi) if self._restore(file_id, i, addr + (i - lo) * size)]
+
+    def _restore(self, file_id, i, addr):
+        file = self.files[file_id]
+        position = self.starts[file_id] + i
+        key = file.digests[i]
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        n = bisect_left(self.positions, position, lo, hi)
+        if n == hi or self.positions[n] != position or self.retired[n]:
+            return False
+        self.retired[n] = 1
+        file.address_table[i] = addr
+        self.remaining[file_id] -= 1
+        if file.sector(i) not in self.meaningless:
+            self.remaining_meaningful[file_id] -= 1
+        return True
+
+    def retire(self, sector, addr):
+        """Remove and return [(file id, source index), ...] for each file with an outstanding sector equal to sector,
+        found at addr."""
+        with self.lock:
+            meaningful = sector not in self.meaningless
+            retired = []
+            for file_id, lo, hi in self.runs(sector):
+                i = self.take(file_id, lo, hi, sector)
+                if i is None:
+                    continue
+                retired.append((file_id, i))
+                self.files[file_id].address_table[i] = addr
+                self.remaining[file_id] -= 1
+                if meaningful:
+                    self.remaining_meaningful[file_id] -= 1
+            return retired
+
+    def retire_meaningless(self, file_id):
+        """Remove every outstanding meaningless sector of a file, marking it AUTO_FILLED and yielding its source
+        index."""
+        with self.lock:
+            for sector in self.meaningless:
+                for run_file, lo, hi in self.runs(sector):
+                    if run_file != file_id:
+                        continue
+                    while True:
+                        i = self.take(file_id, lo, hi, sector)
+                        if i is None:
+                            break
+                        self.files[file_id].address_table[i] = AUTO_FILLED
+                        self.remaining[file_id] -= 1
+                        yield i
@@ -0,0 +1,265 @@
+"""Throughput telemetry for a running job.
+
+Counters are sampled at a fixed rate and turned into time-based exponentially
+weighted moving averages: each sample is weighted by the time it covers, so the
+averages mean the same however irregularly they are sampled. The skim and the
+close inspections are timed separately, so a skim paused for an inspection
+doesn't look like a slow skim, and the time remaining is estimated from what
+each phase still has to read. Snapshots can be exported as JSON or in the
+Prometheus text format, to watch long scans from a monitoring system.
+"""
+import json
+import math
+import time
+from threading import Lock, local
+
+from checkpoint import atomic_write
+
+# seconds over which rates are averaged
+DEFAULT_TAU = 10.0
+# seconds between exports of the metrics file
+DEFAULT_EXPORT_INTERVAL = 10.0
+PHASES = ('starting', 'index_lookup', 'metadata', 'calibration', 'skim', 'inspection', 'second_pass', 'sharded',
+          'retry', 'finished')
+
+
+class Counter():
+    """A counter any number of threads can add to without a lock: each thread adds to a cell of its own."""
+
+    def __init__(self):
+        self.cells = []
+        self.local = local()
+        self.lock = Lock()  # only taken the first time a thread adds
+
+    def add(self, count=1):
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = self.local.cell = [0]
+            with self.lock:
+                self.cells.append(cell)
+        cell[0] += count
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self.cells))
+
+
+class Rate():
+    """Time-based EWMA of the rate at which a total grows."""
+
+    def __init__(self, tau=DEFAULT_TAU):
+        self.tau = tau
+        self.value = None
+        self.total = None
+        self.time = None
+
+    def seed(self, rate):
+        """Start from rate, e.g. one estimated by calibration, until there are samples."""
+        if self.value is None:
+            self.value = rate
+
+    def update(self, total, now, active=True):
+        """Fold in the growth of total since the last update. Time spent inactive is left out."""
+        if active and self.time is not None and now > self.time:
+            dt = now - self.time
+            rate = (total - self.total) / dt
+            weight = 1 - math.exp(-dt / self.tau)
+            self.value = rate if self.value is None else self.value + weight * (rate - self.value)
+        self.total = total
+        self.time = now
+
+
+class Level():
+    """Time-based EWMA of a sampled quantity, e.g. a queue depth."""
+
+    def __init__(self, tau=DEFAULT_TAU):
+        self.tau = tau
+        self.value = None
+        self.time = None
+
+    def update(self, level, now):
+        if self.value is None:
+            self.value = level
+        elif now > self.time:
+            self.value += (1 - math.exp(-(now - self.time) / self.tau)) * (level - self.value)
+        self.time = now
+
+
+class MeteredVolume():
+    """Wraps a volume so that every byte read is counted."""
+
+    def __init__(self, volume, counter):
+        self.volume = volume
+        self.counter = counter
+
+    @property
+    def shared(self):
+        return self.volume.shared
+
+    def read(self, offset, size):
+        data = self.volume.read(offset, size)
+        self.counter.add(len(data))
+        return data
+
+    def close(self):
+        self.volume.close()
+
+
+class Telemetry():
+    """Rates, phase and time remaining of job, updated by sample().
+
+    Args:
+        job (Job): the job to watch.
+        tau (float): seconds over which rates are averaged.
+        export_path (str): file to export snapshots to, as Prometheus text if it
+            ends in .prom and as JSON otherwise; None to not export.
+        export_interval (float): seconds between exports.
+    """
+
+    def __init__(self, job, tau=DEFAULT_TAU, export_path=None, export_interval=DEFAULT_EXPORT_INTERVAL):
+        self.job = job
+        self.phase = 'starting'     # set by the job as it moves on; see PHASES
+        self.started = time.monotonic()
+        self.bytes_read = Counter()
+        self.inspected = Counter()  # units read by close inspections
+        self.read_rate = Rate(tau)
+        self.match_rate = Rate(tau)
+        self.probe_rate = Rate(tau)
+        self.inspection_rate = Rate(tau)
+        self.queue_depth = Level(tau)
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.exported = 0.0
+
+    @property
+    def current_phase(self):
+        """The phase, telling inspections and the second pass apart from the skim."""
+        job = self.job
+        if job.finished:
+            return 'finished'
+        if self.phase == 'skim':
+            if job.skim_reader.inspections:
+                return 'inspection'
+            if job.skim_reader.second_pass:
+                return 'second_pass'
+        return self.phase
+
+    def probes(self):
+        perf = self.job.skim_reader.perf
+        return perf.total_sectors_read if perf is not None else 0
+
+    def sample(self, now=None):
+        """Fold the counters into the rates. Called by the job's sampler."""
+        now = time.monotonic() if now is None else now
+        phase = self.current_phase
+        self.read_rate.update(self.bytes_read.value, now)
+        self.match_rate.update(self.job.done_sectors, now)
+        self.probe_rate.update(self.probes(), now, active=phase in ('skim', 'second_pass', 'sharded'))
+        self.inspection_rate.update(self.inspected.value, now, active=phase == 'inspection')
+        self.queue_depth.update(self.job.dispatcher.depth(), now)
+        if self.export_path and now - self.exported >= self.export_interval:
+            self.exported = now
+            self.export()
+
+    def remaining(self):
+        """Return (probes left to the skim, units left to the active inspections)."""
+        job = self.job
+        skim = job.skim_reader
+        if self.phase == 'sharded':
+            perf = skim.perf
+            return (perf.total_sectors_to_read - perf.total_sectors_read if perf else 0), 0
+        ahead = []
+        position = max(skim.checked_to, skim.resume_at or 0)
+        if not skim.second_pass:
+            ahead += job.unread_ranges(position, job.vol_size)
+            ahead += job.unread_ranges(job.partition_offset, skim.init_address)
+        else:
+            ahead += job.unread_ranges(position, skim.init_address)
+        probes = sum(end - start for start, end in ahead) // max(1, skim.stride)
+        units = sum(max(0, reader.sector_limit - reader.sector_count)
+                    for reader in list(skim.inspections) if hasattr(reader, 'sector_count'))
+        return probes, units
+
+    def eta(self):
+        """Estimated seconds until the volume has been searched, per phase and in total. None where unknown."""
+        probes, units = self.remaining()
+        skim = probes / self.probe_rate.value if self.probe_rate.value else (0 if not probes else None)
+        inspections = units / self.inspection_rate.value if self.inspection_rate.value else (0 if not units else None)
+        total = None if skim is None or inspections is None else skim + inspections
+        return {'skim': skim, 'inspections': inspections, 'total': total}
+
+    def snapshot(self):
+        """Return the current metrics as a JSON-serialisable dict."""
+        job = self.job
+        finished = job.finished
+        return {
+            'phase': self.current_phase,
+            'elapsed_seconds': time.monotonic() - self.started,
+            'bytes_read': self.bytes_read.value,
+            'probes': self.probes(),
+            'inspected_units': self.inspected.value,
+            'matched_sectors': job.done_sectors,
+            'total_sectors': job.total_sectors,
+            'queue_depth': job.dispatcher.depth(),
+            'rates': {
+                'bytes_per_second': self.read_rate.value,
+                'matches_per_second': self.match_rate.value,
+                'probes_per_second': self.probe_rate.value,
+                'inspected_units_per_second': self.inspection_rate.value,
+                'queue_depth': self.queue_depth.value,
+            },
+            'eta_seconds': {'skim': 0, 'inspections': 0, 'total': 0} if finished else self.eta(),
+            'stages': job.profiler.stats(),
+        }
+
+    def prometheus(self, snapshot=None):
+        """Return snapshot (by default a fresh one) in the Prometheus text exposition format."""
+        snapshot = snapshot or self.snapshot()
+        label = '{job="' + self.job.dir_name.replace('\\', '\\\\').replace('"', '\\"') + '"}'
+        lines = []
+
+        def metric(name, kind, value, help_text):
+            if value is None:
+                return
+            lines.append('# HELP recoverability_' + name + ' ' + help_text)
+            lines.append('# TYPE recoverability_' + name + ' ' + kind)
+            lines.append('recoverability_' + name + label + ' ' + repr(float(value)))
+
+        rates = snapshot['rates']
+        metric('bytes_read_total', 'counter', snapshot['bytes_read'], 'Bytes read from the volume.')
+        metric('probes_total', 'counter', snapshot['probes'], 'Units probed by the skim.')
+        metric('inspected_units_total', 'counter', snapshot['inspected_units'], 'Units read by close inspections.')
+        metric('matched_sectors_total', 'counter', snapshot['matched_sectors'], 'Source sectors matched.')
+        metric('source_sectors', 'gauge', snapshot['total_sectors'], 'Sectors of all source files.')
+        metric('queue_depth', 'gauge', snapshot['queue_depth'], 'Matching tasks waiting in the dispatcher.')
+        metric('read_bytes_per_second', 'gauge', rates['bytes_per_second'], 'Average read throughput.')
+        metric('matches_per_second', 'gauge', rates['matches_per_second'], 'Average rate of matched sectors.')
+        metric('probes_per_second', 'gauge', rates['probes_per_second'], 'Average skim probe rate while skimming.')
+        metric('inspected_units_per_second', 'gauge', rates['inspected_units_per_second'],
+               'Average close inspection rate while inspecting.')
+        metric('queue_depth_average', 'gauge', rates['queue_depth'], 'Average dispatcher queue depth.')
+        metric('eta_seconds', 'gauge', snapshot['eta_seconds']['total'], 'Estimated seconds until the search ends.')
+        metric('elapsed_seconds', 'gauge', snapshot['elapsed_seconds'], 'Seconds since the job started.')
+        for name, kind, key, help_text in (('stage_seconds_total', 'counter', 'seconds', 'Seconds spent in each stage.'),
+                                           ('stage_calls_total', 'counter', 'calls', 'Times each stage was timed.')):
+            lines.append('# HELP recoverability_' + name + ' ' + help_text)
+            lines.append('# TYPE recoverability_' + name + ' ' + kind)
+            for stage, stats in snapshot['stages'].items():
+                lines.append('recoverability_' + name + '{job=' + label[5:-1] + ',stage="' + stage + '"} '
+                             + repr(float(stats[key])))
+        lines.append('# HELP recoverability_phase Current phase of the job.')
+        lines.append('# TYPE recoverability_phase gauge')
+        for phase in PHASES:
+            lines.append('recoverability_phase{job=' + label[5:-1] + ',phase="' + phase + '"} '
+                         + ('1.0' if phase == snapshot['phase'] else '0.0'))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=None):
+        """Write a snapshot to path (by default export_path), atomically."""
+        path = path or self.export_path
+        snapshot = self.snapshot()
+        if path.endswith('.prom'):
+            data = self.prometheus(snapshot)
+        else:
+            data = json.dumps(snapshot)
+        atomic_write(path, data.encode())
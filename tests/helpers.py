@@ -0,0 +1,55 @@
+"""Synthetic images and jobs for the tests."""
+import os
+import random
+
+from recoverability import Job, SourceFile
+from pacing import Pacer
+
+UNIT = 512
+
+
+def make_source(path, units, seed=1, tail=UNIT):
+    """Write a source of random units (the last one tail bytes long) to path and return its content."""
+    rng = random.Random(seed)
+    data = rng.randbytes((units - 1) * UNIT + tail)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def make_image(path, units, pieces=(), seed=2, filler=None):
+    """Write an image of units units of random data (or filler) to path, with each (unit, data) of pieces
+    written at that unit, and return its content."""
+    rng = random.Random(seed)
+    image = bytearray(filler * units * UNIT if filler is not None else rng.randbytes(units * UNIT))
+    for unit, data in pieces:
+        image[unit * UNIT:unit * UNIT + len(data)] = data
+    with open(path, 'wb') as f:
+        f.write(image)
+    return image
+
+
+def run_job(image_path, source_paths, out_dir, start=0, setup=None, **options):
+    """Run a job on image_path for source_paths (or the SourceFiles given as files) to the end, and return it.
+    setup(job), if given, is called before the job starts."""
+    options.setdefault('calibrate', False)
+    options.setdefault('processes', 0)
+    options.setdefault('pacer', Pacer.unthrottled())
+    options.setdefault('sector_size', UNIT)
+    files = options.pop('files', None) or [SourceFile(path, sector_size=options['sector_size'])
+                                            for path in source_paths]
+    job = Job(image_path, os.path.getsize(image_path), files, start, out_dir=str(out_dir), **options)
+    if setup:
+        setup(job)
+    job.start()
+    assert job.wait(60)
+    job.join(5)
+    return job
+
+
+def output(file):
+    """Return the content written for a file, or None."""
+    if not file.written:
+        return None
+    with open(file.rebuilt_file_path, 'rb') as f:
+        return f.read()
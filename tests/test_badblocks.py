@@ -0,0 +1,97 @@
+import random
+
+from helpers import UNIT, make_image, output, run_job
+
+import reads
+import recoverability
+from badblocks import BadBlocks, TolerantVolume
+
+
+class FailingVolume(reads.FileVolume):
+    """A volume whose reads fail wherever they touch a range of bad."""
+
+    bad = []
+
+    def read(self, offset, size):
+        if any(offset < end and start < offset + size for start, end in self.bad):
+            raise OSError(5, 'Input/output error')
+        return super().read(offset, size)
+
+
+def failing(tmp_path, monkeypatch, bad, units=4096, pieces=()):
+    make_image(tmp_path / 'image.bin', units, pieces)
+    monkeypatch.setattr(FailingVolume, 'bad', [(start * UNIT, end * UNIT) for start, end in bad])
+    monkeypatch.setitem(recoverability.BACKENDS, 'file', FailingVolume)
+    return str(tmp_path / 'image.bin')
+
+
+def test_failed_reads_are_mapped_and_skipped(tmp_path, monkeypatch):
+    path = failing(tmp_path, monkeypatch, [(10, 12)])
+    bad_blocks = BadBlocks()
+    volume = TolerantVolume(FailingVolume(path), bad_blocks, 4096 * UNIT, skip_size=8 * UNIT)
+    assert bytes(volume.read(8 * UNIT, 4 * UNIT)) == bytes(4 * UNIT)
+    # the reads right after a failure aren't even tried
+    assert bytes(volume.read(12 * UNIT, 2 * UNIT)) == bytes(2 * UNIT)
+    assert bytes(volume.read(20 * UNIT, UNIT)) != bytes(UNIT)
+    assert bad_blocks.failed.as_list() == [[8 * UNIT, 12 * UNIT]]
+    assert bad_blocks.skipped.as_list() == [[12 * UNIT, 14 * UNIT]]
+    assert bad_blocks.intersection(0, 30 * UNIT) == [[8 * UNIT, 14 * UNIT]]
+    assert bad_blocks.intersection(14 * UNIT, 30 * UNIT) == []
+    volume.close()
+
+
+def test_reads_carry_on_after_the_skipped_range(tmp_path, monkeypatch):
+    path = failing(tmp_path, monkeypatch, [(10, 12), (30, 32)])
+    image = (tmp_path / 'image.bin').read_bytes()
+    bad_blocks = BadBlocks()
+    volume = TolerantVolume(FailingVolume(path), bad_blocks, 4096 * UNIT, skip_size=8 * UNIT)
+    volume.read(8 * UNIT, 4 * UNIT)
+    # a block starting in the skipped range [12, 20) is only zeroes up to its end, and what follows is
+    # read, around what is known bad
+    bad_blocks.fail(24 * UNIT, 26 * UNIT)
+    data = bytes(volume.read(14 * UNIT, 16 * UNIT))
+    assert data[:6 * UNIT] == bytes(6 * UNIT) and data[6 * UNIT:10 * UNIT] == image[20 * UNIT:24 * UNIT]
+    assert data[10 * UNIT:12 * UNIT] == bytes(2 * UNIT) and data[12 * UNIT:] == image[26 * UNIT:30 * UNIT]
+    assert bad_blocks.skipped.as_list() == [[14 * UNIT, 20 * UNIT]]
+    # the read after the skipped range succeeded, so the next failure skips no further than the first
+    assert bytes(volume.read(30 * UNIT, 2 * UNIT)) == bytes(2 * UNIT)
+    assert volume.skipping == (32 * UNIT, 40 * UNIT)
+    volume.close()
+
+
+def test_trimmed_reads_lose_only_the_failing_units(tmp_path, monkeypatch):
+    path = failing(tmp_path, monkeypatch, [(10, 12)])
+    bad_blocks = BadBlocks()
+    volume = TolerantVolume(FailingVolume(path), bad_blocks, 4096 * UNIT, trim=True, unit=UNIT)
+    data = volume.read(0, 16 * UNIT)
+    assert bytes(data[10 * UNIT:12 * UNIT]) == bytes(2 * UNIT) and bytes(data[:UNIT]) != bytes(UNIT)
+    assert bad_blocks.failed.as_list() == [[10 * UNIT, 12 * UNIT]] and not len(bad_blocks.skipped)
+    volume.close()
+
+
+def test_zeroes_of_bad_blocks_are_never_matched(tmp_path, monkeypatch):
+    rng = random.Random(1)
+    source = rng.randbytes(32 * UNIT) + bytes(4 * UNIT) + rng.randbytes(32 * UNIT)
+    (tmp_path / 'source.bin').write_bytes(source)
+    # the blank units of the source lie in a block that can't be read, known bad from the start (as when
+    # resumed), so that the reads around it come back with zeroes exactly there
+    path = failing(tmp_path, monkeypatch, [(1032, 1036)], pieces=[(1000, source)])
+    job = run_job(path, [str(tmp_path / 'source.bin')], tmp_path / 'out', block_size=16 * UNIT,
+                  setup=lambda job: job.bad_blocks.fail(1032 * UNIT, 1036 * UNIT))
+    table = job.files[0].address_table
+    assert all(not 1032 * UNIT <= addr < 1036 * UNIT for addr in table)
+    # they come from the source instead
+    assert list(table[32:36]) == [recoverability.AUTO_FILLED] * 4
+    assert output(job.files[0]) == source
+
+
+def test_files_in_bad_blocks_are_reported_incomplete(tmp_path, monkeypatch):
+    rng = random.Random(1)
+    source = rng.randbytes(32 * UNIT)
+    (tmp_path / 'source.bin').write_bytes(source)
+    path = failing(tmp_path, monkeypatch, [(1010, 1012)], pieces=[(1000, source)])
+    job = run_job(path, [str(tmp_path / 'source.bin')], tmp_path / 'out', block_size=16 * UNIT)
+    file = job.files[0]
+    assert not file.written and list(file.address_table[10:12]) == [recoverability.UNMATCHED] * 2
+    assert file.done_sectors == 30
+    assert job.bad_blocks.failed.as_list() == [[1010 * UNIT, 1012 * UNIT]]
@@ -0,0 +1,32 @@
+import json
+
+import benchmark
+
+
+def test_every_layout_is_rebuilt(tmp_path, capsys):
+    output = tmp_path / 'results.json'
+    assert benchmark.main(['--no-calibrate', '--output', str(output)]) == 0
+    with open(output) as f:
+        report = json.load(f)
+    assert set(report['summary']) == {'contiguous', 'light', 'heavy', 'interleaved'}
+    for name, summary in report['summary'].items():
+        assert summary['correct'] and summary['reconstructed'] == 1, name
+        assert summary['reconstruction_seconds'] is not None
+    # compared with itself, nothing regressed
+    assert benchmark.main(['--no-calibrate', '--layouts', 'light', '--output', str(tmp_path / 'again.json'),
+                           '--baseline', str(output), '--tolerance', '100']) == 0
+
+
+def test_runs_are_stopped_after_the_timeout(tmp_path, capsys, monkeypatch):
+    waited = []
+    # a job that never finishes in time
+    monkeypatch.setattr(benchmark.Job, 'wait', lambda job, timeout=None: waited.append(timeout))
+    output = tmp_path / 'results.json'
+    benchmark.main(['--no-calibrate', '--layouts', 'heavy', '--timeout', '3', '--output', str(output)])
+    assert waited == [3]
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    stopped = [event for event in events if event['event'] == 'not_reconstructed']
+    assert len(stopped) == 1 and stopped[0]['layout'] == 'heavy' and stopped[0]['timed_out']
+    with open(output) as f:
+        summary = json.load(f)['summary']['heavy']
+    assert summary['reconstructed'] == 0 and summary['timed_out'] == 1 and summary['reconstruction_seconds'] is None
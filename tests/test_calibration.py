@@ -0,0 +1,85 @@
+import os
+
+from helpers import UNIT, make_image, make_source
+
+import calibration
+from calibration import Calibration, good_enough
+from pacing import Pacer
+from reads import FileVolume
+from recoverability import Job, SourceFile
+
+MB = 1024 * 1024
+
+
+def test_good_enough():
+    assert good_enough({1: 100, 2: 150, 4: 195, 8: 200}) == 4
+    assert good_enough({1: 100, 2: 50}) == 1
+
+
+def test_estimate():
+    result = Calibration()
+    result.block_size = MB
+    result.sequential = {MB: 100 * MB}
+    result.latency = 0.001
+    # a short stride reads whole spans; a long one pays a random read per probe
+    assert result.estimate(1000 * MB, 4096) == (10, 10)
+    skim, sequential = result.estimate(1000 * MB, MB)
+    assert (round(skim, 6), sequential) == (1, 10)
+    assert result.prefers_sequential(1000 * MB, 256 * 1024) is False
+    result.latency = 0.01
+    assert result.prefers_sequential(1000 * MB, 256 * 1024) is True
+
+
+def scripted(monkeypatch, random_rates, parallel_rates, single_rate=100 * MB):
+    """Make calibrate measure random_rates by depth, and in turn parallel_rates against single_rate."""
+    parallel_rates = list(parallel_rates)
+    monkeypatch.setattr(calibration, 'measure_sequential', lambda volume, start, end, block_size, budget: single_rate)
+    monkeypatch.setattr(calibration, 'measure_random',
+                        lambda open_volume, next_offset, unit, depth, budget: (random_rates[depth], [0.001]))
+    monkeypatch.setattr(calibration, 'measure_parallel_sequential',
+                        lambda open_volume, regions, block_size, budget: parallel_rates.pop(0))
+
+
+def run(tmp_path, **options):
+    make_image(tmp_path / 'image.bin', 4096)
+    return calibration.calibrate(lambda: FileVolume(str(tmp_path / 'image.bin')), 4096 * UNIT, UNIT, seed=1,
+                                 **options)
+
+
+def test_readers_need_a_margin_in_every_sample(tmp_path, monkeypatch):
+    random_rates = {1: 100, 2: 190, 4: 380, 8: 400}
+    scripted(monkeypatch, random_rates, [300 * MB] * calibration.SAMPLES)
+    assert run(tmp_path, max_readers=8).readers == 4
+    # one slow sample is enough to stay with one reader
+    scripted(monkeypatch, random_rates, [300 * MB, 90 * MB, 300 * MB])
+    result = run(tmp_path, max_readers=8)
+    assert result.readers == 1 and result.parallel_sequential == 90 * MB
+
+
+def test_readers_are_capped(tmp_path, monkeypatch):
+    scripted(monkeypatch, {1: 100, 2: 190, 4: 380, 8: 400}, [300 * MB] * calibration.SAMPLES)
+    assert run(tmp_path, max_readers=2).readers == 2
+    assert run(tmp_path, max_readers=1).readers == 1
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    assert run(tmp_path).readers == 1
+
+
+def test_job_shards_only_from_the_start(tmp_path, monkeypatch):
+    make_source(tmp_path / 'source.bin', 2, tail=100)
+    make_image(tmp_path / 'image.bin', 4096)
+    result = Calibration()
+    result.block_size = MB
+    result.sequential = {MB: 100 * MB}
+    result.latency = 1
+    result.readers = 4
+    result.parallel_sequential = 400 * MB
+    monkeypatch.setattr(calibration, 'calibrate', lambda *args, **kwargs: result)
+    path = str(tmp_path / 'image.bin')
+    for start, processes in ((0, 4), (1024 * UNIT, 0)):
+        job = Job(path, os.path.getsize(path), [SourceFile(str(tmp_path / 'source.bin'), sector_size=UNIT)], start,
+                  out_dir=str(tmp_path / 'out'), pacer=Pacer.unthrottled(), sector_size=UNIT)
+        job.calibrate()
+        assert job.processes == processes
+        # from elsewhere, every unit is still read, but on this process
+        assert job.sequential == (processes == 0)
+        job.files[0].close()
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+from helpers import UNIT, make_image, make_source, output
+
+import checkpoint
+from pacing import Pacer
+from recoverability import Job, SourceFile, UNMATCHED
+
+OPTIONS = dict(calibrate=False, processes=0, pacer=Pacer.unthrottled(), sector_size=UNIT, checkpoint_interval=3600)
+
+
+def interrupted_job(tmp_path):
+    """Return a job, not started, that has checked the first half of an image holding a source in two pieces,
+    as if it had been interrupted there, with its checkpoint written. Returns (job, source, image)."""
+    source = make_source(tmp_path / 'source.bin', 40, tail=300)
+    pieces = [(200, source[:20 * UNIT]), (1500, source[20 * UNIT:])]
+    image = make_image(tmp_path / 'image.bin', 2048, pieces)
+    path = str(tmp_path / 'image.bin')
+    job = Job(path, os.path.getsize(path), [SourceFile(str(tmp_path / 'source.bin'), sector_size=UNIT)], 0,
+              out_dir=str(tmp_path / 'out'), **OPTIONS)
+    for addr in range(0, 1024 * UNIT, UNIT):
+        job.check_unit(addr, image[addr:addr + UNIT])
+    job.skim_reader.checked_to = 1024 * UNIT
+    job.checkpointer.write()
+    return job, source, image
+
+
+def test_checkpoint_round_trip(tmp_path):
+    job, _, _ = interrupted_job(tmp_path)
+    state = checkpoint.load(job.dir_name)
+    assert state['covered'] == [[0, 1024 * UNIT]] and state['skim']['checked_to'] == 1024 * UNIT
+    assert list(checkpoint.load_table(job.dir_name, 0)) == list(job.files[0].address_table)
+
+    resumed = Job.resume(job.dir_name, **OPTIONS)
+    file = resumed.files[0]
+    assert list(file.address_table) == list(job.files[0].address_table)
+    assert list(file.address_table[:20]) == [(200 + n) * UNIT for n in range(20)]
+    assert UNMATCHED in file.address_table
+    assert file.done_sectors == resumed.done_sectors == 20
+    assert resumed.covered.as_list() == [[0, 1024 * UNIT]]
+    assert resumed.index.remaining_meaningful == job.index.remaining_meaningful
+    assert file.meaningful_sectors - resumed.index.remaining_meaningful[0] == 20
+    # the restored sectors are no longer outstanding
+    assert resumed.index.retire(job.files[0].sector(3), 0) == []
+    for j in (job, resumed):
+        j.files[0].close()
+
+
+def test_resumed_scan(tmp_path):
+    job, source, _ = interrupted_job(tmp_path)
+    job.files[0].close()
+    resumed = Job.resume(job.dir_name, **OPTIONS)
+    resumed.start()
+    assert resumed.wait(60)
+    resumed.join(5)
+    assert output(resumed.files[0]) == source
+    assert list(resumed.files[0].address_table[20:40]) == [(1500 + n) * UNIT for n in range(20)]
+    # the checkpoint of a job that succeeded is removed
+    assert not os.path.exists(os.path.join(job.dir_name, checkpoint.STATE_NAME))
+
+
+def test_resume_refuses_changed_sources(tmp_path):
+    job, _, _ = interrupted_job(tmp_path)
+    job.files[0].close()
+    with open(tmp_path / 'source.bin', 'ab') as f:
+        f.write(b'more')
+    with pytest.raises(ValueError):
+        Job.resume(job.dir_name, **OPTIONS)
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+from helpers import UNIT, make_image, make_source
+
+CLI = os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py')
+
+
+def run(*argv):
+    """Run the CLI with argv and return its exit status and the events it wrote."""
+    process = subprocess.run([sys.executable, CLI] + [str(arg) for arg in argv]
+                             + ['--no-calibrate', '--unthrottled', '--processes', '0', '--sector-size', str(UNIT),
+                                '--progress-interval', '0'], stdout=subprocess.PIPE, timeout=120)
+    return process.returncode, [json.loads(line) for line in process.stdout.splitlines()]
+
+
+def test_skim_from_the_middle(tmp_path):
+    # one file lies after the start and one before it, found once the skim wraps around
+    first = make_source(tmp_path / 'first.bin', 40, seed=1, tail=300)
+    second = make_source(tmp_path / 'second.bin', 24, seed=3)
+    make_image(tmp_path / 'image.bin', 4096, [(3000, first), (500, second)])
+    status, events = run(tmp_path / 'image.bin', tmp_path / 'first.bin', tmp_path / 'second.bin',
+                         '--start', hex(2048 * UNIT), '--out-dir', tmp_path / 'out')
+    assert status == 0
+    predicted = [event for event in events if event['event'] == 'extent_predicted']
+    assert sorted((event['file'], event['start']) for event in predicted) == [(0, 3000 * UNIT), (1, 500 * UNIT)]
+    finished = [event for event in events if event['event'] == 'file_finished']
+    assert sorted((event['file'], event['success']) for event in finished) == [(0, True), (1, True)]
+    # the file after the start is found first
+    assert [event['file'] for event in finished] == [0, 1]
+    summary, = [event for event in events if event['event'] == 'finished']
+    assert summary['success'] and summary['done'] == summary['total'] == 64
+    for path, data in zip(summary['outputs'], (first, second)):
+        with open(path, 'rb') as f:
+            assert f.read() == data
+
+
+def test_missing_file_fails(tmp_path):
+    make_source(tmp_path / 'source.bin', 10)
+    make_image(tmp_path / 'image.bin', 1024)
+    status, events = run(tmp_path / 'image.bin', tmp_path / 'source.bin', '--out-dir', tmp_path / 'out')
+    assert status == 1
+    summary, = [event for event in events if event['event'] == 'finished']
+    assert not summary['success'] and summary['outputs'] == [None]
+
+
+def test_build_index_then_search(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 16)
+    make_image(tmp_path / 'image.bin', 2048, [(1234, source)])
+    status, events = run(tmp_path / 'image.bin', '--build-index', '--out-dir', tmp_path / 'out')
+    assert status == 0 and events[-1]['event'] == 'index_built' and events[-1]['complete']
+    status, events = run(tmp_path / 'image.bin', tmp_path / 'source.bin', '--index',
+                         events[-1]['path'], '--out-dir', tmp_path / 'out')
+    assert status == 0
+    lookup = [event for event in events if event['event'] == 'index_lookup']
+    assert lookup[0]['usable'] and lookup[0]['verified'] == 16
+
+
+def test_partial_index_exits_non_zero(tmp_path):
+    # a sparse image larger than one segment of the index, which --index-limit stops after
+    size = 300 << 20
+    with open(tmp_path / 'image.bin', 'wb') as f:
+        f.truncate(size)
+    index = tmp_path / 'index'
+    status, events = run(tmp_path / 'image.bin', '--build-index', '--index', index, '--index-limit', 1)
+    assert status == 1 and not events[-1]['complete'] and events[-1]['indexed'] < size
+    # the next run carries on and finishes it
+    status, events = run(tmp_path / 'image.bin', '--build-index', '--index', index)
+    assert status == 0 and events[-1]['complete'] and events[-1]['indexed'] == size
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+from helpers import UNIT, make_image, make_source, output, run_job
+
+import diskindex
+from diskindex import DiskIndex, DiskIndexError
+from reads import FileVolume
+from sources import digest
+
+SEGMENT = 256 * UNIT
+
+
+def create(tmp_path, units=1024, pieces=()):
+    image = make_image(tmp_path / 'image.bin', units, pieces)
+    path = str(tmp_path / 'image.bin')
+    volume = FileVolume(path)
+    index = DiskIndex.create(str(tmp_path / 'index'), volume, path, len(image), UNIT, segment_size=SEGMENT)
+    return index, volume, image
+
+
+def test_build_and_lookup(tmp_path):
+    index, volume, image = create(tmp_path, pieces=[(700, bytes(UNIT)), (900, bytes(UNIT))])
+    assert index.build(volume)
+    assert index.complete and len(index.runs) == 1
+    # every unit but the blank ones is indexed
+    assert index.entries == 1022
+    for unit in (0, 333, 1023):
+        assert index.lookup(digest(image[unit * UNIT:(unit + 1) * UNIT])) == [unit * UNIT]
+    assert index.lookup(digest(bytes(UNIT))) == []
+    index.close()
+    volume.close()
+
+
+def test_interrupted_build_carries_on(tmp_path):
+    index, volume, image = create(tmp_path)
+    assert not index.build(volume, limit=SEGMENT)
+    assert index.covered.as_list() == [[0, SEGMENT]] and len(index.runs) == 1
+    index.close()
+    path = str(tmp_path / 'image.bin')
+    index = DiskIndex.create(str(tmp_path / 'index'), volume, path, len(image), UNIT)
+    assert index.covered.as_list() == [[0, SEGMENT]]
+    assert list(index.pending()) == [(n * SEGMENT, (n + 1) * SEGMENT) for n in range(1, 4)]
+    assert index.build(volume)
+    assert index.entries == 1024 and len(index.runs) == 1
+    assert index.lookup(digest(image[600 * UNIT:601 * UNIT])) == [600 * UNIT]
+    index.close()
+    volume.close()
+
+
+def test_changed_volume_is_refused(tmp_path):
+    index, volume, image = create(tmp_path)
+    index.build(volume)
+    index.close()
+    volume.close()
+    path = str(tmp_path / 'image.bin')
+    with open(path, 'r+b') as f:
+        f.seek(0)
+        f.write(bytes(UNIT))
+    volume = FileVolume(path)
+    with pytest.raises(DiskIndexError):
+        DiskIndex.open(str(tmp_path / 'index'), volume, path, len(image), UNIT)
+    with pytest.raises(DiskIndexError):
+        DiskIndex.open(str(tmp_path / 'elsewhere'), volume, path, len(image), UNIT)
+    # a new build starts afresh
+    index = DiskIndex.create(str(tmp_path / 'index'), volume, path, len(image), UNIT)
+    assert not len(index.covered) and not index.runs
+    index.close()
+    volume.close()
+
+
+def indexed_search(tmp_path, out):
+    events = []
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / out,
+                  disk_index=str(tmp_path / 'index'), setup=lambda job: job.disk_index_signal.connect(events.append))
+    return job, events
+
+
+def test_indexed_search(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 30, tail=200)
+    index, volume, _ = create(tmp_path, 2048, pieces=[(1500, source)])
+    # half the volume is indexed; the rest, with the source, is scanned
+    index.build(volume, limit=4 * SEGMENT)
+    job, events = indexed_search(tmp_path, 'out')
+    assert output(job.files[0]) == source
+    assert events == [(4 * SEGMENT, 0)]
+
+    # with all of it indexed, only the units the index points to are read: the whole units of the source
+    assert index.build(volume)
+    index.close()
+    volume.close()
+    job, events = indexed_search(tmp_path, 'out2')
+    assert output(job.files[0]) == source
+    assert events == [(2048 * UNIT, 29)]
+
+
+def test_default_path():
+    assert diskindex.default_path('out', '/dev/sdb') == os.path.join('out', 'index of devsdb')
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import wait
+
+import pytest
+from helpers import make_image, make_source, output, run_job
+
+from dispatch import Dispatcher
+
+
+def test_inline_runs_on_the_caller():
+    dispatcher = Dispatcher(mode='inline')
+    future = dispatcher.submit(threading.current_thread, items=5)
+    assert future.result() is threading.current_thread()
+    assert dispatcher.stats.as_dict()['items'] == 5 and not dispatcher.threads
+    with pytest.raises(ValueError):
+        Dispatcher(mode='pool')
+
+
+def test_queue_runs_tasks_in_order():
+    dispatcher = Dispatcher(workers=1)
+    done = []
+    futures = [dispatcher.submit(done.append, n, items=2) for n in range(20)]
+    wait(futures, 5)
+    assert done == list(range(20))
+    stats = dispatcher.stats.as_dict()
+    assert (stats['tasks'], stats['items'], stats['mean_batch']) == (20, 40, 2)
+    # a task that fails fails its future only
+    assert isinstance(dispatcher.submit(lambda: 1 / 0).exception(5), ZeroDivisionError)
+    assert dispatcher.submit(lambda: 'ok').result(5) == 'ok'
+    dispatcher.shutdown()
+    with pytest.raises(RuntimeError):
+        dispatcher.submit(done.append, 0)
+
+
+def test_back_pressure_and_shutdown():
+    dispatcher = Dispatcher(workers=1, queue_size=1)
+    release = threading.Event()
+    running = dispatcher.submit(release.wait, 5)
+    queued = dispatcher.submit(release.wait, 5)
+    # the worker is busy and the queue full: the next submission waits for room
+    threading.Timer(0.3, release.set).start()
+    last = dispatcher.submit(release.wait, 5)
+    assert dispatcher.stats.as_dict()['blocked_seconds'] > 0.1
+    wait([running, queued, last], 5)
+
+    release.clear()
+    dispatcher.submit(release.wait, 5)
+    pending = [dispatcher.submit(release.wait, 5)]
+    dispatcher.shutdown()
+    # whoever waits on what was cancelled is woken up
+    assert not wait(pending, 5).not_done and pending[0].cancelled()
+    release.set()
+
+
+@pytest.mark.parametrize('dispatch', ['queue', 'inline'])
+def test_scan_with_small_batches(tmp_path, dispatch):
+    source = make_source(tmp_path / 'source.bin', 50, tail=100)
+    make_image(tmp_path / 'image.bin', 2048, [(777, source)])
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / 'out', batch_size=3,
+                  dispatch=dispatch, queue_size=2)
+    assert output(job.files[0]) == source
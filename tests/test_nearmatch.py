@@ -0,0 +1,80 @@
+import random
+from collections import Counter
+
+from helpers import UNIT, make_image, make_source, output, run_job
+
+import nearmatch
+import reads
+import recoverability
+from nearmatch import NearIndex, distance
+from sources import SourceFile
+
+
+def rot(source, every, bits):
+    """Return source with bits bits flipped in every every-th unit, from the third."""
+    units = [source[n * UNIT:(n + 1) * UNIT] for n in range(-(-len(source) // UNIT))]
+    return b''.join(flip(data, bits, seed=n) if n % every == 2 else data for n, data in enumerate(units))
+
+
+def flip(data, bits, seed=7):
+    """Return data with bits distinct bits flipped."""
+    data = bytearray(data)
+    for bit in random.Random(seed).sample(range(len(data) * 8), bits):
+        data[bit // 8] ^= 1 << bit % 8
+    return bytes(data)
+
+
+def test_distance():
+    assert distance(b'\x00\x00', b'\x00\x00') == 0
+    assert distance(b'\x0f\x00', b'\x00\x01') == 5
+
+
+def test_nearest(tmp_path, monkeypatch):
+    make_source(tmp_path / 'source.bin', 8)
+    (tmp_path / 'source.bin').write_bytes((tmp_path / 'source.bin').read_bytes() + b'\x00' * UNIT)
+    file = SourceFile(str(tmp_path / 'source.bin'))
+    index = NearIndex([file], max_distance=8)
+    assert index.nearest(flip(file.sector(3), 8)) == [(8, 0, 3)]
+    assert index.nearest(flip(file.sector(3), 9)) == []
+    # blank units are never near matches, nor are units near them
+    assert index.nearest(flip(b'\x00' * UNIT, 2)) == []
+    sectors = [flip(file.sector(5), 3), random.Random(3).randbytes(UNIT), b'\x00' * UNIT]
+    assert index.candidates(sectors) == [0]
+    # without NumPy the same units are indexed under the same keys
+    monkeypatch.setattr(nearmatch, 'np', None)
+    plain = NearIndex([file], max_distance=8)
+    assert plain.keys == index.keys and plain.positions == index.positions
+    assert plain.candidates(sectors) == [0]
+    file.close()
+
+
+def test_near_scan(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 64, tail=200)
+    rotted = rot(source, 5, 3)
+    make_image(tmp_path / 'image.bin', 2048, [(900, rotted)])
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / 'out', near_distance=8)
+    file = job.files[0]
+    assert sorted(file.near_matches) == list(range(2, 63, 5))
+    assert list(file.address_table) == [(900 + n) * UNIT for n in range(64)]
+    assert output(file) == rotted
+
+
+def test_prediction_reads_rotted_extents_once(tmp_path, monkeypatch):
+    reads_per_unit = Counter()
+
+    class CountingVolume(reads.FileVolume):
+        def read(self, offset, size):
+            data = super().read(offset, size)
+            reads_per_unit.update(range(offset // UNIT, (offset + len(data)) // UNIT))
+            return data
+
+    monkeypatch.setitem(recoverability.BACKENDS, 'file', CountingVolume)
+    source = make_source(tmp_path / 'source.bin', 256)
+    # a rotted unit every few units of the extent
+    rotted = rot(source, 7, 2)
+    make_image(tmp_path / 'image.bin', 4096, [(1000, rotted)])
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / 'out', near_distance=8,
+                  block_size=64 * UNIT)
+    assert output(job.files[0]) == rotted
+    # read by the skim, the prediction and the output at most
+    assert max(reads_per_unit[unit] for unit in range(1000, 1256)) <= 3
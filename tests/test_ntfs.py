@@ -0,0 +1,205 @@
+import random
+
+from helpers import output, run_job
+
+import ntfs
+from reads import FileVolume
+from recoverability import SourceFile
+
+CLUSTER = 4096
+RECORD = 1024
+PARTITION = 64 * 1024
+CLUSTERS = 1008
+MFT_LCN = 16
+MIRROR_LCN = 40
+BITMAP_LCN = 50
+RECORDS = 64
+# an attribute type the parser ignores
+LOGGED_UTILITY_STREAM = 0x100
+
+
+def data_runs(runs):
+    """Encode [(lcn, clusters), ...] as a data-run list, with 4-byte lengths and offsets."""
+    out = b''
+    prev = 0
+    for lcn, length in runs:
+        out += b'\x44' + length.to_bytes(4, 'little') + (lcn - prev).to_bytes(4, 'little', signed=True)
+        prev = lcn
+    return out + b'\x00'
+
+
+def attribute(kind, content, non_resident=False):
+    attr = bytearray(0x18 if not non_resident else 0x40)
+    attr[0:4] = kind.to_bytes(4, 'little')
+    attr[8] = non_resident
+    if not non_resident:
+        attr[0x10:0x14] = len(content).to_bytes(4, 'little')
+        attr[0x14:0x16] = (0x18).to_bytes(2, 'little')
+    attr += content
+    attr += bytes(-len(attr) % 8)
+    attr[4:8] = len(attr).to_bytes(4, 'little')
+    return attr
+
+
+def file_name(name, size):
+    content = bytearray(0x42) + name.encode('utf-16-le')
+    content[0x30:0x38] = size.to_bytes(8, 'little')
+    content[0x40] = len(name)
+    return attribute(ntfs.FILE_NAME, content)
+
+
+def data(size, runs):
+    attr = attribute(ntfs.DATA, data_runs(runs), non_resident=True)
+    clusters = sum(length for _, length in runs)
+    attr[0x18:0x20] = (clusters - 1).to_bytes(8, 'little')
+    attr[0x20:0x22] = (0x40).to_bytes(2, 'little')
+    attr[0x28:0x30] = (clusters * CLUSTER).to_bytes(8, 'little')
+    attr[0x30:0x38] = size.to_bytes(8, 'little')
+    attr[0x38:0x40] = size.to_bytes(8, 'little')
+    return attr
+
+
+def record(flags, *attrs):
+    """Return an MFT record holding attrs, with its update sequence applied."""
+    rec = bytearray(RECORD)
+    rec[0:4] = ntfs.FILE_SIGNATURE
+    rec[4:6] = (0x30).to_bytes(2, 'little')
+    rec[6:8] = (RECORD // 512 + 1).to_bytes(2, 'little')
+    rec[0x14:0x16] = (0x38).to_bytes(2, 'little')
+    rec[0x16:0x18] = flags.to_bytes(2, 'little')
+    body = b''.join(attrs) + ntfs.END.to_bytes(4, 'little')
+    rec[0x38:0x38 + len(body)] = body
+    rec[0x30:0x32] = b'\x01\x00'
+    for n in range(1, RECORD // 512 + 1):
+        end = n * 512
+        rec[0x30 + 2 * n:0x32 + 2 * n] = rec[end - 2:end]
+        rec[end - 2:end] = b'\x01\x00'
+    return bytes(rec)
+
+
+def build(path, name, source, runs, size=None, seed=3, pad=0):
+    """Write a small NTFS volume, at PARTITION in an image of random data, on which a deleted file called
+    name of size (by default len(source)) has source in the clusters of runs. Its record has an attribute
+    of pad bytes before the name, if pad is given. Returns the image."""
+    rng = random.Random(seed)
+    image = bytearray(rng.randbytes(PARTITION + CLUSTERS * CLUSTER))
+
+    def put(lcn, content):
+        image[PARTITION + lcn * CLUSTER:PARTITION + lcn * CLUSTER + len(content)] = content
+
+    boot = bytearray(512)
+    boot[3:11] = ntfs.OEM_ID
+    boot[0x0B:0x0D] = (512).to_bytes(2, 'little')
+    boot[0x0D] = CLUSTER // 512
+    boot[0x28:0x30] = (CLUSTERS * CLUSTER // 512).to_bytes(8, 'little')
+    boot[0x30:0x38] = MFT_LCN.to_bytes(8, 'little')
+    boot[0x38:0x40] = MIRROR_LCN.to_bytes(8, 'little')
+    boot[0x40] = 256 - 10    # records of 2 ** 10 bytes
+    put(0, boot)
+
+    mft_clusters = RECORDS * RECORD // CLUSTER
+    live = [(3000 + 4 * n) % CLUSTERS for n in range(RECORDS)]
+    records = [record(ntfs.IN_USE, file_name('other%d.dat' % n, 10000 + n), data(10000 + n, [(live[n], 1)]))
+               for n in range(RECORDS)]
+    records[ntfs.MFT_RECORD] = record(ntfs.IN_USE, file_name('$MFT', RECORDS * RECORD),
+                                      data(RECORDS * RECORD, [(MFT_LCN, mft_clusters)]))
+    records[ntfs.BITMAP_RECORD] = record(ntfs.IN_USE, file_name('$Bitmap', CLUSTERS // 8),
+                                         data(CLUSTERS // 8, [(BITMAP_LCN, 1)]))
+    padding = [attribute(LOGGED_UTILITY_STREAM, bytes(pad - 0x18))] if pad else []
+    records[40] = record(0, *padding, file_name(name, len(source) if size is None else size),
+                         data(len(source) if size is None else size, runs))
+    mft = b''.join(records)
+    put(MFT_LCN, mft)
+    put(MIRROR_LCN, mft[:4 * RECORD])
+
+    bitmap = bytearray(CLUSTER)
+    for lcn in [0, MIRROR_LCN, BITMAP_LCN] + list(range(MFT_LCN, MFT_LCN + mft_clusters)) + live:
+        bitmap[lcn // 8] |= 1 << lcn % 8
+    put(BITMAP_LCN, bitmap)
+
+    padded = source + bytes(-len(source) % CLUSTER)
+    done = 0
+    for lcn, length in runs:
+        put(lcn, padded[done:done + length * CLUSTER])
+        done += length * CLUSTER
+    with open(path, 'wb') as f:
+        f.write(image)
+    return image
+
+
+def test_decode_runs():
+    runs = ntfs.decode_runs(data_runs([(300, 2), (100, 5)]) + b'\x01\x07\x00')
+    assert runs == [(0, 300, 2), (2, 100, 5)]
+    # a length without an offset is a sparse run
+    assert ntfs.decode_runs(b'\x01\x03\x11\x02\x05\x00') == [(0, None, 3), (3, 5, 2)]
+
+
+def test_free_runs(monkeypatch):
+    bitmap = bytes([0b00001111, 0x00, 0xFF, 0b10000000])
+    expected = [(4, 16), (24, 31)]
+    assert list(ntfs.free_runs(bitmap, 32)) == expected
+    assert list(ntfs.free_runs(bitmap, 20)) == [(4, 16)]
+    monkeypatch.setattr(ntfs, 'np', None)
+    assert list(ntfs.free_runs(bitmap, 32)) == expected
+    assert list(ntfs.free_runs(bitmap, 20)) == [(4, 16)]
+
+
+def test_name_pattern_ignores_case():
+    pattern = ntfs.name_pattern('report.docx')
+    for name in ('report.docx', 'Report.DOCX', 'REPORT.DOCX'):
+        assert ntfs.re.search(pattern, b'\x00' + name.encode('utf-16-le') + b'\x00')
+    assert not ntfs.re.search(pattern, 'report.doc'.encode('utf-16-le'))
+
+
+def test_candidates_match_names_in_any_case(tmp_path):
+    source = random.Random(1).randbytes(5 * CLUSTER + 100)
+    (tmp_path / 'report.docx').write_bytes(source)
+    # a size that says nothing, so that only the name can match
+    build(tmp_path / 'image.bin', 'Report.DOCX', source, [(300, 2), (700, 4)], size=123)
+    volume = FileVolume(str(tmp_path / 'image.bin'))
+    try:
+        candidates = ntfs.find_candidates(volume, [SourceFile(str(tmp_path / 'report.docx'))], PARTITION)
+    finally:
+        volume.close()
+    assert [(e.source_offset, e.address, e.length, e.priority) for e in candidates] == [
+        (0, PARTITION + 300 * CLUSTER, 2 * CLUSTER, 2), (2 * CLUSTER, PARTITION + 700 * CLUSTER, 4 * CLUSTER, 2)]
+
+
+def test_candidates_match_names_across_a_sector_end(tmp_path):
+    source = random.Random(1).randbytes(5 * CLUSTER + 100)
+    (tmp_path / 'crossing.bin').write_bytes(source)
+    # the name starts at byte 0x38 + 352 + 0x5A = 498 of the record, so its last two bytes in the first sector
+    # are stored in the update sequence array until the fixup is undone; the size says nothing
+    build(tmp_path / 'image.bin', 'crossing.bin', source, [(300, 2), (700, 4)], size=123, pad=352)
+    volume = FileVolume(str(tmp_path / 'image.bin'))
+    try:
+        candidates = ntfs.find_candidates(volume, [SourceFile(str(tmp_path / 'crossing.bin'))], PARTITION)
+    finally:
+        volume.close()
+    assert [(e.address, e.priority) for e in candidates] == [(PARTITION + 300 * CLUSTER, 2),
+                                                             (PARTITION + 700 * CLUSTER, 2)]
+
+
+def test_search_space(tmp_path):
+    source = random.Random(1).randbytes(5 * CLUSTER + 100)
+    build(tmp_path / 'image.bin', 'source.bin', source, [(300, 2), (700, 4)])
+    volume = FileVolume(str(tmp_path / 'image.bin'))
+    try:
+        space = ntfs.search_space(volume, PARTITION)
+    finally:
+        volume.close()
+    assert PARTITION + 300 * CLUSTER in space and PARTITION + 703 * CLUSTER in space
+    for lcn in (0, MFT_LCN, MFT_LCN + 15, BITMAP_LCN):
+        assert PARTITION + lcn * CLUSTER not in space
+
+
+def test_ntfs_scan(tmp_path):
+    source = random.Random(1).randbytes(5 * CLUSTER + 100)
+    (tmp_path / 'source.bin').write_bytes(source)
+    build(tmp_path / 'image.bin', 'SOURCE.BIN', source, [(700, 4), (300, 2)])
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / 'out',
+                  partition_offset=PARTITION, use_ntfs=True, free_space_only=True)
+    assert job.metadata_error is None and job.bitmap_error is None
+    assert job.search_space.total() < CLUSTERS * CLUSTER
+    assert job.files[0].address_table[0] == PARTITION + 700 * CLUSTER
+    assert output(job.files[0]) == source
@@ -0,0 +1,87 @@
+import pytest
+
+import pacing
+from pacing import PacedVolume, Pacer
+
+MB = 1024 * 1024
+
+
+def test_unthrottled_never_pauses():
+    pacer = Pacer.unthrottled()
+    assert not pacer.throttled
+    assert pacer.delay(MB, 1.0) == 0 and pacer.paused_seconds == 0
+    with pytest.raises(ValueError):
+        Pacer(share=0)
+
+
+def test_share_of_the_device():
+    pacer = Pacer(share=0.25, adaptive=False)
+    # a read of 10 ms may take a quarter of the time: 30 ms of pause
+    assert pacer.delay(MB, 0.01) == pytest.approx(0.03)
+    assert pacer.paused_seconds == pytest.approx(0.03)
+
+
+def test_iops_budget(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(pacing.time, 'monotonic', lambda: now[0])
+    pacer = Pacer(iops=10, adaptive=False)
+    # reads issued at once queue up for the next free slots
+    assert [round(pacer.delay(4096, 0), 6) for _ in range(3)] == [0.1, 0.2, 0.3]
+    now[0] += 1
+    assert pacer.delay(4096, 0) == pytest.approx(0.1)
+
+
+def test_backs_off_on_saturation_and_recovers():
+    pacer = Pacer()
+    for _ in range(5):
+        assert pacer.delay(MB, 0.01) == 0
+    delays = [pacer.delay(MB, 0.2) for _ in range(12)]
+    assert delays[0] == pacing.MIN_BACKOFF
+    assert max(delays) == pacing.MAX_BACKOFF and delays == sorted(delays)
+    # the backoff halves once reads are fast again, down to nothing
+    delays = [pacer.delay(MB, 0.005) for _ in range(40)]
+    assert delays[-1] == 0 and delays == sorted(delays, reverse=True)
+
+
+def test_latency_is_tracked_by_read_size():
+    pacer = Pacer()
+    pacer.delay(4096, 0.0001)
+    # large reads take longer; that alone isn't saturation
+    for _ in range(5):
+        assert pacer.delay(16 * MB, 0.1) == 0
+    assert len(pacer.latencies) == 2
+
+
+def test_cached_reads_are_never_saturation():
+    pacer = Pacer()
+    pacer.delay(4096, 0.00001)
+    assert all(pacer.delay(4096, 0.001) == 0 for _ in range(10))
+
+
+def test_backs_off_on_backlog():
+    backlog = [0.0]
+    pacer = Pacer(backlog=lambda: backlog[0])
+    assert pacer.delay(MB, 0.01) == 0
+    backlog[0] = 0.9
+    assert pacer.delay(MB, 0.01) == pacing.MIN_BACKOFF
+    assert pacer.delay(MB, 0.01) == 2 * pacing.MIN_BACKOFF
+
+
+def test_paced_volume(monkeypatch):
+    class Volume():
+        shared = True
+
+        def read(self, offset, size):
+            return bytes(size)
+
+        def close(self):
+            self.closed = True
+
+    paced = []
+    pacer = Pacer.unthrottled()
+    monkeypatch.setattr(pacer, 'pace', lambda nbytes, seconds: paced.append(nbytes))
+    volume = PacedVolume(Volume(), pacer)
+    assert volume.read(0, 100) == bytes(100) and volume.shared
+    assert paced == [100]
+    volume.close()
+    assert volume.volume.closed
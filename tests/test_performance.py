@@ -0,0 +1,77 @@
+import math
+
+import pytest
+from helpers import UNIT, make_image, make_source
+
+import telemetry
+from pacing import Pacer
+from performance import SAMPLE_INTERVAL, SAMPLE_WINDOW, PerformanceCalculator, Sampler
+from recoverability import Job, SourceFile
+
+
+class FakeClock():
+    """Stands in for the sampler's stop event and for time.monotonic(): waiting moves the time on at once."""
+
+    def __init__(self, waits=None):
+        self.now = 0.0
+        self.waits = waits
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, timeout):
+        self.now += timeout
+        self.waits -= 1
+        return self.waits < 0
+
+
+def test_sampler_samples_every_interval():
+    clock = FakeClock(waits=round(SAMPLE_WINDOW / SAMPLE_INTERVAL))
+    times = []
+    sampler = Sampler(lambda: times.append(clock.now))
+    sampler.stopped = clock
+    sampler._loop()
+    # one sample per interval, the last at the end of the window the GUI refreshes its estimates over
+    assert times == pytest.approx([n * SAMPLE_INTERVAL for n in range(1, len(times) + 1)])
+    assert len(times) == 50 and times[-1] == pytest.approx(SAMPLE_WINDOW)
+
+
+def test_sampler_stops():
+    sampler = Sampler(lambda: None, interval=0.01)
+    thread = sampler.start()
+    sampler.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_sample_progress(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(telemetry.time, 'monotonic', clock)
+    make_source(tmp_path / 'source.bin', 2, tail=100)
+    image = make_image(tmp_path / 'image.bin', 2048)
+    job = Job(str(tmp_path / 'image.bin'), len(image), [SourceFile(str(tmp_path / 'source.bin'), sector_size=UNIT)],
+              0, out_dir=str(tmp_path / 'out'), pacer=Pacer.unthrottled(), sector_size=UNIT)
+    skim = job.skim_reader
+    skim.perf = PerformanceCalculator(len(image), skim.stride)
+    assert skim.perf.total_sectors_to_read == 1024
+    job.telemetry.phase = 'skim'
+    published, skimmed = [], []
+    job.progress_signal.connect(published.append)
+    skim.progress_signal.connect(skimmed.append)
+    job.sample_progress()
+    assert skimmed == [0] and published[-1]['skim'] == 0 and published[-1]['done'] == 0
+    # nothing changed, so nothing is published, but the rates take the idle time in
+    clock.now = 1.0
+    job.sample_progress()
+    assert len(published) == len(skimmed) == 1
+    assert job.telemetry.read_rate.value == job.telemetry.probe_rate.value == 0
+    job.telemetry.bytes_read.add(4096)
+    skim.perf.add(256)
+    clock.now = 3.0
+    job.sample_progress()
+    assert skimmed == [0, 0.25] and published[-1]['skim'] == 0.25
+    # the 2 seconds since the last sample weigh 1 - e^(-2 / tau)
+    weight = 1 - math.exp(-2 / telemetry.DEFAULT_TAU)
+    assert job.telemetry.read_rate.value == pytest.approx(weight * 2048)
+    assert job.telemetry.probe_rate.value == pytest.approx(weight * 128)
+    job.files[0].close()
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from helpers import UNIT, make_image, make_source, output, run_job
+
+from pacing import Pacer
+from recoverability import Job, PredictiveReader, SourceFile
+
+
+def unstarted_job(tmp_path, units, extent_at, i):
+    """Return a job, not started, on an image holding a source of units units at unit extent_at, with unit i of
+    the source matched as by the skim."""
+    source = make_source(tmp_path / 'source.bin', units)
+    make_image(tmp_path / 'image.bin', 1024, [(extent_at, source)])
+    path = str(tmp_path / 'image.bin')
+    job = Job(path, os.path.getsize(path), [SourceFile(str(tmp_path / 'source.bin'), sector_size=UNIT)], 0,
+              out_dir=str(tmp_path / 'out'), calibrate=False, processes=0, pacer=Pacer.unthrottled(),
+              sector_size=UNIT, block_size=16 * UNIT)
+    assert job.check_unit((extent_at + i) * UNIT, source[i * UNIT:(i + 1) * UNIT]) == [(0, i)]
+    return job
+
+
+def test_prediction_grows_over_a_block(tmp_path):
+    job = unstarted_job(tmp_path, 64, 100, 10)
+    reader = PredictiveReader(job, 0, 10, 110 * UNIT)
+    reader.grow(100 * UNIT, forward=True)
+    reader.grow(100 * UNIT, forward=False)
+    assert (reader.start, reader.end) == (100 * UNIT, 164 * UNIT)
+    assert list(job.files[0].address_table) == [(100 + n) * UNIT for n in range(64)]
+    assert job.wait(5) and job.files[0].written
+
+
+def test_prediction_leaves_claimed_ranges_alone(tmp_path):
+    job = unstarted_job(tmp_path, 64, 100, 10)
+    other = object()
+    job.claim(130 * UNIT, 140 * UNIT, other)
+    reader = PredictiveReader(job, 0, 10, 110 * UNIT)
+    reader.grow(100 * UNIT, forward=True)
+    # stops where another reader is reading, and gives back what it claimed
+    assert reader.end == 130 * UNIT
+    assert job.claims.gaps(100 * UNIT, 200 * UNIT) == [(100 * UNIT, 130 * UNIT), (140 * UNIT, 200 * UNIT)]
+    assert 135 * UNIT not in job.covered
+    job.files[0].close()
+    job.files[0].close()
+
+
+@pytest.mark.parametrize('backend', ['file', 'mmap'])
+def test_sweep_carries_on_backwards(tmp_path, backend):
+    # a source in fragments of 4 units, 1 unit apart; the skim (every 33 units) first probes a gap inside them
+    # and then hits them far from their start, which only a sweep carried on backwards reaches
+    source = make_source(tmp_path / 'source.bin', 64)
+    pieces = [(966 + 5 * n, source[4 * n * UNIT:4 * (n + 1) * UNIT]) for n in range(16)]
+    make_image(tmp_path / 'image.bin', 4096, pieces)
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / 'out',
+                  block_size=16 * UNIT, backend=backend)
+    assert job.skim_reader.stride == 33 * UNIT
+    assert output(job.files[0]) == source
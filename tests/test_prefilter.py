@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+from helpers import UNIT, make_source
+
+import prefilter
+from sources import SourceFile, SectorIndex
+
+
+@pytest.fixture
+def source(tmp_path):
+    make_source(tmp_path / 'source.bin', 32)
+    file = SourceFile(str(tmp_path / 'source.bin'))
+    yield file
+    file.close()
+
+
+def batch(file):
+    rng = random.Random(3)
+    return [rng.randbytes(UNIT), file.sector(5), b'\x00' * UNIT, rng.randbytes(UNIT), file.sector(31), b'\xff' * UNIT]
+
+
+@pytest.mark.skipif(prefilter.np is None, reason='NumPy is not installed')
+def test_numpy_prefilter(source):
+    numpy_prefilter = prefilter.NumpyPrefilter(list(source.blocks()), UNIT)
+    assert numpy_prefilter.candidates(batch(source)) == [1, 4]
+    assert numpy_prefilter.candidates([]) == []
+
+
+def test_py_prefilter(source):
+    py_prefilter = prefilter.PyPrefilter(SectorIndex([source]), UNIT)
+    assert py_prefilter.candidates(batch(source)) == [1, 4]
+
+
+@pytest.mark.skipif(prefilter.np is None, reason='NumPy is not installed')
+def test_prefilter_keeps_meaningless_sources(tmp_path):
+    path = tmp_path / 'source.bin'
+    path.write_bytes(b'\x07' * UNIT + b'\x00' * UNIT)
+    file = SourceFile(str(path))
+    numpy_prefilter = prefilter.NumpyPrefilter(list(file.blocks()), UNIT)
+    sectors = [b'\x00' * UNIT, b'\x07' * UNIT]
+    assert numpy_prefilter.candidates(sectors) == [1]
+    assert numpy_prefilter.candidates(sectors, keep_meaningless=True) == [0, 1]
+    file.close()
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+import pytest
+from helpers import make_image, make_source, run_job
+
+from profiling import STAGES, Profiler, ProfiledLock, Trace
+
+
+@pytest.fixture
+def image(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 20, tail=100)
+    make_image(tmp_path / 'image.bin', 2048, [(300, source)])
+    return str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')]
+
+
+def test_chrome_trace_of_a_job(image, tmp_path):
+    job = run_job(*image, tmp_path / 'out', trace_path=str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as f:
+        events = json.load(f)['traceEvents']
+    threads = {event['tid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    spans = [event for event in events if event['ph'] != 'M']
+    assert threads and all(event['name'] == 'thread_name' for event in events if event['ph'] == 'M')
+    assert spans and all(event['ph'] == 'X' and event['tid'] in threads for event in spans)
+    assert all(event['name'] in STAGES and event['ts'] >= 0 and event['dur'] >= 0 for event in spans)
+    # every span is kept, but those of threads still winding down once the trace is written on shutdown are
+    # missing
+    stats = job.profiler.stats()
+    for stage in ('read', 'match', 'lock', 'emit'):
+        assert 0 < sum(event['name'] == stage for event in spans) <= stats[stage]['calls']
+    assert stats['read']['items'] >= 20 * 512
+
+
+def test_json_timelines_of_a_job(image, tmp_path):
+    job = run_job(*image, tmp_path / 'out', trace_path=str(tmp_path / 'trace.json'), trace_format='json',
+                  trace_sample=3)
+    with open(tmp_path / 'trace.json') as f:
+        trace = json.load(f)
+    assert trace['sample'] == 3
+    spans = [span for thread in trace['threads'] for span in thread['spans']]
+    assert all(stage in STAGES and start >= 0 and seconds >= 0 for stage, start, seconds in spans)
+    assert len({thread['id'] for thread in trace['threads']}) == len(trace['threads'])
+    # one in three spans of each thread is kept
+    calls = sum(stats['calls'] for stats in job.profiler.stats().values())
+    assert 0 < len(spans) <= calls // 3
+
+
+def test_trace_keeps_a_sample_up_to_the_limit():
+    trace = Trace('unused', sample=2, limit=3)
+    for n in range(10):
+        trace.add('read', n, n + 1)
+    (_, _, spans), = trace.timelines
+    assert [start for _, start, _ in spans] == [5, 7, 9]
+    with pytest.raises(ValueError):
+        Trace('unused', 'csv')
+
+
+def test_profiled_lock_counts_the_wait():
+    profiler = Profiler()
+    lock = ProfiledLock(profiler)
+    held = threading.Event()
+
+    def hold():
+        with lock:
+            held.set()
+            time.sleep(0.2)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    with lock:
+        pass
+    thread.join()
+    stats = profiler.stats()['lock']
+    # the holder got it at once; the waiter's time is the rest of the holder's sleep
+    assert stats['calls'] == stats['items'] == 2
+    assert 0.1 < stats['seconds'] < 1
+    assert profiler.stats()['match']['calls'] == 0
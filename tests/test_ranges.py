@@ -0,0 +1,97 @@
+import random
+
+from ranges import IntervalMap, RangeSet
+
+
+def test_range_set():
+    ranges = RangeSet([(10, 20), (30, 40)])
+    ranges.add(20, 25)      # touching ranges merge
+    assert ranges.as_list() == [[10, 25], [30, 40]]
+    ranges.add(5, 35)
+    assert ranges.as_list() == [[5, 40]]
+    ranges.remove(10, 20)
+    assert ranges.as_list() == [[5, 10], [20, 40]]
+    assert 9 in ranges and 10 not in ranges and 39 in ranges and 40 not in ranges
+    assert ranges.span(25) == (20, 40) and ranges.span(15) is None
+    assert ranges.gaps(0, 50) == [(0, 5), (10, 20), (40, 50)]
+    assert ranges.intersection(8, 30) == [(8, 10), (20, 30)]
+    assert ranges.total() == 25 and len(ranges) == 2
+    ranges.add(7, 7)
+    ranges.remove(50, 60)
+    assert ranges.as_list() == [[5, 10], [20, 40]]
+
+
+def test_range_set_matches_a_set_of_addresses():
+    rng = random.Random(1)
+    ranges = RangeSet()
+    addresses = set()
+    for _ in range(500):
+        start = rng.randrange(200)
+        end = start + rng.randrange(1, 20)
+        if rng.random() < 0.6:
+            ranges.add(start, end)
+            addresses.update(range(start, end))
+        else:
+            ranges.remove(start, end)
+            addresses.difference_update(range(start, end))
+        # disjoint, non-adjacent and sorted
+        flat = [x for r in ranges.as_list() for x in r]
+        assert all(a < b for a, b in zip(flat, flat[1:]))
+    assert {a for a in range(250) if a in ranges} == addresses
+    assert ranges.total() == len(addresses)
+    assert [a for s, e in ranges.gaps(0, 250) for a in range(s, e)] == [a for a in range(250) if a not in addresses]
+
+
+def test_interval_map():
+    claims = IntervalMap()
+    a, b = object(), object()
+    claims.add(10, 20, a)
+    claims.add(15, 30, b)
+    claims.add(40, 50, a)
+    claims.add(5, 5, b)     # empty, ignored
+    assert len(claims) == 3
+    assert [owner for _, _, owner in claims.overlapping(18, 19)] == [a, b]
+    assert claims.overlapping(30, 40) == []
+    assert 29 in claims and 30 not in claims
+    assert claims.gaps(0, 60) == [(0, 10), (30, 40), (50, 60)]
+    claims.remove(a)
+    assert claims.gaps(0, 60) == [(0, 15), (30, 60)]
+    claims.remove(a)
+    assert len(claims) == 1
+
+
+def test_interval_map_overlaps_like_a_scan():
+    rng = random.Random(2)
+    claims = IntervalMap()
+    owners = [object() for _ in range(5)]
+    intervals = []
+    for _ in range(300):
+        if rng.random() < 0.8:
+            start = rng.randrange(1000)
+            interval = (start, start + rng.randrange(1, 100), rng.choice(owners))
+            claims.add(*interval)
+            intervals.append(interval)
+        else:
+            owner = rng.choice(owners)
+            claims.remove(owner)
+            intervals = [interval for interval in intervals if interval[2] is not owner]
+        start = rng.randrange(1000)
+        end = start + rng.randrange(1, 50)
+        key = lambda interval: (interval[0], interval[1], id(interval[2]))
+        expected = [interval for interval in intervals if interval[0] < end and interval[1] > start]
+        found = claims.overlapping(start, end)
+        assert [s for s, _, _ in found] == sorted(s for s, _, _ in found)
+        assert sorted(found, key=key) == sorted(expected, key=key)
+
+
+def test_interval_map_behind_a_long_interval():
+    # a long interval keeps the largest end high for everything after it
+    claims = IntervalMap()
+    long, short = object(), object()
+    claims.add(0, 10000, long)
+    for start in range(10, 10000, 10):
+        claims.add(start, start + 5, short)
+    assert claims.overlapping(5003, 5007) == [(0, 10000, long), (5000, 5005, short)]
+    assert claims.overlapping(5006, 5010) == [(0, 10000, long)]
+    claims.remove(long)
+    assert claims.gaps(5000, 5020) == [(5005, 5010), (5015, 5020)]
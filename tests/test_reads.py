@@ -0,0 +1,42 @@
+import mmap
+
+import pytest
+from helpers import UNIT, make_image
+
+from reads import FileVolume, MmapVolume, iter_sectors, iter_span
+
+
+@pytest.fixture(params=['file', 'mmap'])
+def volume(request, tmp_path):
+    # an image that doesn't end on a whole unit
+    image = bytes(make_image(tmp_path / 'image.bin', 600)) + b'end'
+    (tmp_path / 'image.bin').write_bytes(image)
+    if request.param == 'file':
+        volume = FileVolume(str(tmp_path / 'image.bin'))
+    else:
+        # small windows, so reads straddle them and windows are evicted
+        volume = MmapVolume(str(tmp_path / 'image.bin'), window_size=mmap.ALLOCATIONGRANULARITY, max_windows=2)
+    yield volume, image
+    volume.close()
+
+
+@pytest.mark.parametrize('stride', [UNIT, 3 * UNIT, 7 * UNIT + 100, 200 * UNIT])
+def test_iter_sectors_matches_plain_slicing(volume, stride):
+    volume, image = volume
+    for start in (0, 5 * UNIT + 7):
+        expected = [(offset, image[offset:offset + UNIT]) for offset in range(start, len(image), stride)
+                    if offset + UNIT <= len(image)]
+        found = [(offset, bytes(sector)) for offset, sector in
+                 iter_sectors(volume, start, len(image), stride, block_size=16 * UNIT, span_stride_limit=4 * UNIT)]
+        assert found == expected
+
+
+def test_iter_span_blocks_are_aligned(volume):
+    volume, image = volume
+    blocks = list(iter_span(volume, 3 * UNIT, 100 * UNIT, 16 * UNIT, UNIT, origin=UNIT))
+    # the first block runs up to the next boundary counted from origin
+    assert [(offset, len(block)) for offset, block in blocks[:2]] == [(3 * UNIT, 14 * UNIT), (17 * UNIT, 16 * UNIT)]
+    assert b''.join(bytes(block) for _, block in blocks) == image[3 * UNIT:100 * UNIT]
+    # reads stop at the end of the image, rounded up to whole units
+    blocks = list(iter_span(volume, 590 * UNIT, 700 * UNIT, 16 * UNIT, UNIT))
+    assert b''.join(bytes(block) for _, block in blocks) == image[590 * UNIT:]
@@ -0,0 +1,34 @@
+from helpers import UNIT, make_image, make_source, output, run_job
+
+import shards
+
+
+def test_wrap():
+    assert shards.wrap(4096, 8192, 0) == [(4096, 8192), (0, 4096)]
+    assert shards.wrap(512, 8192, 512) == [(512, 8192)]
+    assert shards.wrap(8192, 8192, 0) == [(0, 8192)]
+
+
+def test_split():
+    assert shards.split(0, 5 * UNIT, 2 * UNIT, UNIT) == [(0, 1024), (1024, 2048), (2048, 2560)]
+    # shard sizes are rounded down to whole units
+    assert shards.split(0, 4 * UNIT, 3 * UNIT - 1, UNIT) == [(0, 1024), (1024, 2048)]
+
+
+def test_sharded_scan(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 300, tail=100)
+    image = tmp_path / 'image.bin'
+    make_image(image, 4096, [(700, source[:150 * UNIT]), (2000, source[150 * UNIT:])])
+    job = run_job(str(image), [str(tmp_path / 'source.bin')], tmp_path / 'out', processes=2)
+    assert job.files[0].written
+    assert output(job.files[0]) == source
+
+
+def test_sharded_scan_wraps_around(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 64)
+    image = tmp_path / 'image.bin'
+    make_image(image, 4096, [(100, source)])
+    # the file lies before the start address, so only the part of the scan after the wrap-around finds it
+    job = run_job(str(image), [str(tmp_path / 'source.bin')], tmp_path / 'out', start=2048 * UNIT, processes=2)
+    assert job.files[0].written
+    assert output(job.files[0]) == source
@@ -0,0 +1,85 @@
+import time
+
+from helpers import UNIT, make_image, make_source, output, run_job
+
+from sources import SourceFile, SectorIndex, UNMATCHED, digest
+
+
+def test_source_file(tmp_path):
+    data = make_source(tmp_path / 'source.bin', 5, tail=100)
+    file = SourceFile(str(tmp_path / 'source.bin'))
+    assert file.total_sectors == 5
+    assert file.tail_length == 100
+    assert file.sector(1) == data[UNIT:2 * UNIT]
+    # the last sector is padded with zeroes
+    assert file.sector(4) == data[4 * UNIT:].ljust(UNIT, b'\x00')
+    assert b''.join(file.blocks(2 * UNIT)) == data.ljust(5 * UNIT, b'\x00')
+    assert list(file.digests) == [digest(file.sector(i)) for i in range(5)]
+    assert list(file.address_table) == [UNMATCHED] * 5
+    file.close()
+    file.close()
+
+
+def test_meaningless_sectors_are_not_counted(tmp_path):
+    path = tmp_path / 'source.bin'
+    path.write_bytes(b'\x01' * UNIT + b'\x00' * UNIT + b'\xff' * UNIT)
+    file = SourceFile(str(path))
+    assert file.meaningful_sectors == 1
+    file.close()
+
+
+def test_index_retires_each_copy_once(tmp_path):
+    path = tmp_path / 'source.bin'
+    a, b = b'\x01' * UNIT, b'\x02' * UNIT
+    path.write_bytes(a + b + a)
+    file = SourceFile(str(path))
+    index = SectorIndex([file])
+    assert a in index and b'\x03' * UNIT not in index
+    assert index.retire(a, 4096) == [(0, 0)]
+    assert index.retire(a, 8192) == [(0, 2)]
+    assert index.retire(a, 0) == []
+    assert index.restore(0, 1, 512) and not index.restore(0, 1, 0)
+    assert index.remaining_meaningful == [0]
+    # entered in the table by the same call that retires them
+    assert list(file.address_table) == [4096, 512, 8192]
+    file.close()
+
+
+def test_job_closes_its_sources(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 16)
+    make_image(tmp_path / 'image.bin', 256, [(40, source)])
+    # a source split into other units than the job's is replaced, and the one given closed
+    given = SourceFile(str(tmp_path / 'source.bin'), sector_size=2 * UNIT)
+    job = run_job(str(tmp_path / 'image.bin'), [], tmp_path / 'out', files=[given])
+    assert job.files[0].written
+    assert given.fobj.closed
+    deadline = time.monotonic() + 5
+    while not job.files[0].fobj.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.files[0].fobj.closed and job.files[0].map.closed
+
+
+def test_index_fills_the_table_before_a_file_runs_out(tmp_path):
+    path = tmp_path / 'source.bin'
+    path.write_bytes(bytes(range(256)) * 8 + b'\x00' * UNIT)
+    file = SourceFile(str(path))
+    index = SectorIndex([file])
+    assert index.restore_run(0, 0, 5, 1024) == [0, 1, 2, 3, 4]
+    assert index.remaining_meaningful == [0]
+    assert list(file.address_table) == [1024 + n * UNIT for n in range(5)]
+    file.close()
+
+
+def test_one_pass_finds_two_sources(tmp_path):
+    first = make_source(tmp_path / 'first.bin', 24, seed=1, tail=100)
+    second = make_source(tmp_path / 'second.bin', 16, seed=3)
+    make_image(tmp_path / 'image.bin', 2048, [(1500, first), (200, second)])
+    finished = []
+    job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'first.bin'), str(tmp_path / 'second.bin')],
+                  tmp_path / 'out', setup=lambda job: job.file_finished_signal.connect(finished.append))
+    assert sorted(finished) == [(0, True, 0), (1, True, 0)]
+    # each file has its own table, pointing at its own copy, and its own output
+    assert list(job.files[0].address_table) == [(1500 + i) * UNIT for i in range(24)]
+    assert list(job.files[1].address_table) == [(200 + i) * UNIT for i in range(16)]
+    assert job.files[0].rebuilt_file_path != job.files[1].rebuilt_file_path
+    assert output(job.files[0]) == first and output(job.files[1]) == second
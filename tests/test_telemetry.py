@@ -0,0 +1,91 @@
+import json
+import math
+import threading
+
+import pytest
+from helpers import UNIT, make_image, make_source, run_job
+
+from pacing import Pacer
+from recoverability import Job, SourceFile
+from telemetry import Counter, Level, Rate
+
+
+def test_counter_adds_from_every_thread():
+    counter = Counter()
+    threads = [threading.Thread(target=lambda: [counter.add(2) for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.add()
+    assert counter.value == 8001 and len(counter.cells) == 5
+
+
+def test_rate_is_weighted_by_time():
+    rate = Rate(tau=10)
+    rate.seed(50)
+    rate.update(0, 0)
+    assert rate.value == 50
+    rate.update(100, 1)
+    assert rate.value == pytest.approx(50 + (1 - math.exp(-0.1)) * 50)
+    # samples covering more time weigh more, however they are spaced
+    one, two = Rate(tau=10), Rate(tau=10)
+    for r in (one, two):
+        r.update(0, 0)
+        r.update(0, 1)
+    one.update(1000, 11)
+    for t in range(2, 12):
+        two.update(100 * (t - 1), t)
+    assert one.value == pytest.approx(two.value)
+    # time spent inactive doesn't count
+    rate = Rate()
+    rate.update(0, 0)
+    rate.update(10, 1)
+    rate.update(10, 100, active=False)
+    rate.update(20, 101)
+    assert rate.value == pytest.approx(10)
+    rate.seed(1)
+    assert rate.value == pytest.approx(10)
+
+
+def test_level():
+    level = Level(tau=1)
+    level.update(4, 0)
+    level.update(0, 1)
+    assert level.value == pytest.approx(4 * math.exp(-1))
+
+
+def test_metrics_export(tmp_path):
+    source = make_source(tmp_path / 'source.bin', 20, tail=100)
+    make_image(tmp_path / 'image.bin', 2048, [(300, source)])
+    for name in ('metrics.json', 'metrics.prom'):
+        job = run_job(str(tmp_path / 'image.bin'), [str(tmp_path / 'source.bin')], tmp_path / 'out',
+                      metrics_path=str(tmp_path / name))
+        assert job.telemetry.current_phase == 'finished'
+    with open(tmp_path / 'metrics.json') as f:
+        snapshot = json.load(f)
+    assert snapshot['phase'] == 'finished' and snapshot['matched_sectors'] == snapshot['total_sectors'] == 20
+    assert snapshot['bytes_read'] > 0 and snapshot['eta_seconds']['total'] == 0
+    with open(tmp_path / 'metrics.prom') as f:
+        text = f.read()
+    assert '# TYPE recoverability_bytes_read_total counter' in text
+    assert 'recoverability_matched_sectors_total{job="' + job.dir_name + '"} 20.0' in text
+    assert 'phase="finished"} 1.0' in text and 'phase="skim"} 0.0' in text
+
+
+def test_eta_counts_what_the_skim_has_left(tmp_path):
+    make_source(tmp_path / 'source.bin', 2, tail=100)
+    image = make_image(tmp_path / 'image.bin', 2048)
+    path = str(tmp_path / 'image.bin')
+    job = Job(path, len(image), [SourceFile(str(tmp_path / 'source.bin'), sector_size=UNIT)], 0,
+              out_dir=str(tmp_path / 'out'), pacer=Pacer.unthrottled(), sector_size=UNIT)
+    telemetry = job.telemetry
+    telemetry.phase = 'skim'
+    stride = job.skim_reader.stride
+    job.skim_reader.checked_to = len(image) // 2
+    job.covered.add(0, len(image) // 2)
+    assert telemetry.eta()['skim'] is None
+    telemetry.probe_rate.seed(10)
+    eta = telemetry.eta()
+    assert eta['skim'] == pytest.approx(len(image) // 2 // stride / 10) and eta['total'] == eta['skim']
+    job.files[0].close()